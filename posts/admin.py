@@ -1,15 +1,173 @@
+import datetime
+
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models import Max, Min, QuerySet
+from django.utils import timezone
+from django.utils.functional import cached_property
 
 from posts.models import Comment, Group, Post
 
+# Ниже этого числа строк точный COUNT(*) достаточно дешёвый.
+ESTIMATE_THRESHOLD = 100_000
+
+
+def estimate_count(model):
+    """Приблизительное число строк таблицы без полного прохода."""
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                'SELECT reltuples FROM pg_class WHERE relname = %s', [table])
+            row = cursor.fetchone()
+            return int(row[0]) if row and row[0] > 0 else None
+        if connection.vendor == 'sqlite':
+            # MAX(rowid) берётся из B-дерева за один поиск; удалённые строки
+            # дают завышенную оценку, что для пагинатора приемлемо.
+            cursor.execute(
+                f'SELECT MAX(rowid) FROM {connection.ops.quote_name(table)}')
+            return cursor.fetchone()[0]
+    return None
+
+
+class EstimatedCountPaginator(Paginator):
+    """Для большой таблицы без фильтров берёт оценку числа строк вместо
+    COUNT(*); отфильтрованные списки считаются точно."""
+
+    @cached_property
+    def count(self):
+        query = self.object_list.query
+        if not query.where:
+            estimate = estimate_count(self.object_list.model)
+            if estimate is not None and estimate >= ESTIMATE_THRESHOLD:
+                return estimate
+        return super().count
+
+
+class IndexedDatesQuerySet(QuerySet):
+    """QuerySet для date_hierarchy, который обходится поисками по индексу.
+
+    MIN и MAX считаются отдельными запросами с ORDER BY ... LIMIT 1, а
+    списки лет, месяцев и дней строятся из проверок exists() по
+    диапазонам вместо SELECT DISTINCT по всей таблице.
+    """
+
+    def _edge(self, field_name, last):
+        ordering = f'-{field_name}' if last else field_name
+        return self.filter(**{f'{field_name}__isnull': False}).order_by(
+            ordering).values_list(field_name, flat=True).first()
+
+    def aggregate(self, *args, **kwargs):
+        edges = {}
+        for alias, aggregate in kwargs.items():
+            expressions = aggregate.get_source_expressions()
+            if (args or type(aggregate) not in (Min, Max)
+                    or aggregate.filter is not None
+                    or len(expressions) != 1
+                    or not hasattr(expressions[0], 'name')):
+                return super().aggregate(*args, **kwargs)
+            edges[alias] = (expressions[0].name, type(aggregate) is Max)
+        return {alias: self._edge(field_name, last)
+                for alias, (field_name, last) in edges.items()}
+
+    def datetimes(self, field_name, kind, order='ASC', tzinfo=None,
+                  is_dst=None):
+        if kind not in ('year', 'month', 'day'):
+            return super().datetimes(field_name, kind, order, tzinfo, is_dst)
+        first = self._edge(field_name, last=False)
+        if first is None:
+            return []
+        tzinfo = tzinfo or timezone.get_current_timezone()
+        first = timezone.localtime(first, tzinfo)
+        last = timezone.localtime(self._edge(field_name, last=True), tzinfo)
+        buckets = []
+        start = _truncate(first, kind, tzinfo)
+        while start <= last:
+            end = _next(start, kind, tzinfo)
+            if self.filter(**{f'{field_name}__gte': start,
+                              f'{field_name}__lt': end}).exists():
+                buckets.append(start)
+            start = end
+        return buckets if order == 'ASC' else buckets[::-1]
+
+
+def _truncate(value, kind, tzinfo):
+    value = value.replace(hour=0, minute=0, second=0, microsecond=0,
+                          tzinfo=None)
+    if kind in ('year', 'month'):
+        value = value.replace(day=1)
+    if kind == 'year':
+        value = value.replace(month=1)
+    return timezone.make_aware(value, tzinfo)
+
+
+def _next(value, kind, tzinfo):
+    value = timezone.make_naive(value, tzinfo)
+    if kind == 'day':
+        value += datetime.timedelta(days=1)
+    elif kind == 'month' and value.month == 12:
+        value = value.replace(year=value.year + 1, month=1)
+    elif kind == 'month':
+        value = value.replace(month=value.month + 1)
+    else:
+        value = value.replace(year=value.year + 1)
+    return timezone.make_aware(value, tzinfo)
+
+
+class AuthorFilter(admin.SimpleListFilter):
+    """Фильтр по имени автора через поле ввода вместо списка всех
+    пользователей."""
+    title = 'автору'
+    parameter_name = 'author'
+    template = 'admin/input_filter.html'
+
+    def lookups(self, request, model_admin):
+        return ()
+
+    def has_output(self):
+        return True
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(author__username=self.value().strip())
+        return queryset
+
+    def choices(self, changelist):
+        yield {
+            'selected': self.value() is None,
+            'query_string': changelist.get_query_string(
+                remove=[self.parameter_name]),
+            'query_parts': [
+                (key, value)
+                for key, value in changelist.get_filters_params().items()
+                if key != self.parameter_name
+            ],
+            'display': 'Все',
+        }
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Настройки списка для таблиц на миллионы строк."""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    empty_value_display = '-пусто-'
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        return IndexedDatesQuerySet(
+            queryset.model, queryset.query, queryset.db)
+
 
 @admin.register(Post)
-class PostAdmin(admin.ModelAdmin):
-    list_display = ('pk', 'text', 'pub_date', 'author', 'group')
+class PostAdmin(LargeTableAdmin):
+    list_display = ('pk', 'text', 'pub_date', 'author', 'group',
+                    'comments_count')
+    list_select_related = ('author', 'group')
+    autocomplete_fields = ('author', 'group')
     search_fields = ('text',)
-    list_filter = ('pub_date', 'author')
+    list_filter = ('pub_date', AuthorFilter)
     date_hierarchy = 'pub_date'
-    empty_value_display = '-пусто-'
 
 
 @admin.register(Group)
@@ -21,9 +179,10 @@ class GroupAdmin(admin.ModelAdmin):
 
 
 @admin.register(Comment)
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(LargeTableAdmin):
     list_display = ('pk', 'post', 'text', 'created', 'author')
+    list_select_related = ('post', 'author')
+    autocomplete_fields = ('post', 'author')
     search_fields = ('text',)
-    list_filter = ('created', 'author')
+    list_filter = ('created', AuthorFilter)
     date_hierarchy = 'created'
-    empty_value_display = '-пусто-'
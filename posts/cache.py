@@ -0,0 +1,237 @@
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.utils.cache import (
+    get_conditional_response, patch_cache_control, patch_vary_headers)
+from django.utils.http import http_date, quote_etag
+
+from posts.replicas import used_replica
+
+PAGE_VERSION_KEY = 'page_cache:version'
+PAGE_MODIFIED_KEY = 'page_cache:modified'
+PAGE_HITS_KEY = 'page_cache:hits'
+PAGE_MISSES_KEY = 'page_cache:misses'
+POST_CARD_FRAGMENT = 'post_card'
+# Версия, от которой зависят все страницы: для массовых изменений.
+ALL_PAGES = 'all'
+
+
+def _incr(key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, None)
+        return cache.incr(key)
+
+
+def _initial_version():
+    # На версии построены ETag, которые хранят браузеры, поэтому после
+    # очистки кеша счётчик не должен повторять уже выданные значения.
+    return int(time.time() * 1000)
+
+
+def post_scope(post_id):
+    return f'post:{post_id}'
+
+
+def author_scope(username):
+    return f'author:{username}'
+
+
+def group_scope(slug):
+    return f'group:{slug}'
+
+
+def _scopes(kwargs):
+    """Страница записи зависит от записи и её автора, профиль - от
+    автора, страница сообщества - от сообщества; у остальных страниц
+    (ленты, поиск) общая версия."""
+    scopes = []
+    if 'post_id' in kwargs:
+        scopes.append(post_scope(kwargs['post_id']))
+    if 'username' in kwargs:
+        scopes.append(author_scope(kwargs['username']))
+    if 'slug' in kwargs:
+        scopes.append(group_scope(kwargs['slug']))
+    return [*scopes, ALL_PAGES] if scopes else [None]
+
+
+def _version_key(scope):
+    return f'{PAGE_VERSION_KEY}:{scope}' if scope else PAGE_VERSION_KEY
+
+
+def _modified_key(scope):
+    return f'{PAGE_MODIFIED_KEY}:{scope}' if scope else PAGE_MODIFIED_KEY
+
+
+def page_versions(scopes):
+    """Версии страниц scopes и время последнего изменения любой из них."""
+    version_keys = [_version_key(scope) for scope in scopes]
+    modified_keys = [_modified_key(scope) for scope in scopes]
+    values = cache.get_many(version_keys + modified_keys)
+    versions = []
+    for key in version_keys:
+        version = values.get(key)
+        if version is None:
+            cache.add(key, _initial_version(), None)
+            version = cache.get(key, 1)
+        versions.append(version)
+    modified = [values[key] for key in modified_keys if key in values]
+    return versions, max(modified, default=None)
+
+
+def page_version():
+    """Общая версия лент и поиска."""
+    return page_versions([None])[0][0]
+
+
+def bump_page_version(*scopes):
+    """Делает устаревшими закешированные страницы scopes, а без
+    аргументов - ленты и поиск."""
+    scopes = scopes or (None,)
+    for scope in scopes:
+        key = _version_key(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, _initial_version(), None)
+            cache.incr(key)
+    now = time.time()
+    cache.set_many({_modified_key(scope): now for scope in scopes}, None)
+
+
+def bump_all_pages():
+    """Делает устаревшими все страницы, например после загрузки данных."""
+    bump_page_version(None, ALL_PAGES)
+
+
+def invalidate_post_cards(post_ids):
+    """Удаляет общую для всех читателей часть карточек записей."""
+    cache.delete_many([
+        make_template_fragment_key(POST_CARD_FRAGMENT, [post_id])
+        for post_id in post_ids
+    ])
+
+
+def page_cache_stats():
+    hits = cache.get(PAGE_HITS_KEY, 0)
+    misses = cache.get(PAGE_MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'ratio': hits / total if total else 0.0,
+    }
+
+
+def _cached_page(request, scopes):
+    """Ключ страницы, ответ из кеша и время последнего изменения; ключ
+    None, если страницу для этого запроса не кешируем."""
+    if (request.method not in ('GET', 'HEAD')
+            or request.user.is_authenticated):
+        return None, None, None
+    versions, modified = page_versions(scopes)
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    key = f'page_cache:{":".join(map(str, versions))}:{path}'
+    response = cache.get(key)
+    _incr(PAGE_HITS_KEY if response is not None else PAGE_MISSES_KEY)
+    return key, response, modified
+
+
+def _replica_may_lag(modified):
+    """Страница прочитана с реплики вскоре после изменения и может его
+    ещё не содержать; под ключом и ETag новой версии её хранить нельзя."""
+    return (used_replica() and modified is not None
+            and time.time() - modified < settings.REPLICA_PIN_SECONDS)
+
+
+def _store_page(key, response, modified):
+    if (key is not None and response.status_code == 200
+            and not response.streaming and not response.cookies
+            and not _replica_may_lag(modified)):
+        cache.set(key, response, settings.PAGE_CACHE_TIMEOUT)
+
+
+def cache_anonymous_page(view):
+    """Кеширует ответ целиком для неавторизованных посетителей.
+
+    Ключ строится из версий страницы и пути с query string. Версии
+    увеличиваются после коммита изменений, от которых страница зависит
+    (см. _scopes), поэтому изменения видны сразу, без ожидания TTL.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key, response, modified = _cached_page(request, _scopes(kwargs))
+        if response is not None:
+            return response
+        response = view(request, *args, **kwargs)
+        _store_page(key, response, modified)
+        return response
+    return wrapper
+
+
+def _page_validators(request, scopes):
+    """ETag и Last-Modified страницы без обращений к базе.
+
+    ETag строится из версий объектов страницы и cookie сессии и CSRF:
+    вход, выход и смена CSRF-токена меняют разметку страницы, а
+    пользователя при этом загружать не нужно. Last-Modified - время
+    последнего изменения этих объектов.
+    """
+    versions, modified = page_versions(scopes)
+    cookies = (request.COOKIES.get(settings.SESSION_COOKIE_NAME, ''),
+               request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''))
+    digest = hashlib.md5(':'.join(
+        [*map(str, versions), *cookies]).encode()).hexdigest()
+    return quote_etag(digest), modified
+
+
+def _not_modified(request, scopes):
+    if request.method not in ('GET', 'HEAD'):
+        return None, None, None
+    etag, modified = _page_validators(request, scopes)
+    response = get_conditional_response(
+        request, etag=etag, last_modified=modified and int(modified))
+    if response is not None:
+        _add_validators(request, response, etag, modified)
+    return response, etag, modified
+
+
+def _add_validators(request, response, etag, modified):
+    if (etag is None or response.status_code not in (200, 304)
+            or _replica_may_lag(modified)):
+        return response
+    response.headers.setdefault('ETag', etag)
+    # Last-Modified точен до секунды: пока идёт секунда последнего
+    # изменения, в неё может попасть ещё одно, и If-Modified-Since его
+    # не заметит. Такие страницы проверяются только по ETag.
+    if modified and time.time() - modified >= 1:
+        response.headers.setdefault('Last-Modified', http_date(modified))
+    # Без no-cache браузер по Last-Modified сам решил бы, сколько
+    # показывать страницу без проверки.
+    patch_cache_control(response, no_cache=True)
+    if settings.SESSION_COOKIE_NAME in request.COOKIES:
+        patch_cache_control(response, private=True)
+    patch_vary_headers(response, ('Cookie',))
+    return response
+
+
+def conditional_page(view):
+    """Отвечает 304 без построения страницы, если она не менялась с
+    прошлого запроса этого посетителя (If-None-Match, If-Modified-Since).
+
+    Как и django.views.decorators.http.condition, но валидаторы не
+    требуют запросов к базе.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        response, etag, modified = _not_modified(request, _scopes(kwargs))
+        if response is not None:
+            return response
+        response = view(request, *args, **kwargs)
+        return _add_validators(request, response, etag, modified)
+    return wrapper
@@ -0,0 +1,55 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from posts.models import AuthorStats, Comment, Follow, Post
+
+User = get_user_model()
+
+
+def _count(queryset, field):
+    counts = queryset.filter(**{field: OuterRef('pk')}).order_by().values(
+        field).annotate(total=Count('pk')).values('total')
+    return Coalesce(Subquery(counts), 0)
+
+
+def _add(field, delta):
+    # Счётчики не уходят в минус, даже если успели разойтись с данными.
+    return Greatest(F(field) + delta, 0)
+
+
+def bump_comments(post_id, delta):
+    Post.objects.filter(pk=post_id).update(
+        comments_count=_add('comments_count', delta))
+
+
+def bump_author(user_id, **deltas):
+    AuthorStats.objects.filter(user_id=user_id).update(**{
+        field: _add(field, delta) for field, delta in deltas.items()
+    })
+
+
+def recount_comments(posts=None):
+    posts = Post.objects.all() if posts is None else posts
+    return posts.update(comments_count=_count(Comment.objects, 'post'))
+
+
+def recount_authors(users=None):
+    users = User.objects.all() if users is None else users
+    AuthorStats.objects.bulk_create(
+        [AuthorStats(user_id=pk) for pk in users.filter(
+            stats__isnull=True).values_list('pk', flat=True).iterator()],
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+    return AuthorStats.objects.filter(user__in=users).update(
+        posts_count=_count(Post.objects, 'author'),
+        followers_count=_count(Follow.objects, 'author'),
+        following_count=_count(Follow.objects, 'user'),
+    )
+
+
+@transaction.atomic
+def recount():
+    return recount_comments(), recount_authors()
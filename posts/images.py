@@ -0,0 +1,232 @@
+import base64
+import hashlib
+import io
+import tempfile
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation, ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import UploadedFile
+from PIL import Image, ImageFilter, ImageOps, features
+
+from posts import storage
+from posts.models import Post
+
+# Ширины производных в пикселях и пропорции карточки (как у 1024x480).
+WIDTHS = (320, 640, 1024)
+ASPECT = 480 / 1024
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+# Форматы, которые можно уменьшать без потери (анимированный GIF нельзя).
+RESIZABLE = {'JPEG': {'quality': 90}, 'PNG': {'optimize': True},
+             'WEBP': {'quality': 90}}
+PLACEHOLDER_SIDE = 16
+# Значения EXIF Orientation, при которых ширина и высота меняются местами.
+TRANSPOSED = {5, 6, 7, 8}
+SIZES = '(max-width: 1024px) 100vw, 1024px'
+DERIVATIVES_DIR = 'posts/derivatives'
+# Только JPEG умеет декодироваться сразу в уменьшенном масштабе (draft).
+DRAFTABLE = {'JPEG'}
+
+
+def _formats():
+    # Pillow может быть собран без libwebp, тогда остаётся только JPEG.
+    return {key: value for key, value in FORMATS.items()
+            if key != 'webp' or features.check('webp')}
+
+
+def _save(content, extension):
+    """Сохраняет файл под именем из хеша содержимого; одинаковые
+    производные хранятся один раз."""
+    digest = hashlib.sha256(content).hexdigest()[:20]
+    name = f'{DERIVATIVES_DIR}/{digest[:2]}/{digest}.{extension}'
+    if default_storage.exists(name) and storage.touch(
+            default_storage.path(name)):
+        return name
+    return default_storage.save(name, ContentFile(content))
+
+
+def build_derivatives(name):
+    """Создаёт кадрированные копии изображения нескольких ширин в WebP
+    (если Pillow собран с ним) и JPEG и возвращает манифест для srcset.
+
+    Ширины больше исходной не создаются, кроме самой маленькой.
+    """
+    with default_storage.open(name) as source:
+        image = ImageOps.exif_transpose(Image.open(source))
+        image = image.convert('RGB')
+    formats = _formats()
+    widths = [width for width in WIDTHS if width <= image.width]
+    widths = widths or [WIDTHS[0]]
+    manifest = {
+        'source': name,
+        'width': widths[-1],
+        'height': round(widths[-1] * ASPECT),
+        'formats': {key: [] for key in formats},
+    }
+    for width in widths:
+        resized = ImageOps.fit(
+            image, (width, round(width * ASPECT)), Image.LANCZOS)
+        for key, (image_format, options) in formats.items():
+            buffer = io.BytesIO()
+            resized.save(buffer, image_format, **options)
+            manifest['formats'][key].append(
+                [width, _save(buffer.getvalue(), key)])
+    return manifest
+
+
+def derivative_names(manifest):
+    return [name for variants in (manifest or {}).get('formats', {}).values()
+            for _, name in variants]
+
+
+def release_derivatives(manifest):
+    """Удаляет производные из манифеста, если его исходное изображение
+    больше не нужно ни одной записи. Возвращает число удалённых файлов."""
+    source = (manifest or {}).get('source')
+    if not source:
+        return 0
+    return sum(
+        storage.discard(
+            default_storage, name,
+            lambda: Post.objects.filter(image=source).exists())
+        for name in derivative_names(manifest))
+
+
+def manifest_ready(post):
+    """Манифест построен для текущего изображения записи."""
+    manifest = post.image_manifest or {}
+    return bool(post.image) and manifest.get('source') == post.image.name
+
+
+def picture(post):
+    """Данные для <picture>: srcset по форматам, запасной src и размеры.
+
+    Строится только из манифеста, файловая система не затрагивается.
+    """
+    if not manifest_ready(post):
+        return None
+    manifest = post.image_manifest
+    srcset = {
+        key: ', '.join(f'{default_storage.url(name)} {width}w'
+                       for width, name in variants)
+        for key, variants in manifest['formats'].items()
+    }
+    return {
+        'webp': srcset.get('webp'),
+        'jpeg': srcset['jpeg'],
+        'src': default_storage.url(manifest['formats']['jpeg'][-1][1]),
+        'sizes': SIZES,
+        'width': manifest['width'],
+        'height': manifest['height'],
+    }
+
+
+def _pixel_limit(image_format):
+    # PNG, WebP и GIF декодируются целиком, поэтому для них порог ниже.
+    if image_format in DRAFTABLE:
+        return settings.IMAGE_MAX_PIXELS
+    return settings.IMAGE_MAX_DECODED_PIXELS
+
+
+def limit_upload(upload):
+    """Проверяет размеры загруженной картинки по заголовку и уменьшает
+    слишком большие оригиналы до IMAGE_MAX_SIDE.
+
+    Пиксели не декодируются, пока не ясно, что картинку нужно уменьшать.
+    Для JPEG декодирование идёт сразу в уменьшенном масштабе (draft),
+    поэтому память ограничена целевым размером, а не исходным. Остальные
+    форматы декодируются полностью и принимаются только до
+    IMAGE_MAX_DECODED_PIXELS.
+    Результат держится в памяти только до FILE_UPLOAD_MAX_MEMORY_SIZE,
+    дальше пишется во временный файл.
+    """
+    upload.seek(0)
+    with Image.open(upload) as image:
+        width, height = image.size
+        if width * height > _pixel_limit(image.format):
+            raise ValidationError(
+                'Изображение слишком большое: %(width)s x %(height)s.',
+                code='image_too_large',
+                params={'width': width, 'height': height},
+            )
+        max_side = settings.IMAGE_MAX_SIDE
+        if (max(width, height) <= max_side
+                or image.format not in RESIZABLE):
+            upload.seek(0)
+            return upload
+        image_format = image.format
+        exif = image.info.get('exif')
+        image.draft('RGB', (max_side, max_side))
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        options = dict(RESIZABLE[image_format])
+        if exif:
+            options['exif'] = exif
+        output = tempfile.SpooledTemporaryFile(
+            max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+        image.save(output, image_format, **options)
+    size = output.tell()
+    output.seek(0)
+    return UploadedFile(output, upload.name, upload.content_type, size)
+
+
+def describe(file):
+    """Размеры картинки с учётом EXIF-поворота и крошечная размытая
+    копия в виде data URI для заглушки до загрузки.
+
+    Для картинки, которую пришлось бы декодировать целиком сверх
+    IMAGE_MAX_DECODED_PIXELS, заглушка не строится.
+    """
+    file.seek(0)
+    with Image.open(file) as image:
+        width, height = image.size
+        if image.getexif().get(0x0112) in TRANSPOSED:
+            width, height = height, width
+        if width * height > _pixel_limit(image.format):
+            file.seek(0)
+            return width, height, ''
+        image.draft('RGB', (PLACEHOLDER_SIDE * 8, PLACEHOLDER_SIDE * 8))
+        small = ImageOps.exif_transpose(image).convert('RGB')
+    file.seek(0)
+    small.thumbnail((PLACEHOLDER_SIDE, PLACEHOLDER_SIDE))
+    small = small.filter(ImageFilter.GaussianBlur(1))
+    buffer = io.BytesIO()
+    small.save(buffer, 'JPEG', quality=40)
+    placeholder = base64.b64encode(buffer.getvalue()).decode()
+    return width, height, f'data:image/jpeg;base64,{placeholder}'
+
+
+def describe_image(field_file):
+    """describe() для FieldFile: новая загрузка читается из памяти или
+    временного файла, сохранённая - из хранилища. Если файл не удаётся
+    прочитать, возвращает пустые значения."""
+    try:
+        if not field_file._committed:
+            return describe(field_file.file)
+        with field_file.storage.open(field_file.name) as file:
+            return describe(file)
+    except (OSError, ValueError, SuspiciousFileOperation):
+        return None, None, ''
+
+
+def optimize_original(name, storage):
+    """Поворачивает JPEG по EXIF, удаляет метаданные и пережимает.
+
+    Возвращает имя нового файла в storage или прежнее имя, если
+    пережатие ничего не даёт.
+    """
+    with storage.open(name) as source:
+        data = source.read()
+    with Image.open(io.BytesIO(data)) as image:
+        if image.format != 'JPEG':
+            return name
+        has_exif = bool(image.info.get('exif'))
+        image = ImageOps.exif_transpose(image).convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=85, optimize=True, progressive=True)
+    if not has_exif and buffer.tell() >= len(data):
+        return name
+    return storage.save(name, ContentFile(buffer.getvalue()))
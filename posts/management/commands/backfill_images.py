@@ -0,0 +1,152 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+
+from posts import images, storage
+from posts.cache import bump_all_pages, invalidate_post_cards
+from posts.models import Post
+
+
+def _init_worker():
+    # При запуске через spawn Django в дочернем процессе ещё не настроен.
+    django.setup()
+
+
+def process_image(name, optimize=False):
+    """Работа одного воркера: только файлы, без обращений к базе."""
+    image_storage = Post.image.field.storage
+    try:
+        if optimize:
+            name = images.optimize_original(name, image_storage)
+        manifest = images.build_derivatives(name)
+        if optimize:
+            # Имя - хеш содержимого: пока оно совпадает, файл уже пережат,
+            # и повторный прогон не теряет качество.
+            manifest['optimized'] = name
+        with image_storage.open(name) as file:
+            width, height, placeholder = images.describe(file)
+    except Exception as error:
+        return {'error': f'{type(error).__name__}: {error}'}
+    return {
+        'image': name,
+        'image_manifest': manifest,
+        'image_width': width,
+        'image_height': height,
+        'image_placeholder': placeholder,
+    }
+
+
+class Command(BaseCommand):
+    help = ('Заново создаёт производные изображений, размеры и заглушки '
+            'для всех записей с картинками в пуле процессов. Умеет '
+            'продолжать с контрольной точки.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='Число процессов; 0 - без пула, в текущем процессе.')
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument(
+            '--checkpoint',
+            help='Файл контрольной точки: последний обработанный id.')
+        parser.add_argument(
+            '--optimize-originals', action='store_true',
+            help='Удалить EXIF и пережать исходные JPEG.')
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Обрабатывать и записи с готовыми производными.')
+
+    def handle(self, *args, **options):
+        last_pk = self.load_checkpoint(options['checkpoint'])
+        posts = Post.objects.exclude(image='').exclude(
+            image__isnull=True).filter(pk__gt=last_pk).order_by('pk')
+        rows = posts.values_list(
+            'pk', 'image', 'image_manifest', 'image_width')
+        executor = None
+        if options['workers']:
+            # Дочерние процессы не должны унаследовать открытые соединения.
+            connections.close_all()
+            executor = ProcessPoolExecutor(
+                options['workers'], initializer=_init_worker)
+        self.started = time.perf_counter()
+        self.posts = self.images = self.errors = 0
+        batch = []
+        try:
+            for row in rows.iterator(chunk_size=options['batch_size']):
+                batch.append(row)
+                if len(batch) == options['batch_size']:
+                    self.process(batch, executor, options)
+                    batch = []
+            if batch:
+                self.process(batch, executor, options)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        bump_all_pages()
+        self.report(final=True)
+
+    def process(self, batch, executor, options):
+        names, manifests = {}, {}
+        for pk, name, manifest, width in batch:
+            ready = (manifest or {}).get('source') == name and width
+            if options['force'] or not ready:
+                names.setdefault(name, []).append(pk)
+                manifests[name] = manifest
+        args = (list(names), [
+            options['optimize_originals']
+            and (manifests[name] or {}).get('optimized') != name
+            for name in names
+        ])
+        if executor is None:
+            results = map(process_image, *args)
+        else:
+            results = executor.map(process_image, *args)
+        replaced = []
+        with transaction.atomic():
+            for (name, pks), result in zip(names.items(), results):
+                if 'error' in result:
+                    self.errors += 1
+                    self.stderr.write(f'{name}: {result["error"]}')
+                    continue
+                Post.objects.filter(pk__in=pks).update(**result)
+                if result['image'] != name:
+                    replaced.append(name)
+                self.images += 1
+        for name in replaced:
+            storage.release(name)
+            images.release_derivatives(manifests[name])
+        invalidate_post_cards([pk for pks in names.values() for pk in pks])
+        self.posts += len(batch)
+        self.save_checkpoint(options['checkpoint'], batch[-1][0])
+        self.report()
+
+    def load_checkpoint(self, path):
+        if not path or not os.path.exists(path):
+            return 0
+        with open(path) as checkpoint:
+            last_pk = json.load(checkpoint)['last_pk']
+        self.stdout.write(f'Продолжаю после id={last_pk}')
+        return last_pk
+
+    def save_checkpoint(self, path, last_pk):
+        if not path:
+            return
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as checkpoint:
+            json.dump({'last_pk': last_pk}, checkpoint)
+        os.replace(tmp, path)
+
+    def report(self, final=False):
+        elapsed = time.perf_counter() - self.started
+        line = (f'записей {self.posts}, изображений {self.images}, '
+                f'ошибок {self.errors}, {elapsed:.1f} с, '
+                f'{self.images / elapsed if elapsed else 0:.1f} изобр./с')
+        if final:
+            self.stdout.write(self.style.SUCCESS(f'Готово: {line}'))
+        else:
+            self.stdout.write(line)
@@ -0,0 +1,76 @@
+import statistics
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts.benchmark import benchmark_database, summary, timed
+from posts.models import Post
+from posts.seeding import seed
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = ('Замеряет списки записей и комментариев в админке на большой '
+            'синтетической базе: пагинацию, фильтр по автору, переходы по '
+            'датам и поиск.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=1_000_000)
+        parser.add_argument('--comments', type=int, default=1_000_000)
+        parser.add_argument('--repeat', type=int, default=10)
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            seed(
+                users=max(10, options['posts'] // 100),
+                groups=max(2, options['posts'] // 10000),
+                posts=options['posts'],
+                comments=options['comments'],
+                follows=0,
+                images=0,
+                prefix='admin',
+                stdout=self.stdout,
+            )
+            admin = User.objects.create_superuser(
+                'bench_admin', 'admin@example.com', 'password')
+            client = Client()
+            client.force_login(admin)
+            self.run(client, options['repeat'])
+        self.stdout.write('Время в миллисекундах.')
+
+    def cases(self):
+        post = Post.objects.order_by('-pk').first()
+        author = post.author.username
+        year, month = post.pub_date.year, post.pub_date.month
+        for model, date_field in (('post', 'pub_date'),
+                                  ('comment', 'created')):
+            url = reverse(f'admin:posts_{model}_changelist')
+            yield f'{model}', url, {}
+            yield f'{model} p=100', url, {'p': 100}
+            yield f'{model} author', url, {'author': author}
+            yield f'{model} year', url, {f'{date_field}__year': year}
+            yield f'{model} month', url, {f'{date_field}__year': year,
+                                          f'{date_field}__month': month}
+            yield f'{model} search', url, {'q': 'кофе'}
+
+    def run(self, client, repeat):
+        self.stdout.write(
+            f'{"case":<18} {"p50":>9} {"p95":>9} {"queries":>8} {"code":>5}')
+        for name, url, params in self.cases():
+            latencies, queries = [], []
+            for i in range(repeat + 1):
+                with CaptureQueriesContext(connection) as captured:
+                    elapsed, response = timed(client.get, url, params)
+                if i:
+                    latencies.append(elapsed)
+                    queries.append(len(captured))
+            result = summary(latencies)
+            self.stdout.write(
+                f'{name:<18} {result["p50"]:>9.2f} {result["p95"]:>9.2f} '
+                f'{int(statistics.median(queries)):>8} '
+                f'{response.status_code:>5}')
@@ -0,0 +1,190 @@
+import asyncio
+import json
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.util import setup_testing_defaults
+
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from django.db.backends.signals import connection_created
+from django.test import Client
+from django.urls import reverse
+
+from posts.benchmark import benchmark_database, summary
+from posts.models import Follow, Post
+from posts.seeding import seed
+
+MODES = ('wsgi', 'asgi')
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает пропускную способность лент и страницы записи '
+            'при конкурентных запросах через WSGI и через ASGI: оба '
+            'обработчика вызывают одни и те же синхронные представления. '
+            'Каждый режим запускается в отдельном процессе.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=10_000)
+        parser.add_argument(
+            '--concurrency', default='1,8,32',
+            help='Число одновременных запросов через запятую.')
+        parser.add_argument('--requests', type=int, default=400)
+        parser.add_argument(
+            '--latency', type=float, default=0.0,
+            help='Искусственная задержка каждого SQL-запроса, мс: '
+                 'имитирует медленную сетевую базу.')
+        parser.add_argument('--child', choices=MODES, help='Служебный.')
+
+    def handle(self, *args, **options):
+        if options['child']:
+            return self.child(options)
+        self.stdout.write(
+            f'{"mode":>5} {"conc":>5} {"rps":>8} {"p50":>9} {"p95":>9} '
+            f'{"errors":>7}')
+        for mode in MODES:
+            for row in self.run_child(mode, options):
+                self.stdout.write(
+                    f'{mode:>5} {row["concurrency"]:>5} {row["rps"]:>8.1f} '
+                    f'{row["p50"]:>9.2f} {row["p95"]:>9.2f} '
+                    f'{row["errors"]:>7}')
+        self.stdout.write('Время в миллисекундах.')
+
+    def run_child(self, mode, options):
+        output = subprocess.run(
+            [sys.executable, sys.argv[0], 'bench_asgi', '--child', mode,
+             '--posts', str(options['posts']),
+             '--concurrency', options['concurrency'],
+             '--requests', str(options['requests']),
+             '--latency', str(options['latency'])],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        return json.loads(output.strip().splitlines()[-1])
+
+    def child(self, options):
+        latency = options['latency'] / 1000
+
+        def slow(execute, sql, params, many, context):
+            time.sleep(latency)
+            return execute(sql, params, many, context)
+
+        def add_latency(sender, connection, **kwargs):
+            connection.execute_wrappers.append(slow)
+
+        with benchmark_database():
+            seed(
+                users=max(10, options['posts'] // 100),
+                groups=max(2, options['posts'] // 1000),
+                posts=options['posts'],
+                comments=options['posts'] * 2,
+                follows=options['posts'] // 10,
+                images=0,
+                prefix='asgi',
+            )
+            paths, cookie = self.prepare()
+            if latency:
+                connection_created.connect(add_latency)
+            load = (self.asgi_load if options['child'] == 'asgi'
+                    else self.wsgi_load)
+            rows = []
+            for concurrency in options['concurrency'].split(','):
+                concurrency = int(concurrency)
+                start = time.perf_counter()
+                latencies, errors = load(
+                    paths, cookie, concurrency, options['requests'])
+                elapsed = time.perf_counter() - start
+                rows.append({
+                    'concurrency': concurrency,
+                    'rps': options['requests'] / elapsed,
+                    'errors': errors,
+                    **summary(latencies),
+                })
+        self.stdout.write(json.dumps(rows))
+
+    def prepare(self):
+        follow = Follow.objects.select_related('user').first()
+        # Страница записи с тысячами комментариев строится сотни
+        # миллисекунд и заслонила бы разницу между режимами.
+        post = Post.objects.select_related('author', 'group').filter(
+            group__isnull=False).order_by('comments_count', 'pk').first()
+        paths = [
+            reverse('posts:index'),
+            reverse('posts:group', kwargs={'slug': post.group.slug}),
+            reverse('posts:profile', kwargs={
+                'username': post.author.username}),
+            reverse('posts:post', kwargs={
+                'username': post.author.username, 'post_id': post.id}),
+            reverse('posts:follow_index'),
+        ]
+        # Страницы для вошедшего пользователя не кешируются, поэтому
+        # каждый запрос действительно идёт в базу.
+        client = Client()
+        client.force_login(follow.user)
+        cookie = f'sessionid={client.cookies["sessionid"].value}'
+        return paths, cookie
+
+    def wsgi_load(self, paths, cookie, concurrency, requests):
+        """Потоковый WSGI-сервер: число потоков равно конкурентности."""
+        application = get_wsgi_application()
+
+        def request(number):
+            environ = {
+                'PATH_INFO': paths[number % len(paths)],
+                'HTTP_COOKIE': cookie,
+            }
+            setup_testing_defaults(environ)
+            status = []
+            start = time.perf_counter()
+            body = application(
+                environ, lambda code, headers: status.append(code))
+            b''.join(body)
+            body.close()
+            return time.perf_counter() - start, status[0].startswith('200')
+
+        with ThreadPoolExecutor(concurrency) as executor:
+            results = list(executor.map(request, range(requests)))
+        return ([elapsed for elapsed, _ in results],
+                sum(not ok for _, ok in results))
+
+    def asgi_load(self, paths, cookie, concurrency, requests):
+        """Один цикл событий, как у uvicorn или daphne."""
+        application = get_asgi_application()
+
+        async def request(number, semaphore):
+            scope = {
+                'type': 'http',
+                'asgi': {'version': '3.0'},
+                'http_version': '1.1',
+                'method': 'GET',
+                'scheme': 'http',
+                'path': paths[number % len(paths)],
+                'query_string': b'',
+                'headers': [(b'host', b'testserver'),
+                            (b'cookie', cookie.encode())],
+                'server': ('testserver', 80),
+                'client': ('127.0.0.1', 50000),
+            }
+            messages = []
+
+            async def receive():
+                return {'type': 'http.request', 'body': b''}
+
+            async def send(message):
+                messages.append(message)
+
+            async with semaphore:
+                start = time.perf_counter()
+                await application(scope, receive, send)
+                return (time.perf_counter() - start,
+                        messages[0].get('status') == 200)
+
+        async def run():
+            semaphore = asyncio.Semaphore(concurrency)
+            return await asyncio.gather(
+                *(request(number, semaphore) for number in range(requests)))
+
+        results = asyncio.run(run())
+        return ([elapsed for elapsed, _ in results],
+                sum(not ok for _, ok in results))
@@ -0,0 +1,115 @@
+import random
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from posts import counters
+from posts.benchmark import benchmark_database, summary, timed
+from posts.models import Follow, Post, Timeline
+
+User = get_user_model()
+
+MODES = ('push', 'hybrid')
+
+
+class Command(BaseCommand):
+    help = ('Замеряет задержку публикации и чтения ленты подписок '
+            'в режимах push и hybrid для разного числа подписчиков.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--followers', default='10,100,1000,5000',
+            help='Число подписчиков автора через запятую.')
+        parser.add_argument(
+            '--threshold', type=int, default=500,
+            help='TIMELINE_PULL_THRESHOLD для режима hybrid.')
+        parser.add_argument(
+            '--regular', type=int, default=3,
+            help='Сколько обычных авторов читает каждый подписчик.')
+        parser.add_argument(
+            '--posts', type=int, default=10,
+            help='Записей у каждого автора перед замером.')
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        sizes = [int(size) for size in options['followers'].split(',')]
+        rows = []
+        with benchmark_database():
+            for size in sizes:
+                author, followers = self.populate(size, options)
+                for mode in MODES:
+                    threshold = (options['threshold'] if mode == 'hybrid'
+                                 else 10 ** 9)
+                    with override_settings(TIMELINE_PULL_THRESHOLD=threshold):
+                        write, read = self.measure(
+                            author, followers, options['repeat'])
+                    rows.append((size, mode, summary(write), summary(read)))
+        self.report(rows)
+
+    def populate(self, size, options):
+        prefix = f'bench{size}'
+        users = User.objects.bulk_create(
+            [User(username=f'{prefix}_{i}')
+             for i in range(size + options['regular'] + 1)],
+            batch_size=1000,
+        )
+        if users[0].pk is None:
+            users = list(User.objects.filter(
+                username__startswith=f'{prefix}_').order_by('pk'))
+        author, regular = users[0], users[1:options['regular'] + 1]
+        followers = users[options['regular'] + 1:]
+        authors = [author, *regular]
+        Post.objects.bulk_create(
+            [Post(text=f'Запись {i}', author=user)
+             for user in authors for i in range(options['posts'])],
+            batch_size=1000,
+        )
+        Follow.objects.bulk_create(
+            [Follow(user=user, author=followed)
+             for user in followers for followed in authors],
+            batch_size=1000,
+        )
+        posts = list(Post.objects.filter(
+            author__in=authors).values_list('id', 'pub_date'))
+        Timeline.objects.bulk_create(
+            [Timeline(user=user, post_id=post_id, pub_date=pub_date)
+             for user in followers for post_id, pub_date in posts],
+            batch_size=5000,
+        )
+        counters.recount_authors(User.objects.filter(
+            username__startswith=f'{prefix}_'))
+        return author, followers
+
+    def measure(self, author, followers, repeat):
+        write = []
+        for i in range(repeat):
+            with transaction.atomic():
+                elapsed, _ = timed(
+                    Post.objects.create, text=f'Новая запись {i}',
+                    author=author)
+            write.append(elapsed)
+        read = []
+        client = Client()
+        url = reverse('posts:follow_index')
+        for user in random.sample(followers, min(repeat, len(followers))):
+            client.force_login(user)
+            elapsed, response = timed(client.get, url)
+            assert response.status_code == 200
+            read.append(elapsed)
+        return write, read
+
+    def report(self, rows):
+        header = (f'{"followers":>10} {"mode":>7} {"write p50":>10} '
+                  f'{"write p95":>10} {"read p50":>10} {"read p95":>10}')
+        self.stdout.write(header)
+        for size, mode, write, read in rows:
+            self.stdout.write(
+                f'{size:>10} {mode:>7} {write["p50"]:>10.2f} '
+                f'{write["p95"]:>10.2f} {read["p50"]:>10.2f} '
+                f'{read["p95"]:>10.2f}')
+        self.stdout.write('Время в миллисекундах.')
@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory, override_settings
+from django.views.static import serve as static_serve
+
+from posts.benchmark import summary, timed
+from yatube.media import serve
+
+MODES = ('static', 'stream', 'x-accel', 'x-sendfile')
+
+
+def _consume(response):
+    if response.streaming:
+        size = sum(len(chunk) for chunk in response.streaming_content)
+    else:
+        size = len(response.content)
+    response.close()
+    return size
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает отдачу медиафайлов через django.views.static.serve '
+            'и через yatube.media.serve в разных режимах MEDIA_DELIVERY.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', default='16,512,8192',
+            help='Размеры файлов в КБ через запятую.')
+        parser.add_argument('--repeat', type=int, default=50)
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        media_root = tempfile.mkdtemp()
+        try:
+            for size in sizes:
+                path = f'posts/bench_{size}.bin'
+                fullpath = os.path.join(media_root, path)
+                os.makedirs(os.path.dirname(fullpath), exist_ok=True)
+                with open(fullpath, 'wb') as file:
+                    file.write(os.urandom(size * 1024))
+            self.stdout.write(
+                f'{"size KB":>8} {"mode":>10} {"request":>9} '
+                f'{"p50":>8} {"p95":>8}')
+            for size in sizes:
+                path = f'posts/bench_{size}.bin'
+                for mode in MODES:
+                    with override_settings(
+                            MEDIA_ROOT=media_root,
+                            MEDIA_DELIVERY=mode):
+                        rows = self.measure(
+                            mode, path, media_root, options['repeat'])
+                    for kind, result in rows:
+                        self.stdout.write(
+                            f'{size:>8} {mode:>10} {kind:>9} '
+                            f'{result["p50"]:>8.3f} {result["p95"]:>8.3f}')
+        finally:
+            shutil.rmtree(media_root, ignore_errors=True)
+        self.stdout.write('Время в миллисекундах.')
+
+    def measure(self, mode, path, media_root, repeat):
+        factory = RequestFactory()
+
+        def fetch(**headers):
+            request = factory.get(f'/media/{path}', **headers)
+            if mode == 'static':
+                response = static_serve(request, path, media_root)
+            else:
+                response = serve(request, path)
+            return _consume(response), response
+
+        _, first = fetch()
+        requests = {
+            'full': {},
+            'etag': {'HTTP_IF_NONE_MATCH': first.get('ETag', '"none"')},
+            'range': {'HTTP_RANGE': 'bytes=0-65535'},
+        }
+        rows = []
+        for kind, headers in requests.items():
+            latencies = [timed(fetch, **headers)[0] for _ in range(repeat)]
+            rows.append((kind, summary(latencies)))
+        return rows
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+
+from posts.benchmark import benchmark_database, summary, timed
+from posts.search import search_posts, search_posts_icontains
+from posts.seeding import seed
+
+QUERIES = ('кофе', 'python django', 'велосипед концерт', 'сообщество 3',
+           'несуществующееслово')
+PATHS = {'fts5': search_posts, 'icontains': search_posts_icontains}
+
+
+def _first_page(queryset):
+    """То же, что делает страница поиска: число результатов и первые 10."""
+    return queryset.count(), list(queryset[:10])
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает поиск через FTS5 с поиском через icontains '
+            'на синтетической базе.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=1_000_000)
+        parser.add_argument('--repeat', type=int, default=10)
+        parser.add_argument(
+            '--queries', help='Запросы через запятую.')
+
+    def handle(self, *args, **options):
+        queries = (options['queries'].split(',') if options['queries']
+                   else QUERIES)
+        with benchmark_database():
+            seed(
+                users=max(10, options['posts'] // 100),
+                groups=max(2, options['posts'] // 10000),
+                posts=options['posts'],
+                comments=0,
+                follows=0,
+                images=0,
+                prefix='search',
+                stdout=self.stdout,
+            )
+            self.stdout.write(
+                f'{"query":<22} {"path":>10} {"found":>8} '
+                f'{"p50":>9} {"p95":>9}')
+            for query in queries:
+                for name, search in PATHS.items():
+                    latencies = []
+                    for _ in range(options['repeat']):
+                        elapsed, (found, _) = timed(
+                            _first_page, search(query))
+                        latencies.append(elapsed)
+                    result = summary(latencies)
+                    self.stdout.write(
+                        f'{query:<22} {name:>10} {found:>8} '
+                        f'{result["p50"]:>9.2f} {result["p95"]:>9.2f}')
+        self.stdout.write('Время в миллисекундах.')
@@ -0,0 +1,114 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.management.base import BaseCommand
+from PIL import Image
+
+from posts.benchmark import peak_rss
+from posts.forms import PostForm
+
+MODES = ('form', 'decode')
+CHUNK_SIZE = 64 * 1024
+# PNG декодируется без draft и показывает худший случай для памяти.
+FORMATS = {
+    'jpeg': ('JPEG', 'image/jpeg', {'quality': 90}),
+    'png': ('PNG', 'image/png', {'compress_level': 1}),
+}
+
+
+class Command(BaseCommand):
+    help = ('Замеряет пиковое потребление памяти (RSS) на одну загрузку '
+            'изображения через PostForm и для сравнения при полном '
+            'декодировании. Каждая загрузка идёт в отдельном процессе.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', default='2000x1500,4000x3000,8000x6000',
+            help='Размеры исходных картинок через запятую.')
+        parser.add_argument(
+            '--formats', default='jpeg,png',
+            help=f'Форматы через запятую: {", ".join(FORMATS)}.')
+        parser.add_argument('--child', help='Служебный: путь к файлу.')
+        parser.add_argument('--mode', choices=MODES, default='form')
+
+    def handle(self, *args, **options):
+        if options['child']:
+            return self.child(options['child'], options['mode'])
+        directory = tempfile.mkdtemp()
+        try:
+            self.stdout.write(
+                f'{"size":>10} {"format":>6} {"file MB":>8} {"mode":>7} '
+                f'{"peak MB":>8} {"growth MB":>10} {"seconds":>8}')
+            for size in options['sizes'].split(','):
+                width, height = (int(side) for side in size.split('x'))
+                image = Image.effect_noise(
+                    (width, height), 64).convert('RGB')
+                for key in options['formats'].split(','):
+                    image_format, _, save_options = FORMATS[key]
+                    path = os.path.join(directory, f'{size}.{key}')
+                    image.save(path, image_format, **save_options)
+                    file_size = os.path.getsize(path) / 2 ** 20
+                    for mode in MODES:
+                        self.report(size, key, file_size, mode,
+                                    self.run_child(path, mode))
+                    os.remove(path)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        self.stdout.write(
+            f'IMAGE_MAX_SIDE={settings.IMAGE_MAX_SIDE}, '
+            f'IMAGE_MAX_DECODED_PIXELS={settings.IMAGE_MAX_DECODED_PIXELS}, '
+            f'FILE_UPLOAD_MAX_MEMORY_SIZE='
+            f'{settings.FILE_UPLOAD_MAX_MEMORY_SIZE}')
+
+    def report(self, size, key, file_size, mode, result):
+        growth = (result['peak'] - result['baseline']) / 1024
+        line = (f'{size:>10} {key:>6} {file_size:>8.1f} {mode:>7} '
+                f'{result["peak"] / 1024:>8.1f} {growth:>10.1f} '
+                f'{result["seconds"]:>8.2f}')
+        if result.get('rejected'):
+            line += '  отклонено'
+        self.stdout.write(line)
+
+    def run_child(self, path, mode):
+        output = subprocess.run(
+            [sys.executable, sys.argv[0], 'bench_uploads',
+             '--child', path, '--mode', mode],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        return json.loads(output.strip().splitlines()[-1])
+
+    def child(self, path, mode):
+        baseline = peak_rss()
+        start = time.perf_counter()
+        rejected = False
+        if mode == 'form':
+            _, content_type, _ = FORMATS[os.path.splitext(path)[1][1:]]
+            # Так файл приходит от TemporaryFileUploadHandler.
+            upload = TemporaryUploadedFile(
+                os.path.basename(path), content_type,
+                os.path.getsize(path), None)
+            with open(path, 'rb') as source:
+                shutil.copyfileobj(source, upload, CHUNK_SIZE)
+            upload.seek(0)
+            form = PostForm(data={'text': 'Замер'}, files={'image': upload})
+            # Слишком большую картинку форма отклоняет до декодирования.
+            rejected = not form.is_valid()
+            if rejected and not form.has_error('image', 'image_too_large'):
+                raise SystemExit(form.errors.as_text())
+            upload.close()
+        else:
+            with Image.open(path) as image:
+                image.convert('RGB')
+        self.stdout.write(json.dumps({
+            'baseline': baseline,
+            'peak': peak_rss(),
+            'seconds': time.perf_counter() - start,
+            'rejected': rejected,
+        }))
@@ -0,0 +1,173 @@
+import json
+import shutil
+import statistics
+import tempfile
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts import urls as posts_urls
+from posts.benchmark import benchmark_database, summary, timed
+from posts.models import AuthorStats, Comment, Follow, Group, Post
+from posts.seeding import seed
+
+POST_ONLY = {'post_del', 'comment_del'}
+
+
+class Command(BaseCommand):
+    help = ('Прогоняет все URL из posts.urls через тестовый клиент на '
+            'базах разного размера и сохраняет задержки и число запросов '
+            'в JSON для сравнения между запусками.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', default='100,1000,10000',
+            help='Число записей в базе через запятую.')
+        parser.add_argument('--repeat', type=int, default=10)
+        parser.add_argument('--output', help='Куда сохранить результаты.')
+        parser.add_argument(
+            '--compare', help='JSON предыдущего запуска для сравнения.')
+        parser.add_argument(
+            '--tolerance', type=float, default=0.2,
+            help='Допустимый рост p50 относительно базового запуска.')
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        results = {}
+        media_root = tempfile.mkdtemp()
+        try:
+            with override_settings(MEDIA_ROOT=media_root):
+                for size in sizes:
+                    with benchmark_database():
+                        cache.clear()
+                        self.populate(size)
+                        results[str(size)] = self.run_urls(options['repeat'])
+                    self.report(size, results[str(size)])
+        finally:
+            shutil.rmtree(media_root, ignore_errors=True)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump({'sizes': results}, output, indent=2,
+                          ensure_ascii=False)
+        if options['compare']:
+            self.compare(options['compare'], results, options['tolerance'])
+
+    def populate(self, size):
+        seed(
+            users=max(10, size // 10),
+            groups=max(2, size // 100),
+            posts=size,
+            comments=size * 3,
+            follows=size,
+            images=0.1,
+            image_pool=5,
+            prefix=f'bench{size}',
+        )
+        top = AuthorStats.objects.select_related('user').order_by(
+            '-posts_count')[:50]
+        self.viewer = top[0].user
+        for stats in top[1:]:
+            Follow.objects.get_or_create(
+                user=self.viewer, author_id=stats.user_id)
+        self.post = self.viewer.posts.order_by('-comments_count').first()
+        self.other = Follow.objects.filter(
+            user=self.viewer).first().author
+        self.group = Group.objects.first()
+        self.comment = Comment.objects.create(
+            post=self.post, author=self.viewer, text='Комментарий')
+
+    def url_kwargs(self, pattern):
+        kwargs = {}
+        for name in pattern.pattern.converters:
+            if name == 'slug':
+                kwargs[name] = self.group.slug
+            elif name == 'username':
+                kwargs[name] = (self.post.author.username
+                                if 'post_id' in pattern.pattern.converters
+                                else self.other.username)
+            elif name == 'post_id':
+                kwargs[name] = self.post.id
+            elif name == 'comment_id':
+                kwargs[name] = self.comment.id
+            else:
+                return None
+        return kwargs
+
+    def fresh_kwargs(self, name):
+        post = Post.objects.create(author=self.viewer, text='Удалить')
+        kwargs = {'username': self.viewer.username, 'post_id': post.id}
+        if name == 'comment_del':
+            comment = Comment.objects.create(
+                post=post, author=self.viewer, text='Удалить')
+            kwargs['comment_id'] = comment.id
+        return kwargs
+
+    def request(self, client, name, kwargs):
+        url = reverse(f'posts:{name}', kwargs=kwargs)
+        if name in POST_ONLY:
+            return timed(client.post, url)
+        return timed(client.get, url)
+
+    def run_urls(self, repeat):
+        client = Client(raise_request_exception=False)
+        client.force_login(self.viewer)
+        results = {}
+        for pattern in posts_urls.urlpatterns:
+            name = pattern.name
+            kwargs = self.url_kwargs(pattern)
+            if kwargs is None:
+                self.stderr.write(f'Пропускаю {name}: неизвестные параметры')
+                continue
+            latencies, queries = [], []
+            for i in range(repeat + 1):
+                if name in POST_ONLY:
+                    kwargs = self.fresh_kwargs(name)
+                with CaptureQueriesContext(connection) as captured:
+                    elapsed, response = self.request(client, name, kwargs)
+                if i:
+                    latencies.append(elapsed)
+                    queries.append(len(captured))
+            results[name] = {
+                **summary(latencies),
+                'queries': int(statistics.median(queries)),
+                'status': response.status_code,
+            }
+        return results
+
+    def report(self, size, results):
+        self.stdout.write(self.style.MIGRATE_HEADING(f'Записей: {size}'))
+        for name, result in results.items():
+            self.stdout.write(
+                f'  {name:<18} p50={result["p50"]:>8.2f} мс '
+                f'p95={result["p95"]:>8.2f} мс '
+                f'запросов={result["queries"]:<4} '
+                f'код={result["status"]}')
+
+    def compare(self, path, results, tolerance):
+        try:
+            with open(path) as baseline_file:
+                baseline = json.load(baseline_file)['sizes']
+        except (OSError, ValueError, KeyError) as error:
+            raise CommandError(f'Не удалось прочитать {path}: {error}')
+        regressions = []
+        for size, urls in results.items():
+            for name, result in urls.items():
+                base = baseline.get(size, {}).get(name)
+                if base is None:
+                    continue
+                if result['p50'] > base['p50'] * (1 + tolerance):
+                    regressions.append(
+                        f'{size} {name}: p50 {base["p50"]:.2f} -> '
+                        f'{result["p50"]:.2f} мс')
+                if result['queries'] > base['queries']:
+                    regressions.append(
+                        f'{size} {name}: запросов {base["queries"]} -> '
+                        f'{result["queries"]}')
+        for line in regressions:
+            self.stdout.write(self.style.WARNING(line))
+        if not regressions:
+            self.stdout.write(self.style.SUCCESS('Регрессий нет'))
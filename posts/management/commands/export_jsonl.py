@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts import transfer
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = ('Выгружает сообщества, записи, комментарии и подписки в файл '
+            'JSON Lines потоком, без загрузки таблиц в память. Файлы '
+            'изображений копируются в отдельный каталог.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл выгрузки, можно .gz.')
+        parser.add_argument(
+            '--models', default=','.join(transfer.MODELS),
+            help='Что выгружать, через запятую.')
+        parser.add_argument(
+            '--media-dir', help='Каталог для копий изображений.')
+        parser.add_argument(
+            '--batch-size', type=int, default=transfer.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        models = options['models'].split(',')
+        media_dir = options['media_dir']
+        image_storage = Post.image.field.storage
+        written, images = 0, 0
+        start = time.perf_counter()
+        with transfer.open_file(options['path'], 'w') as output:
+            for record in transfer.export_records(
+                    models, options['batch_size']):
+                output.write(transfer.dump_line(record))
+                written += 1
+                if media_dir and record['model'] == 'post':
+                    name = record['fields']['image']
+                    if name and transfer.copy_image(
+                            name, image_storage, media_dir):
+                        images += 1
+                if written % transfer.PROGRESS_EVERY == 0:
+                    self.stdout.write(transfer.progress(written, start))
+        self.stdout.write(transfer.progress(written, start))
+        self.stdout.write(self.style.SUCCESS(
+            f'Выгружено строк: {written}, изображений: {images}'))
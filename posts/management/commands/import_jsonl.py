@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import counters, timeline, transfer
+from posts.cache import bump_all_pages
+
+
+class Command(BaseCommand):
+    help = ('Загружает файл JSON Lines из export_jsonl пачками через '
+            'bulk_create, затем пересчитывает счётчики и ленты подписок. '
+            'Производные изображений после загрузки строит backfill_images.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл выгрузки, можно .gz.')
+        parser.add_argument(
+            '--media-dir', help='Каталог с копиями изображений.')
+        parser.add_argument(
+            '--batch-size', type=int, default=transfer.BATCH_SIZE)
+        parser.add_argument(
+            '--skip-rebuild', action='store_true',
+            help='Не пересчитывать счётчики и ленты после загрузки.')
+
+    def handle(self, *args, **options):
+        importer = transfer.Importer(
+            batch_size=options['batch_size'],
+            media_dir=options['media_dir'])
+        read = 0
+        start = time.perf_counter()
+        with transfer.open_file(options['path'], 'r') as source:
+            for number, line in enumerate(source, 1):
+                if not line.strip():
+                    continue
+                try:
+                    importer.add(line)
+                except (ValueError, KeyError) as error:
+                    raise CommandError(f'Строка {number}: {error}')
+                read += 1
+                if read % transfer.PROGRESS_EVERY == 0:
+                    self.stdout.write(transfer.progress(read, start))
+        try:
+            counts = importer.finish()
+        except ValueError as error:
+            raise CommandError(str(error))
+        self.stdout.write(transfer.progress(read, start))
+        if not options['skip_rebuild']:
+            counters.recount()
+            timeline.rebuild()
+        bump_all_pages()
+        loaded = ', '.join(f'{model}: {count}'
+                           for model, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(
+            f'Прочитано строк: {loaded}; комментариев без записи '
+            f'пропущено: {importer.skipped}'))
@@ -0,0 +1,23 @@
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.cache import page_cache_stats
+from posts.thumbnails import backlog
+
+
+class Command(BaseCommand):
+    help = 'Показывает метрики кешей.'
+
+    def handle(self, *args, **options):
+        if isinstance(caches['default'], LocMemCache):
+            raise CommandError(
+                'Кеш в памяти процесса (CACHE_URL=locmem://): счётчики '
+                'сервера этой команде не видны. Задайте общий кеш, '
+                'например CACHE_URL=redis://127.0.0.1:6379/1.')
+        stats = page_cache_stats()
+        self.stdout.write(
+            f'Страничный кеш: попаданий {stats["hits"]}, '
+            f'промахов {stats["misses"]}, '
+            f'доля попаданий {stats["ratio"]:.1%}')
+        self.stdout.write(f'Очередь миниатюр: {backlog()}')
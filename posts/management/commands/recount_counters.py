@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from posts.counters import recount
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики комментариев, записей и подписок.'
+
+    def handle(self, *args, **options):
+        posts, authors = recount()
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересчитано записей: {posts}, авторов: {authors}'))
@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import storage
+from posts.cache import bump_all_pages, invalidate_post_cards
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = ('Переносит изображения записей из плоского каталога posts/ '
+            'в хранилище с именами по хешу содержимого и перезаписывает '
+            'пути в базе пачками.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--keep-old', action='store_true',
+            help='Не удалять старые файлы после переноса.')
+
+    def handle(self, *args, **options):
+        image_storage = Post.image.field.storage
+        posts = Post.objects.exclude(image='').exclude(
+            image__isnull=True).order_by('pk')
+        last_pk, moved, missing = 0, 0, 0
+        while True:
+            batch = list(posts.filter(pk__gt=last_pk).only(
+                'pk', 'image', 'image_manifest')[:options['batch_size']])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            renamed, changed = {}, []
+            for post in batch:
+                old = post.image.name
+                if storage.HASHED.match(old):
+                    continue
+                if old not in renamed:
+                    if not image_storage.exists(old):
+                        missing += 1
+                        continue
+                    with image_storage.open(old) as content:
+                        renamed[old] = image_storage.save(old, content)
+                post.image.name = renamed[old]
+                if post.image_manifest.get('source') == old:
+                    post.image_manifest['source'] = renamed[old]
+                changed.append(post)
+            with transaction.atomic():
+                Post.objects.bulk_update(
+                    changed, ['image', 'image_manifest'])
+            invalidate_post_cards([post.pk for post in changed])
+            moved += len(changed)
+            if not options['keep_old']:
+                for old in renamed:
+                    storage.release(old)
+            self.stdout.write(
+                f'Обработано до id={last_pk}, перенесено {moved}')
+        bump_all_pages()
+        self.stdout.write(self.style.SUCCESS(
+            f'Перенесено записей: {moved}, файлов не найдено: {missing}'))
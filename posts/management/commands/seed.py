@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from posts.seeding import seed
+
+
+class Command(BaseCommand):
+    help = ('Заполняет базу синтетическими пользователями, сообществами, '
+            'записями с картинками, комментариями и подписками.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--groups', type=int, default=10)
+        parser.add_argument('--posts', type=int, default=1000)
+        parser.add_argument('--comments', type=int, default=3000)
+        parser.add_argument('--follows', type=int, default=1000)
+        parser.add_argument(
+            '--images', type=float, default=0.1,
+            help='Доля записей с картинкой.')
+        parser.add_argument(
+            '--image-pool', type=int, default=10,
+            help='Сколько разных картинок сгенерировать.')
+        parser.add_argument(
+            '--prefix', default='seed',
+            help='Префикс имён пользователей и сообществ; для повторного '
+                 'запуска нужен новый.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        seed(
+            users=options['users'],
+            groups=options['groups'],
+            posts=options['posts'],
+            comments=options['comments'],
+            follows=options['follows'],
+            images=options['images'],
+            image_pool=options['image_pool'],
+            prefix=options['prefix'],
+            random_seed=options['seed'],
+            stdout=self.stdout,
+        )
+        self.stdout.write(self.style.SUCCESS('Готово'))
@@ -0,0 +1,74 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from posts import images, storage
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = ('Удаляет файлы изображений и производных, на которые не '
+            'ссылается ни одна запись и которые не брали дольше '
+            'IMAGE_RELEASE_GRACE секунд, а также остатки прерванных '
+            'записей. Запускается периодически, например из cron.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        image_storage = Post.image.field.storage
+        removed = 0
+        for batch in self.batches(
+                image_storage, 'posts', options['batch_size'],
+                storage.HASHED.match):
+            referenced = set(Post.objects.filter(
+                image__in=batch).values_list('image', flat=True))
+            removed += sum(storage.release(name) for name in batch
+                           if name not in referenced)
+        # Производные общие для записей с одинаковым исходником, поэтому
+        # нужны все имена из манифестов.
+        referenced = set()
+        manifests = Post.objects.exclude(image_manifest={}).values_list(
+            'image_manifest', flat=True)
+        for manifest in manifests.iterator():
+            referenced.update(images.derivative_names(manifest))
+        for batch in self.batches(
+                default_storage, images.DERIVATIVES_DIR,
+                options['batch_size'], lambda name: True):
+            removed += sum(
+                storage.discard(default_storage, name, lambda: False)
+                for name in batch if name not in referenced)
+        self.stdout.write(self.style.SUCCESS(
+            f'Удалено файлов: {removed}'))
+
+    def batches(self, file_storage, directory, size, accept):
+        batch = []
+        root = file_storage.path(directory)
+        for directory, _, files in os.walk(root):
+            for file_name in files:
+                path = os.path.join(directory, file_name)
+                if file_name.endswith(('.part', '.trash')):
+                    self.remove_stale(path)
+                    continue
+                name = os.path.relpath(
+                    path, file_storage.location).replace(os.sep, '/')
+                if not accept(name):
+                    continue
+                batch.append(name)
+                if len(batch) == size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+    def remove_stale(self, path):
+        # Недописанный или брошенный при сбое временный файл.
+        try:
+            if (time.time() - os.path.getmtime(path)
+                    >= settings.IMAGE_RELEASE_GRACE):
+                os.remove(path)
+        except FileNotFoundError:
+            pass
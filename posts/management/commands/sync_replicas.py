@@ -0,0 +1,53 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+def sqlite_path(alias):
+    database = connections.databases[alias]
+    if database['ENGINE'] != 'django.db.backends.sqlite3':
+        raise CommandError(
+            f'{alias}: копировать можно только базы SQLite, остальные '
+            f'реплицирует сам сервер баз данных.')
+    name = str(database['NAME'])
+    if name.startswith('file:'):
+        name = name[len('file:'):].split('?')[0]
+    return name
+
+
+class Command(BaseCommand):
+    help = ('Копирует основную базу SQLite в файлы реплик из '
+            'DATABASE_REPLICAS. Заменяет репликацию при локальной '
+            'проверке чтения с реплик.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--every', type=float, default=0,
+            help='Повторять копирование раз в столько секунд, имитируя '
+                 'задержку репликации.')
+
+    def handle(self, *args, **options):
+        if not settings.REPLICA_DATABASES:
+            raise CommandError('Реплики не настроены: задайте '
+                               'DATABASE_REPLICAS.')
+        paths = {alias: sqlite_path(alias)
+                 for alias in settings.REPLICA_DATABASES}
+        source = sqlite_path(DEFAULT_DB_ALIAS)
+        while True:
+            for alias, path in paths.items():
+                primary = sqlite3.connect(source)
+                replica = sqlite3.connect(path)
+                try:
+                    # backup копирует согласованный снимок даже во время
+                    # записи в основную базу.
+                    primary.backup(replica)
+                finally:
+                    primary.close()
+                    replica.close()
+                self.stdout.write(f'{alias}: {path}')
+            if not options['every']:
+                break
+            time.sleep(options['every'])
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from posts.metrics import load_stats
+
+PERCENTILES = (50, 95, 99)
+
+
+class Command(BaseCommand):
+    help = ('Показывает p50/p95/p99 числа запросов, времени в базе, '
+            'рендеринга шаблонов и ответа для каждого view.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--slope', type=float, default=0.5,
+            help='Сколько запросов на запись на странице считать ростом '
+                 'числа запросов с размером страницы.')
+
+    def handle(self, *args, **options):
+        stats = load_stats()
+        if not stats:
+            self.stdout.write('Нет данных. Включите QUERY_BUDGET.')
+            return
+        flagged = []
+        for name in sorted(stats):
+            view = stats[name]
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f'{name} (запросов к view: {view.requests})'))
+            for metric, histogram in view.histograms.items():
+                values = ' '.join(
+                    f'p{q}={histogram.percentile(q):.1f}'
+                    for q in PERCENTILES)
+                self.stdout.write(f'  {metric:<12} {values}')
+            slope = view.queries_per_item()
+            if slope >= options['slope']:
+                flagged.append((name, slope))
+        for name, slope in flagged:
+            self.stdout.write(self.style.WARNING(
+                f'{name}: число запросов растёт с размером страницы '
+                f'(~{slope:.1f} на запись)'))
@@ -0,0 +1,172 @@
+import atexit
+import json
+import math
+import os
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+
+BASE = 1.1
+WINDOW = 60
+METRICS = ('queries', 'db_ms', 'template_ms', 'total_ms')
+
+
+class Histogram:
+    """Гистограмма с логарифмическими корзинами.
+
+    Относительная погрешность перцентилей не больше BASE - 1, а
+    гистограммы разных процессов и окон складываются поэлементно.
+    """
+
+    def __init__(self, counts=None):
+        self.counts = defaultdict(int)
+        for bucket, count in (counts or {}).items():
+            self.counts[int(bucket)] += count
+
+    @staticmethod
+    def bucket(value):
+        if value <= 0:
+            return -1000
+        return math.floor(math.log(value, BASE))
+
+    def add(self, value):
+        self.counts[self.bucket(value)] += 1
+
+    def merge(self, other):
+        for bucket, count in other.counts.items():
+            self.counts[bucket] += count
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    def percentile(self, q):
+        total = self.total
+        if not total:
+            return 0.0
+        rank = math.ceil(total * q / 100)
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return 0.0 if bucket == -1000 else BASE ** (bucket + 1)
+        return 0.0
+
+    def to_dict(self):
+        return dict(self.counts)
+
+
+class ViewStats:
+
+    def __init__(self, data=None):
+        data = data or {}
+        self.histograms = {
+            name: Histogram(data.get(name)) for name in METRICS}
+        # Размер страницы -> [сумма запросов, число запросов к view].
+        self.page_sizes = defaultdict(lambda: [0, 0])
+        for size, (queries, count) in data.get('page_sizes', {}).items():
+            self.page_sizes[int(size)][0] += queries
+            self.page_sizes[int(size)][1] += count
+
+    def add(self, sample, page_size=None):
+        for name in METRICS:
+            self.histograms[name].add(sample[name])
+        if page_size is not None:
+            self.page_sizes[page_size][0] += sample['queries']
+            self.page_sizes[page_size][1] += 1
+
+    def merge(self, other):
+        for name in METRICS:
+            self.histograms[name].merge(other.histograms[name])
+        for size, (queries, count) in other.page_sizes.items():
+            self.page_sizes[size][0] += queries
+            self.page_sizes[size][1] += count
+
+    @property
+    def requests(self):
+        return self.histograms['total_ms'].total
+
+    def queries_per_item(self):
+        """Наклон зависимости числа запросов от размера страницы."""
+        points = [(size, queries / count)
+                  for size, (queries, count) in self.page_sizes.items()]
+        if len(points) < 2:
+            return 0.0
+        mean_x = sum(x for x, _ in points) / len(points)
+        mean_y = sum(y for _, y in points) / len(points)
+        dx = sum((x - mean_x) ** 2 for x, _ in points)
+        if not dx:
+            return 0.0
+        return sum((x - mean_x) * (y - mean_y) for x, y in points) / dx
+
+    def to_dict(self):
+        data = {name: self.histograms[name].to_dict() for name in METRICS}
+        data['page_sizes'] = dict(self.page_sizes)
+        return data
+
+
+class Recorder:
+    """Накапливает замеры в окнах по минуте и периодически сбрасывает их
+    в файл процесса, чтобы команда view_stats могла собрать данные всех
+    воркеров."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.windows = defaultdict(lambda: defaultdict(ViewStats))
+        self.flushed = time.monotonic()
+
+    def record(self, view_name, sample, page_size=None):
+        window = int(time.time()) // WINDOW * WINDOW
+        with self.lock:
+            self.windows[window][view_name].add(sample, page_size)
+        if time.monotonic() - self.flushed >= settings.QUERY_BUDGET_FLUSH:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            self.flushed = time.monotonic()
+            oldest = (int(time.time()) // WINDOW
+                      - settings.QUERY_BUDGET_WINDOWS) * WINDOW
+            for window in [w for w in self.windows if w <= oldest]:
+                del self.windows[window]
+            data = {
+                str(window): {name: stats.to_dict()
+                              for name, stats in views.items()}
+                for window, views in self.windows.items()
+            }
+        if not data:
+            return
+        directory = Path(settings.QUERY_BUDGET_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f'{os.getpid()}.json'
+        tmp = path.with_suffix('.tmp')
+        tmp.write_text(json.dumps(data))
+        os.replace(tmp, path)
+
+
+recorder = Recorder()
+atexit.register(lambda: settings.QUERY_BUDGET_ENABLED and recorder.flush())
+
+
+def load_stats():
+    """Складывает окна из файлов всех процессов за период хранения."""
+    result = defaultdict(ViewStats)
+    directory = Path(settings.QUERY_BUDGET_DIR)
+    if not directory.exists():
+        return result
+    oldest = (int(time.time()) // WINDOW
+              - settings.QUERY_BUDGET_WINDOWS) * WINDOW
+    for path in directory.glob('*.json'):
+        try:
+            data = json.loads(path.read_text())
+        except (OSError, ValueError):
+            continue
+        for window, views in data.items():
+            if int(window) <= oldest:
+                continue
+            for name, stats in views.items():
+                result[name].merge(ViewStats(stats))
+    return result
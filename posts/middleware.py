@@ -0,0 +1,105 @@
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import Template
+
+from posts import replicas
+from posts.metrics import recorder
+
+_current = ContextVar('query_budget', default=None)
+
+
+class _Budget:
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_time += time.perf_counter() - start
+
+
+def _instrument_templates():
+    if getattr(Template.render, 'instrumented', False):
+        return
+    render = Template.render
+
+    def timed_render(self, context=None, request=None):
+        budget = _current.get()
+        if budget is None:
+            return render(self, context, request)
+        start = time.perf_counter()
+        try:
+            return render(self, context, request)
+        finally:
+            budget.template_time += time.perf_counter() - start
+
+    timed_render.instrumented = True
+    Template.render = timed_render
+
+
+class QueryBudgetMiddleware:
+    """Считает SQL-запросы, время в базе, время рендеринга шаблонов и
+    общее время ответа для каждого именованного URL."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if settings.QUERY_BUDGET_ENABLED:
+            _instrument_templates()
+
+    def __call__(self, request):
+        if not settings.QUERY_BUDGET_ENABLED:
+            return self.get_response(request)
+        budget = _Budget()
+        token = _current.set(budget)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(budget))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        total = time.perf_counter() - start
+        match = request.resolver_match
+        if match is not None and match.view_name:
+            recorder.record(match.view_name, {
+                'queries': budget.queries,
+                'db_ms': budget.db_time * 1000,
+                'template_ms': budget.template_time * 1000,
+                'total_ms': total * 1000,
+            }, getattr(request, 'page_size', None))
+        return response
+
+
+class ReplicaMiddleware:
+    """Направляет чтения лент и страниц записей на реплики и после
+    записи на REPLICA_PIN_SECONDS секунд закрепляет посетителя за
+    основной базой (см. posts.replicas)."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.REPLICA_DATABASES:
+            return self.get_response(request)
+        state, token = replicas.start_request(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            replicas.finish_request(token)
+        if state.wrote:
+            response.set_cookie(
+                replicas.PIN_COOKIE, '1',
+                max_age=settings.REPLICA_PIN_SECONDS,
+                httponly=True, samesite='Lax')
+        return response
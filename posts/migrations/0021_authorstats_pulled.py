@@ -0,0 +1,28 @@
+# Generated by Django 4.0.1 on 2026-10-17 09:12
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_pulled(apps, schema_editor):
+    # До этой миграции режим определялся текущим числом подписчиков.
+    AuthorStats = apps.get_model('posts', 'AuthorStats')
+    AuthorStats.objects.filter(
+        followers_count__gt=settings.TIMELINE_PULL_THRESHOLD,
+    ).update(pulled=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0020_comment_created_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='authorstats',
+            name='pulled',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Записи подмешиваются в ленты при чтении'),
+        ),
+        migrations.RunPython(fill_pulled, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,8 @@
 from django.contrib.auth import get_user_model
 from django.db import models
 
+from posts.storage import ContentAddressedStorage
+
 User = get_user_model()
 
 
@@ -18,6 +20,7 @@ class Post(models.Model):
         verbose_name='Автор',
         on_delete=models.CASCADE,
         related_name='posts',
+        db_index=False,
     )
     group = models.ForeignKey(
         to='Group',
@@ -27,17 +30,59 @@ class Post(models.Model):
         null=True,
         related_name='posts',
         help_text='Выберите сообщество (необязательно)',
+        db_index=False,
     )
     image = models.ImageField(
         upload_to='posts/',
+        storage=ContentAddressedStorage(),
         verbose_name='Изображение',
         blank=True,
         null=True,
-        help_text='Добавьте изображение (необязательно)'
+        help_text='Добавьте изображение (необязательно)',
+        db_index=True,
+    )
+    comments_count = models.PositiveIntegerField(
+        verbose_name='Комментариев',
+        default=0,
+        editable=False,
+    )
+    image_width = models.PositiveIntegerField(
+        verbose_name='Ширина изображения',
+        blank=True,
+        null=True,
+        editable=False,
+    )
+    image_height = models.PositiveIntegerField(
+        verbose_name='Высота изображения',
+        blank=True,
+        null=True,
+        editable=False,
+    )
+    image_placeholder = models.TextField(
+        verbose_name='Заглушка изображения',
+        blank=True,
+        editable=False,
+    )
+    image_manifest = models.JSONField(
+        verbose_name='Производные изображения',
+        default=dict,
+        blank=True,
+        editable=False,
     )
 
     class Meta:
         ordering = ['-pub_date']
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'],
+                name='post_pub_date_idx'),
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='post_author_pub_date_idx'),
+            models.Index(
+                fields=['group', '-pub_date', '-id'],
+                name='post_group_pub_date_idx'),
+            ]
 
     def __str__(self):
         return self.text[:15]
@@ -62,6 +107,7 @@ class Comment(models.Model):
         verbose_name='Пост',
         on_delete=models.CASCADE,
         related_name='comments',
+        db_index=False,
     )
     text = models.TextField(
         verbose_name='Комментарий',
@@ -80,6 +126,14 @@ class Comment(models.Model):
 
     class Meta:
         ordering = ['-created']
+        indexes = [
+            models.Index(
+                fields=['post', '-created', '-id'],
+                name='comment_post_created_idx'),
+            models.Index(
+                fields=['-created', '-id'],
+                name='comment_created_idx'),
+            ]
 
     def __str__(self):
         return self.text[:15]
@@ -103,3 +157,61 @@ class Follow(models.Model):
                 fields=['user', 'author'],
                 name='user_and_author_uniq_together'),
             ]
+
+
+class AuthorStats(models.Model):
+    user = models.OneToOneField(
+        to=User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats',
+    )
+    posts_count = models.PositiveIntegerField(
+        verbose_name='Записей',
+        default=0,
+    )
+    followers_count = models.PositiveIntegerField(
+        verbose_name='Подписчиков',
+        default=0,
+    )
+    following_count = models.PositiveIntegerField(
+        verbose_name='Подписан',
+        default=0,
+    )
+    # Меняется только вместе с лентами подписчиков, см.
+    # posts.timeline.sync_mode.
+    pulled = models.BooleanField(
+        verbose_name='Записи подмешиваются в ленты при чтении',
+        default=False,
+        editable=False,
+    )
+
+    def __str__(self):
+        return str(self.user_id)
+
+
+class Timeline(models.Model):
+    user = models.ForeignKey(
+        to=User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        db_index=False,
+    )
+    post = models.ForeignKey(
+        to='Post',
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+    )
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'post'],
+                name='timeline_user_and_post_uniq_together'),
+            ]
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-post'],
+                name='timeline_user_pub_date_idx'),
+            ]
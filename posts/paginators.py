@@ -0,0 +1,160 @@
+import base64
+import binascii
+import collections.abc
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+POSTS_ORDERING = ('-pub_date', '-id')
+COMMENTS_ORDERING = ('-created', '-id')
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class CursorEncoder(json.JSONEncoder):
+    # DjangoJSONEncoder обрезает микросекунды, а курсору нужна точность.
+    def default(self, o):
+        if hasattr(o, 'isoformat'):
+            return o.isoformat()
+        return super().default(o)
+
+
+class CursorPaginator:
+    """Постраничная навигация по ключу (keyset) вместо LIMIT/OFFSET.
+
+    Курсор — непрозрачный токен с значениями полей ``ordering``
+    крайней записи страницы, поэтому выборка любой страницы — это один
+    диапазонный запрос по индексу независимо от глубины.
+    """
+
+    def __init__(self, object_list, per_page, ordering=POSTS_ORDERING):
+        self.ordering = tuple(ordering)
+        self.object_list = object_list.order_by(*self.ordering)
+        self.per_page = int(per_page)
+        self.fields = [name.lstrip('-') for name in self.ordering]
+
+    @cached_property
+    def count(self):
+        return self.object_list.count()
+
+    def encode_cursor(self, obj, backward=False):
+        values = [getattr(obj, name) for name in self.fields]
+        data = json.dumps({'k': values, 'b': int(backward)},
+                          cls=CursorEncoder, separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, token):
+        try:
+            padded = token + '=' * (-len(token) % 4)
+            data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            values = data['k']
+            backward = bool(data['b'])
+            if len(values) != len(self.fields):
+                raise InvalidCursor
+            model = self.object_list.model
+            values = [
+                model._meta.get_field(name).to_python(value)
+                for name, value in zip(self.fields, values)
+            ]
+        except (ValueError, TypeError, KeyError, binascii.Error,
+                ValidationError):
+            raise InvalidCursor
+        return values, backward
+
+    def _seek(self, values, backward):
+        condition = Q()
+        for i, name in enumerate(self.ordering):
+            descending = name.startswith('-')
+            lookup = 'lt' if descending != backward else 'gt'
+            equal = {field: values[j] for j, field in
+                     enumerate(self.fields[:i])}
+            condition |= Q(**equal, **{f'{self.fields[i]}__{lookup}':
+                                       values[i]})
+        return condition
+
+    def page(self, token=None):
+        if not token:
+            items = list(self.object_list[:self.per_page + 1])
+            has_next = len(items) > self.per_page
+            return self._get_page(items[:self.per_page], has_next, False)
+        values, backward = self.decode_cursor(token)
+        queryset = self.object_list.filter(self._seek(values, backward))
+        if backward:
+            queryset = queryset.reverse()
+        items = list(queryset[:self.per_page + 1])
+        more = len(items) > self.per_page
+        items = items[:self.per_page]
+        if backward:
+            items.reverse()
+            return self._get_page(items, True, more)
+        return self._get_page(items, more, True)
+
+    def get_page(self, token=None):
+        try:
+            return self.page(token)
+        except InvalidCursor:
+            return self.page()
+
+    def first_page(self):
+        """Первая страница в виде обычной Page одним запросом с LIMIT
+        per_page + 1, без COUNT(*).
+
+        Paginator строится по уже выбранным записям, поэтому его count
+        говорит только, есть ли следующая страница; ссылки ведут по
+        курсору, а номера страниц шаблон не выводит.
+        """
+        items = list(self.object_list[:self.per_page + 1])
+        page = self.annotate(Paginator(items, self.per_page).page(1))
+        page.first_by_cursor = True
+        return page
+
+    def annotate(self, page):
+        """Добавляет курсоры соседних страниц к обычной странице Paginator,
+        чтобы ссылки «вперёд/назад» не зависели от смещения."""
+        items = page.object_list = list(page.object_list)
+        page.next_cursor = page.previous_cursor = None
+        if items and page.has_next():
+            page.next_cursor = self.encode_cursor(items[-1])
+        if items and page.has_previous():
+            page.previous_cursor = self.encode_cursor(items[0], True)
+        return page
+
+    def _get_page(self, items, has_next, has_previous):
+        next_cursor = previous_cursor = None
+        if items and has_next:
+            next_cursor = self.encode_cursor(items[-1])
+        if items and has_previous:
+            previous_cursor = self.encode_cursor(items[0], True)
+        return CursorPage(items, self, next_cursor, previous_cursor)
+
+
+class CursorPage(collections.abc.Sequence):
+
+    def __init__(self, object_list, paginator, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return f'<CursorPage of {len(self.object_list)} items>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
@@ -0,0 +1,127 @@
+"""Чтение лент и страниц записей с реплик базы.
+
+На реплику уходят только чтения внутри GET- и HEAD-запросов к
+представлениям из REPLICA_VIEWS; записи, сессии, команды и фоновые
+потоки всегда работают с основной базой. После записи ReplicaMiddleware
+ставит посетителю cookie, и REPLICA_PIN_SECONDS секунд его чтения тоже
+идут в основную базу, чтобы он сразу увидел свою запись. Реплика, не
+ответившая на проверку, пропускается до следующей проверки через
+REPLICA_CHECK_INTERVAL секунд; если живых реплик нет, читается основная
+база.
+"""
+import logging
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+PIN_COOKIE = 'primary_db'
+# Сессии читаются до разбора URL и сразу после входа, задержка реплики
+# для них недопустима.
+PRIMARY_APPS = {'sessions'}
+
+_current = ContextVar('replica_request', default=None)
+_health = {}
+_health_lock = threading.Lock()
+
+
+class _Request:
+    """Состояние одного запроса. Изменяется на месте, а не через
+    ContextVar.set, потому что sync_to_async выполняет представление
+    в копии контекста."""
+
+    def __init__(self, request):
+        self.request = request
+        self.alias = None
+        self.wrote = False
+
+    def replica(self):
+        if self.wrote or self.request.method not in ('GET', 'HEAD'):
+            return None
+        if PIN_COOKIE in self.request.COOKIES:
+            return None
+        # До разбора URL (сессия, пользователь) читается основная база.
+        match = self.request.resolver_match
+        if match is None or match.view_name not in settings.REPLICA_VIEWS:
+            return None
+        if self.alias is None:
+            # Все чтения запроса идут в одну реплику, чтобы страница не
+            # собиралась из данных с разной задержкой.
+            replicas = healthy_replicas()
+            self.alias = (random.choice(replicas) if replicas
+                          else DEFAULT_DB_ALIAS)
+        return self.alias
+
+
+def _check(alias):
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute('SELECT 1 FROM django_migrations LIMIT 1')
+    except DatabaseError:
+        logger.warning('Реплика %s недоступна', alias, exc_info=True)
+        connections[alias].close()
+        return False
+    return True
+
+
+def healthy_replicas():
+    """Реплики, прошедшие последнюю проверку."""
+    now = time.monotonic()
+    healthy = []
+    for alias in settings.REPLICA_DATABASES:
+        with _health_lock:
+            ok, checked = _health.get(alias, (None, 0.0))
+        if ok is None or now - checked >= settings.REPLICA_CHECK_INTERVAL:
+            ok = _check(alias)
+            with _health_lock:
+                _health[alias] = (ok, now)
+        if ok:
+            healthy.append(alias)
+    return healthy
+
+
+def reset_health():
+    with _health_lock:
+        _health.clear()
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        state = _current.get()
+        if state is None or model._meta.app_label in PRIMARY_APPS:
+            return None
+        return state.replica()
+
+    def db_for_write(self, model, **hints):
+        state = _current.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики содержат те же строки, что и основная база.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.REPLICA_DATABASES
+
+
+def used_replica():
+    """Читал ли текущий запрос данные с реплики."""
+    state = _current.get()
+    return state is not None and state.alias not in (None, DEFAULT_DB_ALIAS)
+
+
+def start_request(request):
+    state = _Request(request)
+    return state, _current.set(state)
+
+
+def finish_request(token):
+    _current.reset(token)
@@ -0,0 +1,49 @@
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+from posts.models import Post
+
+FTS_TABLE = 'posts_post_fts'
+# Вес совпадения в тексте записи и в названии сообщества для bm25.
+TEXT_WEIGHT = 1.0
+GROUP_WEIGHT = 0.5
+WORD = re.compile(r'\w+')
+
+
+def fts_query(query):
+    """Превращает ввод пользователя в запрос FTS5: каждое слово ищется
+    как префикс, все слова обязательны. Операторы и кавычки FTS5 из
+    ввода не попадают в запрос."""
+    return ' '.join(f'"{word}"*' for word in WORD.findall(query.lower()))
+
+
+def search_posts(query):
+    """Записи, подходящие под запрос, от самых релевантных.
+
+    На SQLite используется FTS5-таблица с ранжированием bm25, на других
+    базах - icontains по тексту и названию сообщества.
+    """
+    posts = Post.objects.select_related('author', 'group')
+    match = fts_query(query)
+    if not match:
+        return posts.none()
+    if connection.vendor != 'sqlite':
+        return search_posts_icontains(query)
+    # JOIN с виртуальной таблицей ORM выразить не может, поэтому extra.
+    return posts.extra(
+        tables=[FTS_TABLE],
+        where=[f'{FTS_TABLE}.rowid = posts_post.id',
+               f'{FTS_TABLE} MATCH %s'],
+        params=[match],
+        select={'rank': f'bm25({FTS_TABLE}, %s, %s)'},
+        select_params=(TEXT_WEIGHT, GROUP_WEIGHT),
+    ).order_by('rank', '-pub_date')
+
+
+def search_posts_icontains(query):
+    """Прежний путь через LIKE, для сравнения в bench_search."""
+    return Post.objects.select_related('author', 'group').filter(
+        Q(text__icontains=query) | Q(group__title__icontains=query)
+    ).order_by('-pub_date', '-id')
@@ -0,0 +1,153 @@
+import io
+import random
+from itertools import accumulate
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from PIL import Image
+
+from posts import counters, timeline
+from posts.images import describe
+from posts.models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+BATCH_SIZE = 1000
+WORDS = (
+    'лето море горы город кофе книга музыка код python django утро вечер '
+    'дорога дом кот собака весна осень зима снег дождь солнце друзья '
+    'работа отпуск фото поход велосипед концерт кино театр'
+).split()
+
+
+class Zipf:
+    """Выбор элементов с распределением Ципфа: немногие популярные авторы,
+    записи и сообщества получают большую часть активности."""
+
+    def __init__(self, items, exponent=1.1, rng=random):
+        self.items = list(items)
+        self.rng = rng
+        self.weights = list(accumulate(
+            1 / (rank ** exponent) for rank in range(1, len(self.items) + 1)))
+
+    def choice(self):
+        return self.rng.choices(self.items, cum_weights=self.weights)[0]
+
+
+def _text(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def _images(rng, count, prefix):
+    names = []
+    for i in range(count):
+        color = tuple(rng.randrange(256) for _ in range(3))
+        buffer = io.BytesIO()
+        Image.new('RGB', (1280, 720), color).save(buffer, 'JPEG')
+        names.append(Post.image.field.storage.save(
+            f'posts/{prefix}_{i}.jpg', ContentFile(buffer.getvalue())))
+    return names
+
+
+def _ids(queryset):
+    return list(queryset.order_by('pk').values_list('pk', flat=True))
+
+
+def seed(users=100, groups=10, posts=1000, comments=3000, follows=1000,
+         images=0.1, image_pool=10, prefix='seed', random_seed=0,
+         stdout=None):
+    """Заполняет базу синтетическими данными с реалистичной асимметрией.
+
+    Сигналы не вызываются (bulk_create), поэтому размеры картинок
+    заполняются здесь, а в конце пересчитываются счётчики и ленты подписок.
+    """
+    rng = random.Random(random_seed)
+
+    def log(message):
+        if stdout is not None:
+            stdout.write(message)
+
+    User.objects.bulk_create(
+        [User(username=f'{prefix}_user_{i}', first_name=f'Пользователь {i}')
+         for i in range(users)],
+        batch_size=BATCH_SIZE,
+    )
+    seeded = User.objects.filter(username__startswith=f'{prefix}_user_')
+    user_ids = _ids(seeded)
+    log(f'Пользователей: {len(user_ids)}')
+
+    Group.objects.bulk_create(
+        [Group(title=f'{prefix} сообщество {i}', slug=f'{prefix}-group-{i}',
+               description=_text(rng, 20))
+         for i in range(groups)],
+        batch_size=BATCH_SIZE,
+    )
+    group_ids = _ids(
+        Group.objects.filter(slug__startswith=f'{prefix}-group-'))
+    log(f'Сообществ: {len(group_ids)}')
+
+    pool = _images(rng, image_pool, prefix) if images and posts else []
+    storage = Post.image.field.storage
+    described = {}
+    for name in pool:
+        with storage.open(name) as file:
+            described[name] = describe(file)
+    authors = Zipf(user_ids, rng=rng)
+    group_choice = Zipf(group_ids, rng=rng) if group_ids else None
+    batch = []
+    for _ in range(posts):
+        image = rng.choice(pool) if pool and rng.random() < images else ''
+        width, height, placeholder = described.get(image, (None, None, ''))
+        batch.append(Post(
+            text=_text(rng, rng.randint(5, 60)),
+            author_id=authors.choice(),
+            group_id=(group_choice.choice()
+                      if group_choice and rng.random() < 0.5 else None),
+            image=image,
+            image_width=width,
+            image_height=height,
+            image_placeholder=placeholder,
+        ))
+        if len(batch) == BATCH_SIZE:
+            Post.objects.bulk_create(batch)
+            batch = []
+    Post.objects.bulk_create(batch)
+    seeded_posts = Post.objects.filter(author__in=seeded)
+    post_ids = _ids(seeded_posts)
+    log(f'Записей: {len(post_ids)}')
+
+    # Свежие записи комментируют чаще, поэтому ранжируем от новых к старым.
+    commented = Zipf(reversed(post_ids), rng=rng) if post_ids else None
+    commenters = Zipf(user_ids, exponent=0.8, rng=rng)
+    batch = []
+    for _ in range(comments if commented else 0):
+        batch.append(Comment(
+            post_id=commented.choice(),
+            author_id=commenters.choice(),
+            text=_text(rng, rng.randint(3, 30)),
+        ))
+        if len(batch) == BATCH_SIZE:
+            Comment.objects.bulk_create(batch)
+            batch = []
+    Comment.objects.bulk_create(batch)
+    log(f'Комментариев: {comments if commented else 0}')
+
+    edges = set()
+    attempts = 0
+    while len(edges) < follows and attempts < follows * 10:
+        attempts += 1
+        user_id, author_id = commenters.choice(), authors.choice()
+        if user_id != author_id:
+            edges.add((user_id, author_id))
+    Follow.objects.bulk_create(
+        [Follow(user_id=user_id, author_id=author_id)
+         for user_id, author_id in edges],
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    log(f'Подписок: {len(edges)}')
+
+    counters.recount_comments(seeded_posts)
+    counters.recount_authors(seeded)
+    timeline.rebuild(seeded)
+    return user_ids, group_ids, post_ids
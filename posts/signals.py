@@ -0,0 +1,257 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+
+from posts import counters, images, storage, thumbnails, timeline
+from posts.cache import (author_scope, bump_page_version, group_scope,
+                         invalidate_post_cards, post_scope)
+from posts.models import AuthorStats, Comment, Follow, Group, Post
+from posts.utils import invalidate_followees
+
+User = get_user_model()
+
+
+def _bump_after_commit(scopes):
+    scopes = {scope for scope in scopes if scope}
+    if scopes:
+        transaction.on_commit(lambda: bump_page_version(*scopes))
+
+
+def _author_scopes(user_ids):
+    return [author_scope(username) for username in User.objects.filter(
+        pk__in=user_ids).values_list('username', flat=True)]
+
+
+def _group_scopes(group_ids):
+    return [group_scope(slug) for slug in Group.objects.filter(
+        pk__in=group_ids).values_list('slug', flat=True)]
+
+
+def _release_image(name, manifest):
+    storage.release(name)
+    images.release_derivatives(manifest)
+
+
+@receiver(post_save, sender=User)
+def create_author_stats(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        AuthorStats.objects.get_or_create(user=instance)
+
+
+@receiver(post_save, sender=Post)
+def post_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.bump_author(instance.author_id, posts_count=1)
+        timeline.push_post(instance)
+
+
+@receiver(post_save, sender=Post)
+def post_image_saved(sender, instance, raw=False, **kwargs):
+    if raw or not instance.image or images.manifest_ready(instance):
+        return
+    post_id, name = instance.pk, instance.image.name
+    transaction.on_commit(lambda: thumbnails.enqueue(post_id, name))
+
+
+@receiver(pre_save, sender=Post)
+def post_image_described(sender, instance, raw=False, **kwargs):
+    # Размеры и заглушка считаются один раз при сохранении, чтобы лента
+    # не открывала исходные файлы.
+    if raw:
+        return
+    if not instance.image:
+        instance.image_width = instance.image_height = None
+        instance.image_placeholder = ''
+    elif not instance.image._committed or instance.image_width is None:
+        (instance.image_width, instance.image_height,
+         instance.image_placeholder) = images.describe_image(instance.image)
+
+
+@receiver(pre_save, sender=Post)
+def post_remember_old(sender, instance, raw=False, **kwargs):
+    # Прежние файл, автор и сообщество нужны после сохранения.
+    instance._old = {}
+    if not raw and instance.pk is not None:
+        instance._old = Post.objects.filter(pk=instance.pk).values(
+            'image', 'image_manifest', 'author_id', 'group_id').first() or {}
+
+
+@receiver(post_save, sender=Post)
+def post_author_changed(sender, instance, created, raw=False, **kwargs):
+    # Автора можно сменить в админке, счётчик записи переходит к новому.
+    old = getattr(instance, '_old', {}).get('author_id')
+    if not created and old and old != instance.author_id:
+        counters.bump_author(old, posts_count=-1)
+        counters.bump_author(instance.author_id, posts_count=1)
+
+
+@receiver(post_save, sender=Post)
+def post_image_replaced(sender, instance, raw=False, **kwargs):
+    old = getattr(instance, '_old', {})
+    if old.get('image') and old['image'] != instance.image.name:
+        transaction.on_commit(lambda: _release_image(
+            old['image'], old['image_manifest']))
+
+
+@receiver(post_delete, sender=Post)
+def post_image_deleted(sender, instance, **kwargs):
+    # Файл общий для одинаковых загрузок, удаляем его только после
+    # коммита и только если на него больше никто не ссылается.
+    name, manifest = instance.image.name, instance.image_manifest
+    if name:
+        transaction.on_commit(lambda: _release_image(name, manifest))
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    counters.bump_author(instance.author_id, posts_count=-1)
+
+
+@receiver(pre_save, sender=Comment)
+def comment_remember_old(sender, instance, raw=False, **kwargs):
+    instance._old_post_id = None
+    if not raw and instance.pk is not None:
+        instance._old_post_id = Comment.objects.filter(
+            pk=instance.pk).values_list('post_id', flat=True).first()
+
+
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.bump_comments(instance.post_id, 1)
+
+
+@receiver(post_save, sender=Comment)
+def comment_moved(sender, instance, created, raw=False, **kwargs):
+    # Комментарий можно перенести к другой записи в админке.
+    old = getattr(instance, '_old_post_id', None)
+    if not created and old and old != instance.post_id:
+        counters.bump_comments(old, -1)
+        counters.bump_comments(instance.post_id, 1)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    counters.bump_comments(instance.post_id, -1)
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.bump_author(instance.author_id, followers_count=1)
+        counters.bump_author(instance.user_id, following_count=1)
+        timeline.sync_mode(instance.author_id)
+        timeline.backfill(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    counters.bump_author(instance.author_id, followers_count=-1)
+    counters.bump_author(instance.user_id, following_count=-1)
+    timeline.remove(instance.user_id, instance.author_id)
+    timeline.sync_mode(instance.author_id)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_pages(sender, **kwargs):
+    # До коммита параллельный запрос ещё видит старые данные и сохранил
+    # бы их под новой версией.
+    transaction.on_commit(bump_page_version)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post_pages(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    old = getattr(instance, '_old', {})
+    _bump_after_commit([
+        post_scope(instance.pk),
+        *_author_scopes({instance.author_id, old.get('author_id')}),
+        *_group_scopes({instance.group_id, old.get('group_id')}),
+    ])
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_commented_post_pages(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    post_ids = {instance.post_id, getattr(instance, '_old_post_id', None)}
+    scopes = [post_scope(post_id) for post_id in post_ids if post_id]
+    for author, group in Post.objects.filter(pk__in=post_ids).values_list(
+            'author__username', 'group__slug'):
+        scopes += [author_scope(author), group and group_scope(group)]
+    _bump_after_commit(scopes)
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_follow_pages(sender, instance, raw=False, **kwargs):
+    # Меняются счётчики подписок обоих и кнопка подписки на профиле.
+    if not raw:
+        _bump_after_commit(
+            _author_scopes({instance.user_id, instance.author_id}))
+
+
+@receiver(pre_save, sender=Group)
+def group_remember_old(sender, instance, raw=False, **kwargs):
+    instance._old_slug = None
+    if not raw and instance.pk is not None:
+        instance._old_slug = Group.objects.filter(
+            pk=instance.pk).values_list('slug', flat=True).first()
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post_card(sender, instance, **kwargs):
+    invalidate_post_cards([instance.pk])
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_commented_post_card(sender, instance, **kwargs):
+    old = getattr(instance, '_old_post_id', None)
+    invalidate_post_cards({instance.post_id, old} - {None})
+
+
+@receiver(post_save, sender=Group)
+@receiver(pre_delete, sender=Group)
+def invalidate_group_post_cards(sender, instance, created=False, raw=False,
+                                **kwargs):
+    if created or raw:
+        return
+    # Название сообщества выводится в карточках его записей, на их
+    # страницах и в профилях их авторов.
+    scopes = {group_scope(instance.slug)}
+    old_slug = getattr(instance, '_old_slug', None)
+    if old_slug:
+        scopes.add(group_scope(old_slug))
+    rows = instance.posts.values_list('pk', 'author__username')
+    batch = []
+    for post_id, author in rows.iterator(chunk_size=1000):
+        batch.append(post_id)
+        scopes.update((post_scope(post_id), author_scope(author)))
+        if len(batch) == 1000:
+            invalidate_post_cards(batch)
+            batch = []
+    invalidate_post_cards(batch)
+    _bump_after_commit(scopes)
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_follow_cache(sender, instance, **kwargs):
+    # Повторная очистка после коммита не даёт параллельному запросу
+    # закешировать старое множество до завершения транзакции.
+    invalidate_followees(instance.user_id)
+    transaction.on_commit(lambda: invalidate_followees(instance.user_id))
@@ -0,0 +1,109 @@
+import hashlib
+import os
+import posixpath
+import re
+import time
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import FileSystemStorage
+from django.utils.crypto import get_random_string
+from django.utils.deconstruct import deconstructible
+from sorl import thumbnail
+
+HASHED = re.compile(r'^posts/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.\w+$')
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранит файлы под именем из sha256 содержимого, разложенными по
+    вложенным каталогам: posts/ab/cd/abcd....jpg.
+
+    Одинаковые загрузки сохраняются один раз, второй файл не пишется,
+    а только обновляет mtime существующего (см. discard).
+    """
+
+    def content_name(self, name, content):
+        digest = hashlib.sha256()
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        digest = digest.hexdigest()
+        extension = os.path.splitext(name)[1].lower()
+        return posixpath.join(
+            posixpath.dirname(name), digest[:2], digest[2:4],
+            digest + extension)
+
+    def _save(self, name, content):
+        name = self.content_name(name, content)
+        if self.exists(name) and touch(self.path(name)):
+            return name
+        # Файл пишется под временным именем и встаёт на место одним
+        # rename: параллельная загрузка того же содержимого не получает
+        # имя со случайным суффиксом, а читатели не видят недописанный
+        # файл.
+        temporary = super()._save(
+            f'{name}.{get_random_string(12)}.part', content)
+        os.replace(self.path(temporary), self.path(name))
+        return name
+
+
+def touch(path):
+    """Отмечает, что файл снова взят в работу. False, если файла уже
+    нет."""
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def discard(storage, name, in_use):
+    """Удаляет файл, если in_use() ложно и файл не брали последние
+    IMAGE_RELEASE_GRACE секунд. Возвращает True, если файл удалён.
+
+    Загрузка, взявшая существующий файл, ссылается на него из базы только
+    после коммита, поэтому свежий файл не трогается, его потом заберёт
+    sweep_images. Файл сначала переименовывается, и если за это время
+    его взяли (touch) или на него сослались, возвращается на место.
+    """
+    try:
+        path = storage.path(name)
+        modified = os.path.getmtime(path)
+    except (OSError, SuspiciousFileOperation):
+        # Имя вне MEDIA_ROOT (например, из фикстуры) - файл не наш.
+        return False
+    if (time.time() - modified < settings.IMAGE_RELEASE_GRACE
+            or in_use()):
+        return False
+    trash = f'{path}.{get_random_string(12)}.trash'
+    try:
+        os.rename(path, trash)
+    except FileNotFoundError:
+        return False
+    if os.path.getmtime(trash) != modified or in_use():
+        try:
+            os.link(trash, path)
+        except FileExistsError:
+            # Загрузка уже записала файл заново.
+            pass
+        os.remove(trash)
+        return False
+    os.remove(trash)
+    return True
+
+
+def release(name):
+    """Удаляет файл изображения и его миниатюры, если на него больше не
+    ссылается ни одна запись."""
+    from posts.models import Post
+
+    if not name or not discard(
+            Post.image.field.storage, name,
+            lambda: Post.objects.filter(image=name).exists()):
+        return False
+    thumbnail.delete(name, delete_file=False)
+    return True
@@ -0,0 +1,39 @@
+from django import template
+from django.core.exceptions import SuspiciousFileOperation
+
+from posts import images, thumbnails
+
+register = template.Library()
+
+
+@register.simple_tag
+def post_thumbnail(post):
+    """Готовая миниатюра изображения записи или None.
+
+    Если миниатюры ещё нет, она ставится в очередь, а шаблон показывает
+    оригинал: запрос не ждёт декодирования и пережатия картинки.
+    """
+    name = post.image.name
+    if not name:
+        return None
+    if hasattr(post, 'thumbnail'):
+        # Миниатюры страницы уже найдены одним запросом (resolve).
+        thumbnail = post.thumbnail
+    else:
+        thumbnail = thumbnails.ready(name)
+    if thumbnail is None and _exists(post.image):
+        thumbnails.enqueue(post.pk, name)
+    return thumbnail
+
+
+def _exists(image):
+    try:
+        return image.storage.exists(image.name)
+    except SuspiciousFileOperation:
+        return False
+
+
+@register.simple_tag
+def post_picture(post):
+    """Источники для <picture> из манифеста производных или None."""
+    return images.picture(post)
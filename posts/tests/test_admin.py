@@ -0,0 +1,87 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts.models import Comment, Group, Post
+
+User = get_user_model()
+
+
+class AdminChangelistTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.admin = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password')
+        cls.author = User.objects.create(username='TestAuthor')
+        cls.other = User.objects.create(username='OtherAuthor')
+        cls.group = Group.objects.create(
+            title='Группа', slug='test-slug', description='Сообщество')
+        cls.posts = [
+            Post.objects.create(
+                text=f'Пост {i}', author=cls.author, group=cls.group)
+            for i in range(5)
+        ]
+        Post.objects.create(text='Чужой пост', author=cls.other)
+        for post in cls.posts:
+            Comment.objects.create(post=post, author=cls.other, text='Да')
+        cls.post_list = reverse('admin:posts_post_changelist')
+        cls.comment_list = reverse('admin:posts_comment_changelist')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def queries(self, url, data=None):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(url, data)
+        self.assertEqual(response.status_code, 200)
+        return len(captured), response
+
+    def test_queries_do_not_grow_with_rows(self):
+        """Число запросов списка не зависит от числа строк на странице."""
+        for url in (self.post_list, self.comment_list):
+            with self.subTest(url=url):
+                before, _ = self.queries(url)
+                post = Post.objects.create(
+                    text='Ещё', author=self.other, group=self.group)
+                Comment.objects.create(post=post, author=self.author, text='')
+                after, _ = self.queries(url)
+                self.assertEqual(before, after)
+
+    def test_author_filter(self):
+        """Фильтр по автору принимает имя пользователя и не выводит
+        список всех пользователей."""
+        _, response = self.queries(self.post_list, {'author': 'OtherAuthor'})
+        self.assertEqual(response.context['cl'].result_count, 1)
+        self.assertNotContains(response, '?author__id__exact=')
+        _, response = self.queries(
+            self.comment_list, {'author': 'OtherAuthor'})
+        self.assertEqual(response.context['cl'].result_count, 5)
+
+    def test_date_hierarchy(self):
+        """Переходы по годам и месяцам строятся без SELECT DISTINCT."""
+        today = self.posts[0].pub_date
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(
+                self.post_list, {'pub_date__year': today.year})
+        self.assertContains(response, f'pub_date__month={today.month}')
+        self.assertFalse(
+            [query for query in captured if 'DISTINCT' in query['sql']])
+
+    def test_estimated_count(self):
+        """Для большой таблицы без фильтров число строк оценивается, а
+        полный COUNT(*) не выполняется."""
+        with mock.patch('posts.admin.ESTIMATE_THRESHOLD', 1):
+            with CaptureQueriesContext(connection) as captured:
+                response = self.client.get(self.post_list)
+        self.assertEqual(
+            response.context['cl'].result_count,
+            Post.objects.order_by('pk').last().pk)
+        self.assertFalse([
+            query for query in captured
+            if 'COUNT(*)' in query['sql'] and 'posts_post' in query['sql']
+        ])
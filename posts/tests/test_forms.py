@@ -1,11 +1,13 @@
+import io
 import shutil
 import tempfile
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import Client, TestCase
+from django.test import Client, TestCase, override_settings
 from django.urls import reverse
+from PIL import Image
 
 from posts.models import Comment, Group, Post
 
@@ -98,6 +100,63 @@ class PostFormTests(TestCase):
         self.assertEqual(post.text, form_data['text'])
         self.assertEqual(post.group.id, form_data['group'])
 
+    @staticmethod
+    def jpeg(name, size):
+        buffer = io.BytesIO()
+        Image.new('RGB', size, (0, 120, 200)).save(buffer, 'JPEG')
+        return SimpleUploadedFile(
+            name, buffer.getvalue(), content_type='image/jpeg')
+
+    @override_settings(IMAGE_MAX_SIDE=500)
+    def test_large_image_is_downscaled(self):
+        """Слишком большой оригинал уменьшается до IMAGE_MAX_SIDE с
+        сохранением пропорций."""
+        self.authorized_client.post(
+            reverse('posts:new_post'),
+            data={'text': 'Большая картинка',
+                  'image': self.jpeg('big.jpg', (2000, 1000))},
+        )
+        post = Post.objects.get(text='Большая картинка')
+        with Image.open(post.image.path) as image:
+            self.assertEqual(image.size, (500, 250))
+            self.assertEqual(image.format, 'JPEG')
+
+    @override_settings(IMAGE_MAX_PIXELS=1000)
+    def test_too_many_pixels_are_rejected(self):
+        """Картинка с числом пикселей больше IMAGE_MAX_PIXELS не
+        принимается."""
+        response = self.authorized_client.post(
+            reverse('posts:new_post'),
+            data={'text': 'Огромная картинка',
+                  'image': self.jpeg('huge.jpg', (100, 100))},
+        )
+        self.assertFormError(
+            response, 'form', 'image',
+            'Изображение слишком большое: 100 x 100.')
+        self.assertFalse(
+            Post.objects.filter(text='Огромная картинка').exists())
+
+    @override_settings(IMAGE_MAX_DECODED_PIXELS=1000)
+    def test_undraftable_formats_have_lower_limit(self):
+        """PNG декодируется целиком, поэтому его порог по пикселям ниже,
+        чем у JPEG того же размера."""
+        buffer = io.BytesIO()
+        Image.new('RGB', (100, 100), (0, 120, 200)).save(buffer, 'PNG')
+        png = SimpleUploadedFile(
+            'huge.png', buffer.getvalue(), content_type='image/png')
+        response = self.authorized_client.post(
+            reverse('posts:new_post'),
+            data={'text': 'Огромный PNG', 'image': png},
+        )
+        self.assertFormError(
+            response, 'form', 'image',
+            'Изображение слишком большое: 100 x 100.')
+        self.authorized_client.post(
+            reverse('posts:new_post'),
+            data={'text': 'JPEG', 'image': self.jpeg('ok.jpg', (100, 100))},
+        )
+        self.assertTrue(Post.objects.filter(text='JPEG').exists())
+
 
 class CommentFormTests(TestCase):
     @classmethod
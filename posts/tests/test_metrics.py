@@ -0,0 +1,102 @@
+import shutil
+import tempfile
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from posts.cache import page_cache_stats
+from posts.metrics import Histogram, load_stats, recorder
+from posts.models import Post
+
+User = get_user_model()
+METRICS_DIR = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+
+@override_settings(QUERY_BUDGET_ENABLED=True, QUERY_BUDGET_DIR=METRICS_DIR)
+class QueryBudgetTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.author = User.objects.create(username='TestAuthor')
+        Post.objects.create(text='Тестовый пост', author=cls.author)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(METRICS_DIR, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        recorder.windows.clear()
+        shutil.rmtree(METRICS_DIR, ignore_errors=True)
+
+    def test_histogram_percentiles(self):
+        """Перцентили гистограммы отличаются от точных не больше чем
+        на 10%."""
+        histogram = Histogram()
+        for value in range(1, 1001):
+            histogram.add(value)
+        for q, expected in ((50, 500), (95, 950), (99, 990)):
+            with self.subTest(q=q):
+                self.assertAlmostEqual(
+                    histogram.percentile(q), expected, delta=expected * 0.1)
+
+    def test_middleware_records_views(self):
+        """Middleware записывает число запросов и время по имени URL."""
+        Client().get(reverse('posts:index'))
+        recorder.flush()
+        stats = load_stats()
+        self.assertEqual(stats['posts:index'].requests, 1)
+        self.assertGreater(
+            stats['posts:index'].histograms['queries'].percentile(50), 0)
+        self.assertGreater(
+            stats['posts:index'].histograms['template_ms'].percentile(50), 0)
+        self.assertEqual(list(stats['posts:index'].page_sizes), [1])
+
+    def test_view_stats_flags_growing_query_count(self):
+        """view_stats отмечает view, где запросов тем больше, чем больше
+        записей на странице."""
+        sample = {'db_ms': 1, 'template_ms': 1, 'total_ms': 2}
+        for size in (1, 5, 10):
+            recorder.record('posts:slow', {**sample, 'queries': 2 + size},
+                            size)
+            recorder.record('posts:fast', {**sample, 'queries': 3}, size)
+        recorder.flush()
+        out = StringIO()
+        call_command('view_stats', stdout=out)
+        self.assertIn('posts:slow: число запросов растёт', out.getvalue())
+        self.assertNotIn('posts:fast: число запросов растёт', out.getvalue())
+
+
+class CacheMetricsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.author = User.objects.create(username='TestAuthor')
+
+    def test_refuses_process_local_cache(self):
+        """Команда не показывает нули из кеша в памяти своего процесса."""
+        with self.assertRaisesMessage(CommandError, 'CACHE_URL'):
+            call_command('metrics', stdout=StringIO())
+
+    def test_reads_shared_cache(self):
+        """Счётчики страниц видны команде через общий кеш."""
+        location = tempfile.mkdtemp(dir=settings.BASE_DIR)
+        self.addCleanup(shutil.rmtree, location, ignore_errors=True)
+        shared = {'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': location,
+        }}
+        with override_settings(CACHES=shared):
+            url = reverse('posts:profile', kwargs={'username': 'TestAuthor'})
+            self.client.get(url)
+            self.client.get(url)
+            self.assertEqual(page_cache_stats()['hits'], 1)
+            out = StringIO()
+            call_command('metrics', stdout=out)
+        self.assertIn('попаданий 1, промахов 1', out.getvalue())
@@ -1,7 +1,23 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from PIL import Image
 
-from posts.models import Comment, Group, Post
+from posts import images
+from posts import storage as posts_storage
+from posts.models import AuthorStats, Comment, Follow, Group, Post
 
 User = get_user_model()
 
@@ -101,3 +117,355 @@ class CommentModelTest(TestCase):
         comments_count = Comment.objects.count()
         self.post.delete()
         self.assertNotEqual(comments_count, Comment.objects.count())
+
+
+class CountersTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.author = User.objects.create(username='TestAuthor')
+        cls.user = User.objects.create(username='TestUser')
+        cls.post = Post.objects.create(text='Текст', author=cls.author)
+
+    def assertStats(self, user, **expected):
+        stats = AuthorStats.objects.get(user=user)
+        for field, value in expected.items():
+            with self.subTest(field=field):
+                self.assertEqual(getattr(stats, field), value)
+
+    def test_comments_count(self):
+        """Счётчик комментариев меняется при создании и удалении."""
+        comment = Comment.objects.create(
+            text='Текст', author=self.user, post=self.post)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 1)
+        comment.delete()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 0)
+
+    def test_author_counters(self):
+        """Счётчики записей и подписок автора меняются при создании
+        и удалении."""
+        self.assertStats(self.author, posts_count=1)
+        follow = Follow.objects.create(user=self.user, author=self.author)
+        self.assertStats(self.author, followers_count=1, following_count=0)
+        self.assertStats(self.user, followers_count=0, following_count=1)
+        follow.delete()
+        self.post.delete()
+        self.assertStats(self.author, posts_count=0, followers_count=0)
+        self.assertStats(self.user, following_count=0)
+
+    def test_counters_follow_reassignment(self):
+        """Смена автора записи или записи комментария (как в админке)
+        переносит счётчики."""
+        other = Post.objects.create(text='Другая', author=self.user)
+        comment = Comment.objects.create(
+            text='Текст', author=self.user, post=self.post)
+        comment.post = other
+        comment.save()
+        for post, count in ((self.post, 0), (other, 1)):
+            post.refresh_from_db()
+            self.assertEqual(post.comments_count, count)
+        self.post.author = self.user
+        self.post.save()
+        self.assertStats(self.author, posts_count=0)
+        self.assertStats(self.user, posts_count=2)
+
+    def test_recount_counters_command(self):
+        """Команда recount_counters исправляет расхождения счётчиков."""
+        Post.objects.bulk_create([Post(text='Текст', author=self.author)])
+        Comment.objects.bulk_create(
+            [Comment(text='Текст', author=self.user, post=self.post)])
+        AuthorStats.objects.filter(user=self.user).delete()
+        call_command('recount_counters', stdout=StringIO())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 1)
+        self.assertStats(self.author, posts_count=2)
+        self.assertStats(self.user, posts_count=0)
+
+
+class SeedCommandTest(TestCase):
+    def test_seed_creates_consistent_data(self):
+        """Команда seed создаёт данные с согласованными счётчиками
+        и лентами подписок."""
+        call_command('seed', users=10, groups=2, posts=50, comments=40,
+                     follows=15, images=0, stdout=StringIO())
+        self.assertEqual(User.objects.count(), 10)
+        self.assertEqual(Post.objects.count(), 50)
+        self.assertEqual(Comment.objects.count(), 40)
+        for stats in AuthorStats.objects.select_related('user'):
+            with self.subTest(user=stats.user):
+                self.assertEqual(
+                    stats.posts_count, stats.user.posts.count())
+                self.assertEqual(
+                    stats.followers_count, stats.user.following.count())
+        follow = Follow.objects.first()
+        self.assertTrue(follow.user.timeline.filter(
+            post__author=follow.author).exists())
+
+
+class ImageStorageTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp(dir=settings.BASE_DIR)
+        cls.media = override_settings(
+            MEDIA_ROOT=cls.media_root, IMAGE_RELEASE_GRACE=0)
+        cls.media.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.media.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = User.objects.create(username='TestUser')
+        cls.content = (
+            b'\x47\x49\x46\x38\x39\x61\x01\x00'
+            b'\x01\x00\x00\x00\x00\x21\xf9\x04'
+            b'\x01\x0a\x00\x01\x00\x2c\x00\x00'
+            b'\x00\x00\x01\x00\x01\x00\x00\x02'
+            b'\x02\x4c\x01\x00\x3b'
+        )
+
+    def create_post(self, name='small.gif'):
+        return Post.objects.create(
+            text='Тестовый пост', author=self.user,
+            image=SimpleUploadedFile(name, self.content, 'image/gif'))
+
+    def test_identical_uploads_are_stored_once(self):
+        """Одинаковые загрузки получают одно имя из хеша содержимого,
+        разложенное по подкаталогам."""
+        first = self.create_post('one.gif')
+        second = self.create_post('two.gif')
+        digest = hashlib.sha256(self.content).hexdigest()
+        self.assertEqual(
+            first.image.name, f'posts/{digest[:2]}/{digest[2:4]}/{digest}.gif')
+        self.assertEqual(first.image.name, second.image.name)
+
+    def test_file_is_deleted_with_last_reference(self):
+        """Файл удаляется только вместе с последней записью, которая
+        на него ссылается."""
+        first, second = self.create_post(), self.create_post()
+        storage = first.image.storage
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(storage.exists(second.image.name))
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(storage.exists(second.image.name))
+
+    def test_concurrent_identical_upload_keeps_hash_name(self):
+        """Если одинаковый файл появился между проверкой и записью,
+        загрузка всё равно получает имя из хеша, а не со случайным
+        суффиксом."""
+        first = self.create_post()
+        storage = first.image.storage
+        with mock.patch.object(type(storage), 'exists', return_value=False):
+            second = self.create_post()
+        self.assertEqual(second.image.name, first.image.name)
+        self.assertEqual(
+            os.listdir(os.path.dirname(first.image.path)),
+            [os.path.basename(first.image.name)])
+
+    def test_recent_file_is_left_for_sweep(self):
+        """Файл, который недавно брала загрузка, не удаляется сразу:
+        запись со ссылкой на него могла ещё не закоммититься. Его
+        удаляет sweep_images."""
+        post = self.create_post()
+        name, storage = post.image.name, post.image.storage
+        with override_settings(IMAGE_RELEASE_GRACE=3600):
+            with self.captureOnCommitCallbacks(execute=True):
+                post.delete()
+            self.assertTrue(storage.exists(name))
+            call_command('sweep_images', stdout=StringIO())
+            self.assertTrue(storage.exists(name))
+        kept = Post.objects.create(
+            text='Другая картинка', author=self.user,
+            image=storage.save('posts/kept.gif', ContentFile(b'GIF89a')))
+        call_command('sweep_images', stdout=StringIO())
+        self.assertFalse(storage.exists(name))
+        self.assertTrue(storage.exists(kept.image.name))
+
+    def test_file_taken_during_release_is_restored(self):
+        """Если на файл сослались, пока он удалялся, он остаётся."""
+        post = self.create_post()
+        storage = post.image.storage
+        in_use = mock.Mock(side_effect=[False, True])
+        self.assertFalse(
+            posts_storage.discard(storage, post.image.name, in_use))
+        self.assertTrue(storage.exists(post.image.name))
+        self.assertEqual(len(os.listdir(os.path.dirname(post.image.path))), 1)
+
+    def test_rehash_images_command(self):
+        """Команда rehash_images переносит старые плоские пути в
+        хранилище по хешу и удаляет старые файлы."""
+        storage = Post.image.field.storage
+        old = FileSystemStorage().save('posts/old.gif', ContentFile(
+            self.content))
+        posts = Post.objects.bulk_create([
+            Post(text=f'Старый пост {i}', author=self.user, image=old)
+            for i in range(3)
+        ])
+        call_command('rehash_images', batch_size=2, stdout=StringIO())
+        names = set(Post.objects.filter(
+            pk__in=[post.pk for post in posts]).values_list(
+                'image', flat=True))
+        self.assertEqual(len(names), 1)
+        name = names.pop()
+        self.assertRegex(name, r'^posts/\w\w/\w\w/[0-9a-f]{64}\.gif$')
+        self.assertTrue(storage.exists(name))
+        self.assertFalse(storage.exists(old))
+
+    def test_backfill_images_command(self):
+        """Команда backfill_images заполняет производные, размеры и
+        заглушки, пережимает оригиналы и продолжает с контрольной
+        точки."""
+        buffer = BytesIO()
+        Image.new('RGB', (800, 400), (10, 20, 30)).save(
+            buffer, 'JPEG', exif=Image.Exif())
+        name = Post.image.field.storage.save(
+            'posts/photo.jpg', ContentFile(buffer.getvalue()))
+        posts = Post.objects.bulk_create([
+            Post(text=f'Старый пост {i}', author=self.user, image=name)
+            for i in range(3)
+        ])
+        checkpoint = os.path.join(self.media_root, 'checkpoint.json')
+        with open(checkpoint, 'w') as file:
+            json.dump({'last_pk': posts[0].pk}, file)
+        call_command('backfill_images', workers=0, batch_size=1,
+                     checkpoint=checkpoint, optimize_originals=True,
+                     stdout=StringIO())
+        first, *rest = Post.objects.filter(
+            pk__in=[post.pk for post in posts]).order_by('pk')
+        self.assertIsNone(first.image_width)
+        # Старый файл остаётся, пока на него ссылается необработанная запись.
+        self.assertTrue(Post.image.field.storage.exists(name))
+        for post in rest:
+            with self.subTest(post=post.pk):
+                self.assertEqual(
+                    (post.image_width, post.image_height), (800, 400))
+                self.assertTrue(images.manifest_ready(post))
+                self.assertTrue(post.image_placeholder)
+                self.assertNotEqual(post.image.name, name)
+        with open(checkpoint) as file:
+            self.assertEqual(json.load(file)['last_pk'], posts[-1].pk)
+
+        # Повторный прогон с --force не пережимает уже пережатые файлы.
+        optimized = {post.pk: post.image.name for post in rest}
+        os.remove(checkpoint)
+        with mock.patch('posts.images.optimize_original',
+                        wraps=images.optimize_original) as optimize:
+            call_command('backfill_images', workers=0, force=True,
+                         optimize_originals=True, stdout=StringIO())
+        self.assertEqual(
+            [call.args[0] for call in optimize.call_args_list], [name])
+        self.assertEqual(dict(Post.objects.filter(
+            pk__in=optimized).values_list('pk', 'image')), optimized)
+
+
+class TransferCommandTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp(dir=settings.BASE_DIR)
+        cls.media = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.media.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+
+    def test_export_and_import_round_trip(self):
+        """Выгрузка и загрузка через JSON Lines сохраняют id, даты,
+        связи и файлы изображений и пересчитывают счётчики."""
+        call_command('seed', users=10, groups=2, posts=30, comments=40,
+                     follows=15, images=0, stdout=StringIO())
+        post = Post.objects.order_by('pk').first()
+        post.image = Post.image.field.storage.save(
+            'posts/photo.gif', ContentFile(b'GIF89a'))
+        post.save(update_fields=['image'])
+        expected = {
+            'posts': list(Post.objects.order_by('pk').values_list(
+                'pk', 'text', 'pub_date', 'author__username', 'group__slug',
+                'image', 'comments_count')),
+            'comments': list(Comment.objects.order_by('pk').values_list(
+                'pk', 'post_id', 'created', 'author__username')),
+            'follows': set(Follow.objects.values_list(
+                'user__username', 'author__username')),
+        }
+        path = os.path.join(self.media_root, 'dump.jsonl.gz')
+        media_dir = os.path.join(self.media_root, 'dump')
+        call_command('export_jsonl', path, media_dir=media_dir,
+                     stdout=StringIO())
+        Post.objects.all().delete()
+        Group.objects.all().delete()
+        User.objects.all().delete()
+        shutil.rmtree(os.path.join(self.media_root, 'posts'))
+
+        call_command('import_jsonl', path, media_dir=media_dir,
+                     batch_size=7, stdout=StringIO())
+        self.assertEqual(list(Post.objects.order_by('pk').values_list(
+            'pk', 'text', 'pub_date', 'author__username', 'group__slug',
+            'image', 'comments_count')), expected['posts'])
+        self.assertEqual(list(Comment.objects.order_by('pk').values_list(
+            'pk', 'post_id', 'created', 'author__username')),
+            expected['comments'])
+        self.assertEqual(set(Follow.objects.values_list(
+            'user__username', 'author__username')), expected['follows'])
+        self.assertTrue(Post.image.field.storage.exists(post.image.name))
+        follow = Follow.objects.first()
+        self.assertTrue(follow.user.timeline.filter(
+            post__author=follow.author).exists())
+        self.assertFalse(follow.user.has_usable_password())
+
+        # Повторная загрузка того же файла ничего не меняет.
+        call_command('import_jsonl', path, media_dir=media_dir,
+                     stdout=StringIO())
+        self.assertEqual(Post.objects.count(), len(expected['posts']))
+
+    def write_dump(self, *records):
+        path = os.path.join(self.media_root, 'records.jsonl')
+        with open(path, 'w') as dump:
+            for model, fields in records:
+                dump.write(json.dumps({'model': model, 'fields': fields}))
+                dump.write('\n')
+        return path
+
+    def post_record(self, **fields):
+        return 'post', {
+            'id': 1, 'text': 'Из файла', 'author__username': 'writer',
+            'pub_date': '2020-01-01T00:00:00+00:00', 'group__slug': None,
+            'image': '', 'image_width': None, 'image_height': None,
+            'image_placeholder': '', **fields,
+        }
+
+    def test_taken_id_stops_import(self):
+        """Запись файла с id, занятым другой записью, не теряется
+        молча, а её комментарии не достаются чужой записи."""
+        other = Post.objects.create(
+            text='Своя', author=User.objects.create(username='local'))
+        path = self.write_dump(
+            self.post_record(id=other.pk),
+            ('comment', {'id': 1, 'post_id': other.pk, 'text': 'Чужой',
+                         'created': '2020-01-01T00:00:00+00:00',
+                         'author__username': 'writer'}))
+        with self.assertRaisesMessage(CommandError, f'id={other.pk}'):
+            call_command('import_jsonl', path, stdout=StringIO())
+        self.assertEqual(Post.objects.get().text, 'Своя')
+        self.assertFalse(Comment.objects.exists())
+
+    def test_image_outside_media_is_rejected(self):
+        for name in ('../secret.gif', '/etc/passwd', 'posts/../../x.gif'):
+            with self.subTest(name=name):
+                path = self.write_dump(self.post_record(image=name))
+                with self.assertRaisesMessage(CommandError, name):
+                    call_command('import_jsonl', path,
+                                 media_dir=self.media_root,
+                                 stdout=StringIO())
+        self.assertFalse(Post.objects.exists())
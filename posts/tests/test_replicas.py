@@ -0,0 +1,152 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.models import Session
+from django.db import router
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import resolve, reverse
+
+from posts import cache, replicas
+from posts.middleware import ReplicaMiddleware
+from posts.models import Post
+
+User = get_user_model()
+
+
+def fake_view(request):
+    """Имитирует обработчик Django: URL разбирается до вызова
+    представления, а ответ содержит базы, из которых читали."""
+    before = router.db_for_read(Post)
+    request.resolver_match = resolve(request.path_info)
+    if request.method == 'POST':
+        router.db_for_write(Post)
+    reads = {router.db_for_read(Post) for _ in range(5)}
+    return HttpResponse(' '.join([before, *sorted(reads)]))
+
+
+@override_settings(REPLICA_DATABASES=['replica1', 'replica2'],
+                   REPLICA_PIN_SECONDS=10, REPLICA_CHECK_INTERVAL=60)
+class ReplicaRoutingTest(TestCase):
+    def setUp(self):
+        replicas.reset_health()
+        self.factory = RequestFactory()
+        self.middleware = ReplicaMiddleware(fake_view)
+        self.feed = reverse('posts:index')
+
+    def tearDown(self):
+        replicas.reset_health()
+
+    def databases_for(self, request):
+        response = self.middleware(request)
+        before, *reads = response.content.decode().split()
+        return response, before, reads
+
+    @mock.patch('posts.replicas._check', return_value=True)
+    def test_feed_reads_from_one_replica(self, check):
+        """Чтения ленты идут в одну реплику, а чтения до разбора URL
+        (сессия, пользователь) - в основную базу."""
+        response, before, reads = self.databases_for(
+            self.factory.get(self.feed))
+        self.assertEqual(before, 'default')
+        self.assertEqual(len(reads), 1)
+        self.assertIn(reads[0], ('replica1', 'replica2'))
+        self.assertNotIn(replicas.PIN_COOKIE, response.cookies)
+
+    @mock.patch('posts.replicas._check', return_value=True)
+    def test_other_views_and_methods_use_primary(self, check):
+        for request in (self.factory.get(reverse('posts:new_post')),
+                        self.factory.head(reverse('posts:new_post')),
+                        self.factory.options(self.feed)):
+            with self.subTest(method=request.method, path=request.path):
+                _, _, reads = self.databases_for(request)
+                self.assertEqual(reads, ['default'])
+
+    @mock.patch('posts.replicas._check', return_value=True)
+    def test_write_pins_visitor_to_primary(self, check):
+        """После записи посетитель читает основную базу, пока жива
+        cookie, в том числе в остатке того же запроса."""
+        response, _, reads = self.databases_for(self.factory.post(
+            reverse('posts:profile', kwargs={'username': 'someone'})))
+        self.assertEqual(reads, ['default'])
+        cookie = response.cookies[replicas.PIN_COOKIE]
+        self.assertEqual(cookie['max-age'], 10)
+
+        request = self.factory.get(self.feed)
+        request.COOKIES[replicas.PIN_COOKIE] = cookie.value
+        _, _, reads = self.databases_for(request)
+        self.assertEqual(reads, ['default'])
+
+    def test_unhealthy_replica_is_skipped(self):
+        with mock.patch('posts.replicas._check',
+                        side_effect=lambda alias: alias == 'replica2'):
+            for _ in range(5):
+                _, _, reads = self.databases_for(self.factory.get(self.feed))
+                self.assertEqual(reads, ['replica2'])
+
+    def test_primary_when_no_replica_is_healthy(self):
+        with mock.patch('posts.replicas._check', return_value=False):
+            _, _, reads = self.databases_for(self.factory.get(self.feed))
+        self.assertEqual(reads, ['default'])
+        self.assertFalse(replicas.used_replica())
+
+    def test_health_is_checked_once_per_interval(self):
+        with mock.patch('posts.replicas._check',
+                        return_value=False) as check:
+            for _ in range(3):
+                self.databases_for(self.factory.get(self.feed))
+            self.assertEqual(check.call_count, 2)
+            with mock.patch('posts.replicas.time.monotonic',
+                            return_value=10 ** 9):
+                self.databases_for(self.factory.get(self.feed))
+            self.assertEqual(check.call_count, 4)
+
+    def test_reads_outside_requests_use_primary(self):
+        self.assertEqual(router.db_for_read(Post), 'default')
+        self.assertEqual(router.db_for_write(Post), 'default')
+
+    @mock.patch('posts.replicas._check', return_value=True)
+    def test_sessions_are_read_from_primary(self, check):
+        def view(request):
+            request.resolver_match = resolve(self.feed)
+            return HttpResponse(router.db_for_read(Session))
+
+        response = ReplicaMiddleware(view)(self.factory.get(self.feed))
+        self.assertEqual(response.content, b'default')
+
+    @mock.patch('posts.replicas._check', return_value=True)
+    def test_fresh_change_is_not_cached_from_replica(self, check):
+        """Реплика может ещё не содержать только что сделанное
+        изменение, поэтому такую страницу не кладут в кеш под новой
+        версией."""
+        lag = []
+
+        def view(request):
+            request.resolver_match = resolve(self.feed)
+            router.db_for_read(Post)
+            lag.append(cache._replica_may_lag(
+                cache.page_versions([None])[1]))
+            return HttpResponse()
+
+        cache.bump_page_version()
+        ReplicaMiddleware(view)(self.factory.get(self.feed))
+        with mock.patch('posts.cache.time.time', return_value=10 ** 10):
+            ReplicaMiddleware(view)(self.factory.get(self.feed))
+        self.assertEqual(lag, [True, False])
+
+    def test_login_pins_visitor(self):
+        """Вход сохраняет сессию, и следующие страницы посетитель читает
+        из основной базы."""
+        User.objects.create_user('reader', password='secret-password')
+        response = self.client.post(
+            reverse('login'),
+            {'username': 'reader', 'password': 'secret-password'})
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(replicas.PIN_COOKIE, response.cookies)
+
+
+class ReplicaSettingsTest(TestCase):
+    def test_replicas_disabled_by_default(self):
+        response = self.client.get(reverse('posts:index'))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(replicas.PIN_COOKIE, response.cookies)
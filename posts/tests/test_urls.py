@@ -1,8 +1,15 @@
+import os
+import shutil
+import tempfile
+
 from django.contrib.auth import get_user_model
-from django.test import Client, TestCase
+from django.http import Http404
+from django.test import (Client, RequestFactory, SimpleTestCase, TestCase,
+                         override_settings)
 from django.urls import reverse
 
 from posts.models import Comment, Group, Post
+from yatube.media import serve
 
 User = get_user_model()
 
@@ -152,3 +159,79 @@ class PostsURLTests(TestCase):
             with self.subTest(value=url):
                 response = self.author_client.get(url)
                 self.assertEqual(response.status_code, status_code)
+
+
+class MediaServeTest(SimpleTestCase):
+    content = bytes(range(256)) * 16
+    hashed = 'posts/derivatives/ab/abcdef0123456789abcd.jpg'
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        for name in ('posts/photo.jpg', self.hashed):
+            path = os.path.join(self.media_root, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as file:
+                file.write(self.content)
+        settings = override_settings(
+            MEDIA_ROOT=self.media_root, MEDIA_DELIVERY='stream')
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.factory = RequestFactory()
+
+    def get(self, path, **headers):
+        return serve(self.factory.get(f'/media/{path}', **headers), path)
+
+    def test_stream_with_etag(self):
+        """Файл отдаётся целиком с ETag, а повтор с If-None-Match
+        получает 304."""
+        response = self.get('posts/photo.jpg')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=3600')
+        response = self.get(
+            'posts/photo.jpg', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_hashed_names_are_immutable(self):
+        """Файлы с именем из хеша кешируются навсегда."""
+        response = self.get(self.hashed)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(response['ETag'], '"abcdef0123456789abcd"')
+
+    def test_range(self):
+        """Запрос с Range получает 206 и нужный кусок файла, а
+        неудовлетворимый диапазон - 416."""
+        response = self.get('posts/photo.jpg', HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(
+            b''.join(response.streaming_content), self.content[10:20])
+        self.assertEqual(
+            response['Content-Range'], f'bytes 10-19/{len(self.content)}')
+        response = self.get('posts/photo.jpg', HTTP_RANGE='bytes=-5')
+        self.assertEqual(
+            b''.join(response.streaming_content), self.content[-5:])
+        response = self.get('posts/photo.jpg', HTTP_RANGE='bytes=99999-')
+        self.assertEqual(response.status_code, 416)
+
+    def test_proxy_modes(self):
+        """В режимах x-accel и x-sendfile тело не передаётся, а файл
+        отдаёт фронтовый сервер."""
+        with override_settings(MEDIA_DELIVERY='x-accel'):
+            response = self.get('posts/photo.jpg')
+        self.assertEqual(
+            response['X-Accel-Redirect'], '/protected-media/posts/photo.jpg')
+        self.assertEqual(response.content, b'')
+        with override_settings(MEDIA_DELIVERY='x-sendfile'):
+            response = self.get('posts/photo.jpg')
+        self.assertEqual(
+            response['X-Sendfile'],
+            os.path.join(self.media_root, 'posts/photo.jpg'))
+
+    def test_missing_and_outside_files(self):
+        """Отсутствующие файлы и пути за пределами MEDIA_ROOT дают 404."""
+        for path in ('posts/missing.jpg', '../etc/passwd', 'posts'):
+            with self.subTest(path=path):
+                with self.assertRaises(Http404):
+                    self.get(path)
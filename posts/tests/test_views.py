@@ -1,15 +1,31 @@
+import io
 import shutil
 import tempfile
+from unittest import mock
 
 from django import forms
 from django.conf import settings
+from django.core.cache import cache
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
 from django.core.paginator import Paginator
-from django.test import Client, TestCase
+from django.db import connection
+from django.test import AsyncClient, Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from PIL import Image
 
-from posts.models import Comment, Follow, Group, Post
+from posts import images, thumbnails, timeline
+from posts.cache import (author_scope, page_cache_stats, page_version,
+                         page_versions, post_scope)
+from posts.models import (AuthorStats, Comment, Follow, Group, Post,
+                          Timeline)
+from posts.timeline import get_feed
+from posts.utils import get_followee_ids, is_follow
 
 User = get_user_model()
 
@@ -85,6 +101,9 @@ class PostsViewsTests(TestCase):
         super().tearDownClass()
         shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
 
+    def setUp(self):
+        cache.clear()
+
     def test_pages_uses_correct_template(self):
         """URL-адреса приложения posts используют соответствующие шаблоны."""
         urls = {
@@ -217,7 +236,7 @@ class PostsViewsTests(TestCase):
             reverse('posts:add_comment', kwargs=self.post_args),
         )
         form_field = response.context['form'].fields['text']
-        comments_count = response.context['comments'].count()
+        comments_count = len(response.context['comments'])
         context_fields = {
             'post': Post.objects.get(id=self.post.id),
             'is_follow': False,
@@ -234,7 +253,7 @@ class PostsViewsTests(TestCase):
             reverse('posts:comment_edit', kwargs=self.comm_args),
         )
         form_field = response.context['form'].fields['text']
-        comments_count = response.context['comments'].count()
+        comments_count = len(response.context['comments'])
         context_fields = {
             'post': Post.objects.get(id=self.post.id),
             'comment_id': self.comment.id,
@@ -350,6 +369,9 @@ class FollowPageTest(TestCase):
         cls.author = Client()
         cls.author.force_login(cls.user3)
 
+    def setUp(self):
+        cache.clear()
+
     def test_follow_page_show_relevant_posts(self):
         """Новая запись автора появляется в ленте тех, кто на него подписан."""
         response1 = self.follower.get(reverse('posts:follow_index'))
@@ -367,6 +389,124 @@ class FollowPageTest(TestCase):
         self.assertNotEqual(posts_count1, posts_count3)
         self.assertEqual(posts_count2, posts_count4)
 
+    def test_follow_page_uses_timeline(self):
+        """Лента подписок собирается из таблицы Timeline и очищается
+        при отписке и удалении записи."""
+        post = Post.objects.create(text='Пост для теста', author=self.user3)
+        self.assertEqual(self.user1.timeline.count(), 2)
+        self.assertFalse(self.user2.timeline.exists())
+
+        post.delete()
+        response = self.follower.get(reverse('posts:follow_index'))
+        self.assertEqual(response.context['paginator'].count, 1)
+
+        Follow.objects.filter(user=self.user1).delete()
+        response = self.follower.get(reverse('posts:follow_index'))
+        self.assertEqual(response.context['paginator'].count, 0)
+
+    @override_settings(TIMELINE_PULL_THRESHOLD=1)
+    def test_follow_page_merges_pulled_authors(self):
+        """Записи авторов с большим числом подписчиков не раскладываются
+        по лентам, а подмешиваются в ленту при чтении."""
+        Follow.objects.create(user=self.user2, author=self.user3)
+        Follow.objects.create(user=self.user1, author=self.user2)
+        posts = [Post.objects.create(text=f'Пост {i}', author=author)
+                 for i, author in enumerate([self.user2, self.user3] * 6)]
+        self.assertEqual(self.user1.timeline.filter(
+            post__author=self.user3).count(), 1)
+
+        url = reverse('posts:follow_index')
+        response = self.follower.get(url)
+        page1 = response.context['page']
+        page2 = self.follower.get(
+            f'{url}?cursor={page1.next_cursor}').context['page']
+        feed = [entry.post for entry in list(page1) + list(page2)]
+        expected = Post.objects.filter(
+            author__in=[self.user2, self.user3]).order_by('-pub_date', '-id')
+        self.assertEqual(len(feed), 13)
+        self.assertEqual(feed, list(expected))
+        self.assertIn(posts[-1], feed)
+
+    @override_settings(TIMELINE_PULL_THRESHOLD=1, TIMELINE_WORKERS=0)
+    def test_pull_mode_transitions_keep_feeds_complete(self):
+        """Переход автора к подмешиванию и обратно не теряет и не
+        повторяет записи в лентах подписчиков."""
+        def feed(user):
+            return [entry.post_id for entry in get_feed(user)[:50]]
+
+        author_posts = Post.objects.filter(author=self.user3).order_by(
+            '-pub_date', '-id')
+        Follow.objects.create(user=self.user2, author=self.user3)
+        self.assertTrue(AuthorStats.objects.get(user=self.user3).pulled)
+        post = Post.objects.create(text='Пост при подмешивании',
+                                   author=self.user3)
+        self.assertFalse(self.user1.timeline.filter(post=post).exists())
+        self.assertEqual(feed(self.user1), feed(self.user2))
+        self.assertIn(post.pk, feed(self.user1))
+
+        # Перенос записей в ленты идёт после коммита в пуле потоков, а
+        # до его окончания автор подмешивается при чтении.
+        entries = Timeline.objects.count()
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.not_follower.get(reverse(
+                'posts:profile_unfollow', kwargs={'username': 'TestUser3'}))
+        self.assertTrue(AuthorStats.objects.get(user=self.user3).pulled)
+        self.assertEqual(Timeline.objects.count(), entries)
+        self.assertIn(post.pk, feed(self.user1))
+        for callback in callbacks:
+            callback()
+        self.assertFalse(AuthorStats.objects.get(user=self.user3).pulled)
+        self.assertEqual(
+            feed(self.user1), list(author_posts.values_list('pk', flat=True)))
+
+        Follow.objects.create(user=self.user2, author=self.user3)
+        Post.objects.create(text='Снова подмешивание', author=self.user3)
+        expected = list(author_posts.values_list('pk', flat=True))
+        self.assertEqual(feed(self.user1), expected)
+        self.assertEqual(feed(self.user2), expected)
+
+    @override_settings(TIMELINE_PULL_THRESHOLD=1)
+    def test_switch_to_push_catches_up_with_changes(self):
+        """Записи, подписки и отписки, сделанные во время переноса,
+        учитываются при снятии флага."""
+        AuthorStats.objects.filter(user=self.user3).update(pulled=True)
+        backfill = timeline._backfill
+        changes = []
+
+        def backfill_and_change(user_id, author_id):
+            backfill(user_id, author_id)
+            if not changes:
+                Follow.objects.filter(user=self.user1).delete()
+                changes.append(Post.objects.create(
+                    text='Во время переноса', author=self.user3))
+                Follow.objects.create(user=self.user2, author=self.user3)
+
+        with mock.patch('posts.timeline._backfill',
+                        side_effect=backfill_and_change):
+            self.assertTrue(timeline.switch_to_push(self.user3.pk))
+        self.assertFalse(AuthorStats.objects.get(user=self.user3).pulled)
+        self.assertFalse(self.user1.timeline.exists())
+        self.assertEqual(
+            set(self.user2.timeline.values_list('post_id', flat=True)),
+            set(Post.objects.filter(
+                author=self.user3).values_list('pk', flat=True)))
+
+    @override_settings(TIMELINE_DEPTH=10)
+    def test_timeline_is_trimmed(self):
+        """Лента подписок обрезается до TIMELINE_DEPTH записей
+        (с запасом в десятую часть)."""
+        for i in range(12):
+            Post.objects.create(text=f'Пост {i}', author=self.user3)
+        entries_count = self.user1.timeline.count()
+        self.assertLessEqual(entries_count, 11)
+        newest = Post.objects.filter(author=self.user3).order_by(
+            '-pub_date', '-id')[:entries_count]
+        self.assertQuerysetEqual(
+            self.user1.timeline.order_by('-pub_date', '-post_id'),
+            list(newest),
+            transform=lambda entry: entry.post,
+        )
+
 
 class PaginatorsTest(TestCase):
     @classmethod
@@ -391,6 +531,9 @@ class PaginatorsTest(TestCase):
         cls.group_args = {'slug': cls.group.slug}
         cls.profile_args = {'username': cls.author.username}
 
+    def setUp(self):
+        cache.clear()
+
     def test_index_first_page_containse_ten_records(self):
         """Первые страницы паджинаторов содержат правильное кол-во записей."""
         urls = {
@@ -415,3 +558,711 @@ class PaginatorsTest(TestCase):
                 reverse(url_name, kwargs=value[0]) + '?page=2')
             posts_page2_count = len(response.context['page'].object_list)
             self.assertEqual(posts_page2_count, value[1])
+
+    def test_cursor_pages_cover_all_records(self):
+        """Страницы по курсору содержат все записи без повторов."""
+        urls = {
+            'posts:index': None,
+            'posts:group': self.group_args,
+            'posts:profile': self.profile_args,
+        }
+        for url_name, kwargs in urls.items():
+            with self.subTest(value=url_name):
+                url = reverse(url_name, kwargs=kwargs)
+                page1 = self.client.get(url).context['page']
+                page2 = self.client.get(
+                    f'{url}?cursor={page1.next_cursor}').context['page']
+                ids = [post.id for post in page1] + [post.id for post in page2]
+                self.assertEqual(len(page2), 3)
+                self.assertFalse(page2.has_next())
+                self.assertEqual(len(set(ids)), 13)
+
+                page = self.client.get(
+                    f'{url}?cursor={page2.previous_cursor}').context['page']
+                self.assertEqual(list(page), list(page1))
+                self.assertFalse(page.has_previous())
+
+    def test_cursor_is_stable_under_inserts(self):
+        """Новая запись не сдвигает следующую страницу по курсору."""
+        url = reverse('posts:index')
+        page1 = self.client.get(url).context['page']
+        expected = list(self.client.get(
+            f'{url}?cursor={page1.next_cursor}').context['page'])
+        with self.captureOnCommitCallbacks(execute=True):
+            Post.objects.create(text='Новый пост', author=self.author)
+        page2 = self.client.get(
+            f'{url}?cursor={page1.next_cursor}').context['page']
+        self.assertEqual(list(page2), expected)
+
+    def test_invalid_cursor_returns_first_page(self):
+        """Неверный курсор возвращает первую страницу."""
+        response = self.client.get(reverse('posts:index') + '?cursor=abc')
+        self.assertEqual(len(response.context['page']), 10)
+        self.assertFalse(response.context['page'].has_previous())
+
+
+class QueryPlanTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.author = User.objects.create(username='TestAuthor')
+        cls.user = User.objects.create(username='TestUser')
+        cls.group = Group.objects.create(
+            title='Группа',
+            slug='test-slug',
+            description='Тестовое сообщество',
+        )
+        Follow.objects.create(user=cls.user, author=cls.author)
+        for i in range(12):
+            post = Post.objects.create(
+                text=f'Тестовый пост {i}',
+                author=cls.author,
+                group=cls.group,
+            )
+        Comment.objects.create(post=post, text='Комментарий', author=cls.user)
+        cls.post = post
+        cls.user_client = Client()
+        cls.user_client.force_login(cls.user)
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return ' '.join(row[-1] for row in cursor.fetchall())
+
+    def test_feed_queries_do_not_sort_in_memory(self):
+        """Запросы лент и комментариев используют индексы для сортировки
+        и не строят временное B-дерево."""
+        if connection.vendor != 'sqlite':
+            self.skipTest('EXPLAIN QUERY PLAN есть только в SQLite')
+        urls = [
+            reverse('posts:index'),
+            reverse('posts:group', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': 'TestAuthor'}),
+            reverse('posts:follow_index'),
+            reverse('posts:post', kwargs={
+                'username': 'TestAuthor', 'post_id': self.post.id}),
+        ]
+        for url in urls[:-1]:
+            page = self.user_client.get(url).context['page']
+            urls.append(f'{url}?cursor={page.next_cursor}')
+        for url in urls:
+            with CaptureQueriesContext(connection) as queries:
+                self.user_client.get(url)
+            for query in queries:
+                if not query['sql'].startswith('SELECT'):
+                    continue
+                with self.subTest(url=url, sql=query['sql']):
+                    self.assertNotIn('TEMP B-TREE', self.explain(query['sql']))
+
+    def test_first_pages_do_not_count(self):
+        """Первая страница лент выбирается по курсору без COUNT(*) по
+        всем записям."""
+        urls = [
+            reverse('posts:index'),
+            reverse('posts:profile', kwargs={'username': 'TestAuthor'}),
+            reverse('posts:follow_index'),
+        ]
+        for url in urls:
+            with self.subTest(url=url), CaptureQueriesContext(
+                    connection) as queries:
+                response = self.user_client.get(url)
+                self.assertTrue(response.context['page'].next_cursor)
+                self.assertNotContains(response, 'page=')
+                self.assertFalse(
+                    [query['sql'] for query in queries
+                     if 'COUNT(' in query['sql'].upper()])
+
+
+class PageCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.author = User.objects.create(username='TestAuthor')
+        cls.post = Post.objects.create(text='Тестовый пост', author=cls.author)
+        cls.author_client = Client()
+        cls.author_client.force_login(cls.author)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_anonymous_pages_are_cached(self):
+        """Страницы для неавторизованных посетителей отдаются из кеша
+        без запросов к базе."""
+        urls = [
+            reverse('posts:index'),
+            reverse('posts:profile', kwargs={'username': 'TestAuthor'}),
+            reverse('posts:post', kwargs={
+                'username': 'TestAuthor', 'post_id': self.post.id}),
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                response1 = self.client.get(url)
+                with self.assertNumQueries(0):
+                    response2 = self.client.get(url)
+                self.assertEqual(response1.content, response2.content)
+        self.assertEqual(page_cache_stats()['hits'], 3)
+        self.assertEqual(page_cache_stats()['ratio'], 0.5)
+
+    def test_changes_invalidate_cached_pages(self):
+        """Новые записи и комментарии сразу видны в закешированных
+        страницах."""
+        index = reverse('posts:index')
+        post_url = reverse('posts:post', kwargs={
+            'username': 'TestAuthor', 'post_id': self.post.id})
+        self.client.get(index)
+        self.client.get(post_url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Post.objects.create(text='Новая запись', author=self.author)
+            Comment.objects.create(
+                post=self.post, text='Новый комментарий', author=self.author)
+        self.assertContains(self.client.get(index), 'Новая запись')
+        self.assertContains(self.client.get(post_url), 'Новый комментарий')
+
+    def test_version_is_bumped_after_commit(self):
+        """Страница, закешированная до коммита изменения, не переживает
+        коммит."""
+        index = reverse('posts:index')
+        with self.captureOnCommitCallbacks() as callbacks:
+            Post.objects.create(text='Новая запись', author=self.author)
+            version = page_version()
+            self.client.get(index)
+        self.assertEqual(page_version(), version)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(page_version(), version)
+        self.assertContains(self.client.get(index), 'Новая запись')
+
+    def test_authorized_pages_are_not_cached(self):
+        """Страницы для авторизованных пользователей не кешируются."""
+        url = reverse('posts:index')
+        self.author_client.get(url)
+        response = self.author_client.get(url)
+        self.assertIsNotNone(response.context)
+        self.assertEqual(page_cache_stats()['hits'], 0)
+
+
+class CommentsPageTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.author = User.objects.create(username='TestAuthor')
+        cls.post = Post.objects.create(text='Тестовый пост', author=cls.author)
+        Comment.objects.bulk_create([
+            Comment(post=cls.post, author=cls.author, text=f'Комментарий {i}')
+            for i in range(45)
+        ])
+        # Порядок на странице: от новых к старым.
+        cls.comments = list(cls.post.comments.order_by('-created', '-id'))
+        cls.post_args = {'username': 'TestAuthor', 'post_id': cls.post.id}
+        cls.author_client = Client()
+        cls.author_client.force_login(cls.author)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_post_page_renders_first_batch(self):
+        """Страница записи показывает только первую порцию комментариев
+        и ссылку на следующую."""
+        response = self.client.get(
+            reverse('posts:post', kwargs=self.post_args))
+        page = response.context['comments']
+        self.assertEqual(list(page), self.comments[:20])
+        self.assertContains(response, f'cursor={page.next_cursor}')
+        self.assertNotContains(response, self.comments[20].text + '<')
+
+    def test_fragment_returns_next_batches(self):
+        """Фрагмент по курсору отдаёт следующие порции без повторов до
+        последней, в которой нет кнопки «Показать ещё»."""
+        url = reverse('posts:comments', kwargs=self.post_args)
+        page = self.client.get(
+            reverse('posts:post', kwargs=self.post_args)).context['comments']
+        loaded = list(page)
+        while page.has_next():
+            response = self.client.get(url, {'cursor': page.next_cursor})
+            self.assertTemplateUsed(response, 'includes/comment_list.html')
+            self.assertTemplateNotUsed(response, 'base.html')
+            page = response.context['comments']
+            loaded += page
+        self.assertEqual(loaded, self.comments)
+        self.assertNotContains(response, 'comments-more')
+
+    def test_queries_do_not_depend_on_comment_count(self):
+        """Число запросов страницы записи не растёт с числом
+        комментариев."""
+        url = reverse('posts:post', kwargs=self.post_args)
+        self.author_client.get(url)
+        with CaptureQueriesContext(connection) as before:
+            self.author_client.get(url)
+        Comment.objects.bulk_create([
+            Comment(post=self.post, author=self.author, text='Ещё')
+            for _ in range(30)
+        ])
+        with CaptureQueriesContext(connection) as after:
+            response = self.author_client.get(url)
+        self.assertEqual(len(before), len(after))
+        self.assertEqual(len(response.context['comments']), 20)
+
+    def test_edited_comment_is_shown_first(self):
+        """При редактировании старого комментария он показывается в
+        первой порции вместе с формой."""
+        comment = self.comments[-1]
+        response = self.author_client.get(reverse(
+            'posts:comment_edit',
+            kwargs={**self.post_args, 'comment_id': comment.id}))
+        self.assertEqual(response.context['comments'][0], comment)
+        self.assertContains(response, 'id="comment_edit"')
+
+
+class ConditionalGetTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.author = User.objects.create(username='TestAuthor')
+        cls.reader = User.objects.create(username='Reader')
+        cls.group = Group.objects.create(
+            title='Группа', slug='test-slug', description='Сообщество')
+        cls.post = Post.objects.create(
+            text='Тестовый пост', author=cls.author, group=cls.group)
+        cls.urls = [
+            reverse('posts:post', kwargs={
+                'username': 'TestAuthor', 'post_id': cls.post.id}),
+            reverse('posts:profile', kwargs={'username': 'TestAuthor'}),
+            reverse('posts:group', kwargs={'slug': 'test-slug'}),
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.reader)
+
+    def test_unchanged_pages_return_304_without_queries(self):
+        """Неизменившаяся страница отдаётся как 304 без запросов к базе
+        и без шаблонов."""
+        for url in self.urls:
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                with self.assertNumQueries(0):
+                    response = self.client.get(
+                        url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response['ETag'], etag)
+                self.assertEqual(response.templates, [])
+
+    def test_changes_and_other_users_get_full_page(self):
+        """После изменений и для другого пользователя страница
+        отдаётся целиком."""
+        url = self.urls[0]
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(
+                post=self.post, author=self.author, text='Новый комментарий')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'Новый комментарий')
+        self.assertNotEqual(response['ETag'], etag)
+        other = Client()
+        other.force_login(self.author)
+        response = other.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_unrelated_changes_keep_validators(self):
+        """Изменения чужих записей, авторов и сообществ не сбрасывают
+        ETag страниц записи, профиля и сообщества."""
+        etags = {url: self.client.get(url)['ETag'] for url in self.urls}
+        other = User.objects.create(username='Other')
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(text='Чужая запись', author=other)
+            Comment.objects.create(post=post, author=other, text='Да')
+            Group.objects.create(title='Другая', slug='other')
+            Follow.objects.create(user=other, author=self.reader)
+        for url, etag in etags.items():
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+
+    def test_related_changes_reset_validators(self):
+        """Страница устаревает после коммита изменения объекта, который
+        на ней выводится."""
+        post_url, profile_url, group_url = self.urls
+        changes = [
+            (lambda: Follow.objects.create(
+                user=self.reader, author=self.author),
+             [post_url, profile_url]),
+            (lambda: Group.objects.filter(pk=self.group.pk).first().save(),
+             self.urls),
+            (lambda: Post.objects.create(
+                text='Ещё', author=self.author, group=self.group),
+             [profile_url, group_url]),
+        ]
+        for change, urls in changes:
+            etags = {url: self.client.get(url)['ETag'] for url in self.urls}
+            with self.captureOnCommitCallbacks() as callbacks:
+                change()
+            for url in urls:
+                # До коммита страница считается прежней.
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etags[url])
+                self.assertEqual(response.status_code, 304)
+            for callback in callbacks:
+                callback()
+            for url in urls:
+                with self.subTest(url=url):
+                    response = self.client.get(
+                        url, HTTP_IF_NONE_MATCH=etags[url])
+                    self.assertEqual(response.status_code, 200)
+
+    def test_if_modified_since(self):
+        """Last-Modified отдаётся, когда последнее изменение старше
+        секунды, и работает с If-Modified-Since."""
+        url = self.urls[1]
+        with mock.patch('posts.cache.time.time', return_value=1000.0), \
+                self.captureOnCommitCallbacks(execute=True):
+            Post.objects.create(text='Запись', author=self.author)
+        response = self.client.get(url)
+        self.assertIn('no-cache', response['Cache-Control'])
+        response = self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+
+class PostCardCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.author = User.objects.create(username='TestAuthor')
+        cls.user = User.objects.create(username='TestUser')
+        cls.group = Group.objects.create(
+            title='Группа',
+            slug='test-slug',
+            description='Тестовое сообщество',
+        )
+        cls.post = Post.objects.create(
+            text='Тестовый пост', author=cls.author, group=cls.group)
+        cls.author_client = Client()
+        cls.author_client.force_login(cls.author)
+        cls.user_client = Client()
+        cls.user_client.force_login(cls.user)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_card_is_shared_between_users(self):
+        """Карточка записи кешируется одна на всех, а кнопки
+        редактирования видит только автор."""
+        url = reverse('posts:index')
+        self.author_client.get(url)
+        Post.objects.filter(pk=self.post.pk).update(text='Другой текст')
+        response = self.user_client.get(url)
+        self.assertContains(response, 'Тестовый пост')
+        self.assertNotContains(response, 'Редактировать')
+        self.assertContains(self.author_client.get(url), 'Редактировать')
+
+    def test_card_is_invalidated(self):
+        """Карточка обновляется при правке записи, новом комментарии и
+        переименовании сообщества."""
+        url = reverse('posts:index')
+        self.user_client.get(url)
+        self.author_client.post(
+            reverse('posts:post_edit', kwargs={
+                'username': 'TestAuthor', 'post_id': self.post.id}),
+            {'text': 'Исправленный текст', 'group': self.group.id},
+        )
+        Comment.objects.create(
+            post=self.post, text='Комментарий', author=self.user)
+        self.group.title = 'Новое название'
+        self.group.save()
+        response = self.user_client.get(url)
+        self.assertContains(response, 'Исправленный текст')
+        self.assertContains(response, 'Комментариев: 1')
+        self.assertContains(response, '#Новое название')
+
+
+class FolloweesCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.author = User.objects.create(username='TestAuthor')
+        cls.user = User.objects.create(username='TestUser')
+        cls.user_client = Client()
+        cls.user_client.force_login(cls.user)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_is_follow_uses_cached_followees(self):
+        """is_follow отвечает по закешированному множеству подписок."""
+        self.assertFalse(is_follow(self.user, self.author))
+        with self.assertNumQueries(0):
+            self.assertFalse(is_follow(self.user, self.author))
+            self.assertFalse(is_follow(AnonymousUser(), self.author))
+
+    def test_follow_and_unfollow_invalidate_followees(self):
+        """Подписка и отписка сбрасывают закешированное множество."""
+        profile = reverse('posts:profile', kwargs={'username': 'TestAuthor'})
+        self.assertFalse(self.user_client.get(profile).context['is_follow'])
+        self.user_client.get(
+            reverse('posts:profile_follow', kwargs={'username': 'TestAuthor'}))
+        self.assertEqual(get_followee_ids(self.user), {self.author.pk})
+        self.assertTrue(self.user_client.get(profile).context['is_follow'])
+        self.user_client.get(reverse(
+            'posts:profile_unfollow', kwargs={'username': 'TestAuthor'}))
+        self.assertFalse(self.user_client.get(profile).context['is_follow'])
+
+
+@override_settings(THUMBNAIL_WORKERS=0)
+class ThumbnailTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp(dir=settings.BASE_DIR)
+        cls.media = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.media.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.author = User.objects.create(username='TestAuthor')
+        buffer = io.BytesIO()
+        Image.new('RGB', (2000, 1000), (200, 0, 0)).save(buffer, 'JPEG')
+        cls.uploaded = SimpleUploadedFile(
+            'photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_thumbnail_is_generated_after_commit(self):
+        """Миниатюра и производные создаются после сохранения записи, и
+        лента показывает уже их."""
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(
+                text='Тестовый пост', author=self.author,
+                image=self.uploaded)
+        self.assertIsNotNone(thumbnails.ready(post.image.name))
+        self.assertEqual(thumbnails.backlog(), 0)
+        post.refresh_from_db()
+        picture = images.picture(post)
+        self.assertIsNotNone(picture)
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, f'srcset="{picture["jpeg"]}"')
+        self.assertNotContains(response, post.image.url)
+
+    def test_finished_thumbnail_resets_only_its_pages(self):
+        """Готовая миниатюра сбрасывает страницы своей записи и её
+        автора, но не общий кеш страниц."""
+        post = Post.objects.create(
+            text='Тестовый пост', author=self.author, image=self.uploaded)
+        scopes = [None, post_scope(post.pk), author_scope('TestAuthor'),
+                  post_scope(post.pk + 1)]
+        before = page_versions(scopes)[0]
+        thumbnails.generate(post.pk, post.image.name)
+        after = page_versions(scopes)[0]
+        self.assertEqual(
+            [old != new for old, new in zip(before, after)],
+            [False, True, True, False])
+
+    def test_derivatives_manifest(self):
+        """Манифест содержит несколько ширин, имена производных зависят
+        только от содержимого."""
+        name = default_storage.save('posts/photo.jpg', self.uploaded)
+        manifest = images.build_derivatives(name)
+        self.assertEqual(manifest['source'], name)
+        self.assertEqual((manifest['width'], manifest['height']), (1024, 480))
+        for variants in manifest['formats'].values():
+            self.assertEqual(
+                [width for width, _ in variants], list(images.WIDTHS))
+            for _, derivative in variants:
+                self.assertTrue(default_storage.exists(derivative))
+        self.assertEqual(
+            images.build_derivatives(name)['formats'], manifest['formats'])
+
+    @override_settings(IMAGE_RELEASE_GRACE=0)
+    def test_derivatives_are_deleted_with_image(self):
+        """Производные удаляются вместе с изображением, когда его
+        заменяют или удаляют запись."""
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(
+                text='Тестовый пост', author=self.author,
+                image=self.uploaded)
+        post.refresh_from_db()
+        replaced = images.derivative_names(post.image_manifest)
+        buffer = io.BytesIO()
+        Image.new('RGB', (800, 400), (0, 0, 200)).save(buffer, 'JPEG')
+        post.image = SimpleUploadedFile('other.jpg', buffer.getvalue())
+        with self.captureOnCommitCallbacks(execute=True):
+            post.save()
+        post.refresh_from_db()
+        deleted = images.derivative_names(post.image_manifest)
+        with self.captureOnCommitCallbacks(execute=True):
+            post.delete()
+        self.assertTrue(replaced and deleted)
+        for name in replaced + deleted:
+            with self.subTest(name=name):
+                self.assertFalse(default_storage.exists(name))
+
+    @override_settings(IMAGE_RELEASE_GRACE=0)
+    def test_sweep_removes_orphan_derivatives(self):
+        """sweep_images удаляет производные, которых нет ни в одном
+        манифесте, и оставляет нужные."""
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(
+                text='Тестовый пост', author=self.author,
+                image=self.uploaded)
+        post.refresh_from_db()
+        buffer = io.BytesIO()
+        Image.new('RGB', (800, 400), (0, 200, 0)).save(buffer, 'JPEG')
+        orphans = images.derivative_names(images.build_derivatives(
+            default_storage.save(
+                'posts/orphan.jpg', ContentFile(buffer.getvalue()))))
+        call_command('sweep_images', stdout=io.StringIO())
+        self.assertTrue(orphans)
+        for name in orphans:
+            self.assertFalse(default_storage.exists(name))
+        for name in images.derivative_names(post.image_manifest):
+            self.assertTrue(default_storage.exists(name))
+
+    def test_original_is_shown_until_ready(self):
+        """Пока миниатюры нет, шаблон отдаёт оригинал и ставит
+        создание миниатюры в очередь."""
+        post = Post.objects.create(
+            text='Тестовый пост', author=self.author, image=self.uploaded)
+        with mock.patch('posts.thumbnails.enqueue') as enqueue:
+            response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, post.image.url)
+        enqueue.assert_called_once_with(post.pk, post.image.name)
+        self.assertIsNone(thumbnails.ready(post.image.name))
+
+    def test_page_thumbnails_are_resolved_in_one_query(self):
+        """Миниатюры страницы находятся одним запросом к kvstore, а
+        после этого берутся из кеша без запросов."""
+        with self.captureOnCommitCallbacks(execute=True):
+            posts = [
+                Post.objects.create(
+                    text=f'Тестовый пост {i}', author=self.author,
+                    image=self.uploaded)
+                for i in range(3)
+            ]
+        posts.append(Post.objects.create(
+            text='Без картинки', author=self.author))
+        cache.clear()
+        with self.assertNumQueries(1):
+            thumbnails.resolve(posts)
+        for post in posts[:3]:
+            self.assertEqual(
+                post.thumbnail.url, thumbnails.ready(post.image.name).url)
+        self.assertIsNone(posts[3].thumbnail)
+        with self.assertNumQueries(0):
+            thumbnails.resolve(posts)
+
+    def test_dimensions_are_stored_on_save(self):
+        """Размеры и заглушка сохраняются в записи, и лента выводит их,
+        не открывая файл картинки."""
+        post = Post.objects.create(
+            text='Тестовый пост', author=self.author, image=self.uploaded)
+        self.assertEqual((post.image_width, post.image_height), (2000, 1000))
+        self.assertTrue(
+            post.image_placeholder.startswith('data:image/jpeg;base64,'))
+        with mock.patch('posts.thumbnails.enqueue'), mock.patch(
+                'django.core.files.storage.FileSystemStorage.open',
+                side_effect=AssertionError('файл открыт при рендеринге')):
+            response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, 'width="2000" height="1000"')
+        self.assertContains(response, 'loading="lazy"')
+        self.assertContains(response, post.image_placeholder)
+
+
+class SearchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.author = User.objects.create(username='TestAuthor')
+        cls.group = Group.objects.create(
+            title='Путешествия', slug='travel', description='Сообщество')
+        cls.in_text = Post.objects.create(
+            text='Путешествия по горам и морям', author=cls.author)
+        cls.in_group = Post.objects.create(
+            text='Фотографии с отпуска', author=cls.author, group=cls.group)
+        cls.other = Post.objects.create(
+            text='Рецепт борща', author=cls.author)
+        cls.url = reverse('posts:search')
+
+    def setUp(self):
+        cache.clear()
+
+    def found(self, query):
+        response = self.client.get(self.url, {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return [post.pk for post in response.context['page']]
+
+    def test_search_by_text_and_group(self):
+        """Поиск находит записи по тексту и названию сообщества, совпадение
+        в тексте выше."""
+        self.assertEqual(
+            self.found('путешествия'), [self.in_text.pk, self.in_group.pk])
+        self.assertEqual(self.found('бор'), [self.other.pk])
+        self.assertEqual(self.found('горам морям'), [self.in_text.pk])
+
+    def test_index_follows_changes(self):
+        """Индекс обновляется при правке и удалении записи и при
+        переименовании сообщества."""
+        self.other.text = 'Рецепт пирога'
+        self.other.save()
+        self.assertEqual(self.found('борща'), [])
+        self.assertEqual(self.found('пирога'), [self.other.pk])
+        self.group.title = 'Походы'
+        self.group.save()
+        self.assertEqual(self.found('походы'), [self.in_group.pk])
+        self.in_text.delete()
+        self.assertEqual(self.found('путешествия'), [])
+
+    def test_query_syntax_is_escaped(self):
+        """Кавычки и операторы FTS5 во вводе не ломают поиск."""
+        for query in ('"', 'AND OR NOT', 'борщ*', '(', '', '  '):
+            with self.subTest(query=query):
+                self.found(query)
+
+    def test_pagination_keeps_query(self):
+        """Ссылки пагинации сохраняют поисковый запрос."""
+        Post.objects.bulk_create([
+            Post(text=f'Рецепт номер {i}', author=self.author)
+            for i in range(15)
+        ])
+        response = self.client.get(self.url, {'q': 'рецепт'})
+        self.assertEqual(response.context['paginator'].count, 16)
+        self.assertContains(
+            response, '?q=%D1%80%D0%B5%D1%86%D0%B5%D0%BF%D1%82&amp;page=2')
+
+
+class AsgiTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.author = User.objects.create(username='TestAuthor')
+        cls.reader = User.objects.create(username='Reader')
+        cls.group = Group.objects.create(
+            title='Группа', slug='test-slug', description='Сообщество')
+        cls.post = Post.objects.create(
+            text='Пост через ASGI', author=cls.author, group=cls.group)
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+
+    async def test_pages_are_served_over_asgi(self):
+        """ASGI отдаёт те же синхронные представления, что и WSGI."""
+        urls = [
+            reverse('posts:index'),
+            reverse('posts:group', kwargs={'slug': 'test-slug'}),
+            reverse('posts:profile', kwargs={'username': 'TestAuthor'}),
+            reverse('posts:post', kwargs={
+                'username': 'TestAuthor', 'post_id': self.post.id}),
+        ]
+        client = AsyncClient()
+        for url in urls:
+            with self.subTest(url=url):
+                response = await client.get(url)
+                self.assertContains(response, 'Пост через ASGI')
+        response = await client.get(reverse('posts:follow_index'))
+        self.assertEqual(response.status_code, 302)
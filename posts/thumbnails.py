@@ -0,0 +1,161 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import EMPTY_VALUE
+from sorl.thumbnail.models import KVStore
+
+from posts import images
+from posts.cache import (_incr, author_scope, bump_page_version,
+                         group_scope, invalidate_post_cards, post_scope)
+from posts.models import Post
+
+logger = logging.getLogger(__name__)
+
+GEOMETRY = '1024x480'
+OPTIONS = {'crop': 'center', 'upscale': True}
+BACKLOG_KEY = 'thumbnails:backlog'
+
+_executor = None
+_lock = threading.Lock()
+_pending = set()
+
+
+def _thumbnail_file(name):
+    """Повторяет вычисление имени миниатюры из ThumbnailBackend, не
+    открывая исходный файл."""
+    backend = default.backend
+    source = ImageFile(name)
+    options = dict(OPTIONS)
+    if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault('format', backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(sorl_settings, attr)
+        if value != getattr(sorl_defaults, attr):
+            options.setdefault(key, value)
+    return ImageFile(
+        backend._get_thumbnail_filename(source, GEOMETRY, options),
+        default.storage)
+
+
+def ready(name):
+    """Готовая миниатюра из kvstore sorl или None, без генерации."""
+    if not name:
+        return None
+    return default.kvstore.get(_thumbnail_file(name))
+
+
+def resolve(posts):
+    """Находит готовые миниатюры для всех записей страницы разом.
+
+    Вместо отдельного обращения к kvstore на каждую карточку делается
+    один get_many в кеш и, для промахов, один запрос к таблице kvstore.
+    Результат кладётся в post.thumbnail (None, если миниатюры нет).
+    Записи с готовым манифестом производных пропускаются.
+    """
+    keys = {}
+    for post in posts:
+        post.thumbnail = None
+        if post.image and not images.manifest_ready(post):
+            key = add_prefix(_thumbnail_file(post.image.name).key)
+            keys.setdefault(key, []).append(post)
+    if not keys:
+        return posts
+    kv_cache = default.kvstore.cache
+    values = kv_cache.get_many(list(keys))
+    missing = [key for key in keys if key not in values]
+    if missing:
+        found = dict(KVStore.objects.filter(
+            key__in=missing).values_list('key', 'value'))
+        # Как и sorl, запоминаем отсутствие значения, чтобы не ходить в
+        # базу повторно.
+        fetched = {key: found.get(key, EMPTY_VALUE) for key in missing}
+        kv_cache.set_many(fetched, sorl_settings.THUMBNAIL_CACHE_TIMEOUT)
+        values.update(fetched)
+    for key, value in values.items():
+        if value == EMPTY_VALUE or not value:
+            continue
+        thumbnail = deserialize_image_file(value)
+        for post in keys[key]:
+            post.thumbnail = thumbnail
+    return posts
+
+
+def backlog():
+    return cache.get(BACKLOG_KEY, 0)
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.THUMBNAIL_WORKERS,
+                thread_name_prefix='thumbnails')
+        return _executor
+
+
+def generate(post_id, name):
+    try:
+        get_thumbnail(name, GEOMETRY, **OPTIONS)
+        manifest = images.build_derivatives(name)
+        # Одно изображение может принадлежать нескольким записям.
+        posts = Post.objects.filter(image=name)
+        rows = list(posts.values_list('pk', 'author__username', 'group__slug'))
+        posts.update(image_manifest=manifest)
+    except Exception:
+        logger.exception('Не удалось создать миниатюру %s', name)
+    else:
+        # Карточки, страницы записей, профили и сообщества могли
+        # закешироваться с оригиналом. Ленты обновятся по TTL или со
+        # следующим изменением.
+        invalidate_post_cards({post_id, *(row[0] for row in rows)})
+        scopes = {post_scope(post_id)}
+        for pk, author, group in rows:
+            scopes.update((post_scope(pk), author_scope(author)))
+            if group:
+                scopes.add(group_scope(group))
+        bump_page_version(*scopes)
+    finally:
+        with _lock:
+            _pending.discard(name)
+        try:
+            cache.decr(BACKLOG_KEY)
+        except ValueError:
+            pass
+
+
+def enqueue(post_id, name):
+    """Ставит создание миниатюры и производных в очередь пула потоков.
+
+    Одно и то же изображение не ставится повторно, пока задача не
+    выполнена. При THUMBNAIL_WORKERS = 0 миниатюра создаётся сразу.
+    """
+    if not name:
+        return
+    with _lock:
+        if name in _pending:
+            return
+        _pending.add(name)
+    _incr(BACKLOG_KEY)
+    if not settings.THUMBNAIL_WORKERS:
+        generate(post_id, name)
+        return
+    _get_executor().submit(_run, post_id, name)
+
+
+def _run(post_id, name):
+    try:
+        generate(post_id, name)
+    finally:
+        connections.close_all()
@@ -0,0 +1,320 @@
+import heapq
+import itertools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Count, F, Max, Q
+
+from posts.models import AuthorStats, Follow, Post, Timeline
+from posts.utils import get_followee_ids
+
+logger = logging.getLogger(__name__)
+
+TIMELINE_ORDERING = ('-pub_date', '-post_id')
+BATCH_SIZE = 1000
+
+_executor = None
+_lock = threading.Lock()
+_pending = set()
+
+
+def _depth():
+    return settings.TIMELINE_DEPTH
+
+
+def is_pulled(author_id):
+    """Записи авторов с большим числом подписчиков не раскладываются
+    по лентам, а подмешиваются при чтении."""
+    return AuthorStats.objects.filter(user_id=author_id, pulled=True).exists()
+
+
+def _should_pull(followers, pulled):
+    # Обратно к раскладке автор переходит с запасом в десятую часть
+    # порога, чтобы подписки и отписки у порога не перекладывали ленты
+    # каждый раз.
+    threshold = settings.TIMELINE_PULL_THRESHOLD
+    if pulled:
+        return followers > threshold - threshold // 10
+    return followers > threshold
+
+
+@transaction.atomic
+def sync_mode(author_id):
+    """Переключает автора между раскладкой записей по лентам и
+    подмешиванием при чтении, когда число подписчиков пересекает порог.
+
+    Режим хранится в AuthorStats.pulled. К подмешиванию автор переходит
+    сразу. Возврат к раскладке требует дописать его последние записи в
+    ленты всех подписчиков, поэтому он выполняется в фоне (switch_to_push)
+    после коммита, а до его окончания записи автора подмешиваются при
+    чтении. Записи, разложенные до перехода к подмешиванию, не удаляются:
+    при чтении они исключаются, а обрезка ленты их уберёт.
+    """
+    # Блокировка строки упорядочивает переключение с push_post: автор
+    # сначала увеличивает posts_count в той же строке.
+    stats = AuthorStats.objects.select_for_update().filter(
+        user_id=author_id).values_list('followers_count', 'pulled').first()
+    if stats is None:
+        return None
+    followers, pulled = stats
+    should_pull = _should_pull(followers, pulled)
+    if should_pull and not pulled:
+        AuthorStats.objects.filter(user_id=author_id).update(pulled=True)
+    elif pulled and not should_pull:
+        transaction.on_commit(lambda: enqueue_switch_to_push(author_id))
+    return pulled or should_pull
+
+
+def switch_to_push(author_id):
+    """Возвращает автора к раскладке записей по лентам.
+
+    Сначала его последние записи дописываются в ленты подписчиков, пока
+    флаг pulled ещё стоит и частично заполненные ленты не видны при
+    чтении. Затем под блокировкой строки AuthorStats флаг снимается, и в
+    той же транзакции докладываются подписки и записи, появившиеся за
+    время переноса, и убираются записи у успевших отписаться. Если
+    подписчиков за это время снова стало много, автор остаётся в режиме
+    подмешивания. Возвращает True, если автор переключён.
+    """
+    follows = Follow.objects.filter(author_id=author_id)
+    last_follow = follows.aggregate(last=Max('id'))['last'] or 0
+    last_post = Post.objects.filter(author_id=author_id).aggregate(
+        last=Max('id'))['last'] or 0
+    follower_ids = follows.filter(id__lte=last_follow).values_list(
+        'user_id', flat=True)
+    for user_id in follower_ids.iterator(chunk_size=BATCH_SIZE):
+        _backfill(user_id, author_id)
+    with transaction.atomic():
+        stats = AuthorStats.objects.select_for_update().filter(
+            user_id=author_id).values_list('followers_count', 'pulled').first()
+        if stats is None or not stats[1] or _should_pull(stats[0], True):
+            return False
+        AuthorStats.objects.filter(user_id=author_id).update(pulled=False)
+        new_follower_ids = follows.filter(id__gt=last_follow).values_list(
+            'user_id', flat=True)
+        for user_id in new_follower_ids.iterator(chunk_size=BATCH_SIZE):
+            _backfill(user_id, author_id)
+        for post in Post.objects.filter(author_id=author_id, id__gt=last_post):
+            push_post(post)
+        Timeline.objects.filter(post__author_id=author_id).exclude(
+            user_id__in=follows.values('user_id')).delete()
+    return True
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.TIMELINE_WORKERS,
+                thread_name_prefix='timeline')
+        return _executor
+
+
+def enqueue_switch_to_push(author_id):
+    """Ставит switch_to_push в очередь пула потоков, не повторяя уже
+    поставленного автора. При TIMELINE_WORKERS = 0 выполняется сразу."""
+    with _lock:
+        if author_id in _pending:
+            return
+        _pending.add(author_id)
+    if not settings.TIMELINE_WORKERS:
+        _run(author_id)
+        return
+    _get_executor().submit(_run, author_id)
+
+
+def _run(author_id):
+    try:
+        switch_to_push(author_id)
+    except Exception:
+        # Автор остаётся в режиме подмешивания, и следующая подписка или
+        # отписка поставит перенос снова.
+        logger.exception('Не удалось вернуть автора %s к раскладке',
+                         author_id)
+    finally:
+        with _lock:
+            _pending.discard(author_id)
+        if settings.TIMELINE_WORKERS:
+            connections.close_all()
+
+
+def reset_modes():
+    """Выставляет режимы по числу подписчиков без переноса записей,
+    перед полной пересборкой лент."""
+    threshold = settings.TIMELINE_PULL_THRESHOLD
+    AuthorStats.objects.filter(followers_count__gt=threshold).update(
+        pulled=True)
+    AuthorStats.objects.filter(followers_count__lte=threshold).update(
+        pulled=False)
+
+
+def push_post(post):
+    """Раскладывает новую запись по лентам подписчиков автора."""
+    if is_pulled(post.author_id):
+        return
+    follower_ids = Follow.objects.filter(
+        author_id=post.author_id).values_list('user_id', flat=True)
+    batch = []
+    for user_id in follower_ids.iterator(chunk_size=BATCH_SIZE):
+        batch.append(user_id)
+        if len(batch) == BATCH_SIZE:
+            _push(post, batch)
+            batch = []
+    if batch:
+        _push(post, batch)
+
+
+def _push(post, user_ids):
+    Timeline.objects.bulk_create(
+        [Timeline(user_id=user_id, post_id=post.pk, pub_date=post.pub_date)
+         for user_id in user_ids],
+        ignore_conflicts=True,
+    )
+    trim(user_ids)
+
+
+def backfill(user_id, author_id):
+    """Добавляет в ленту пользователя последние записи нового автора."""
+    if not is_pulled(author_id):
+        _backfill(user_id, author_id)
+
+
+def _backfill(user_id, author_id):
+    posts = Post.objects.filter(author_id=author_id).order_by(
+        '-pub_date', '-id').values_list('id', 'pub_date')[:_depth()]
+    Timeline.objects.bulk_create(
+        [Timeline(user_id=user_id, post_id=post_id, pub_date=pub_date)
+         for post_id, pub_date in posts],
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    trim([user_id])
+
+
+def remove(user_id, author_id):
+    Timeline.objects.filter(
+        user_id=user_id, post__author_id=author_id).delete()
+
+
+def trim(user_ids):
+    """Обрезает ленты до TIMELINE_DEPTH записей.
+
+    Ленты обрезаются с запасом в десятую часть глубины, чтобы не
+    удалять по одной записи на каждую новую публикацию.
+    """
+    depth = _depth()
+    overflowing = Timeline.objects.filter(user_id__in=user_ids).values(
+        'user_id').annotate(total=Count('id')).filter(
+        total__gt=depth + depth // 10).values_list('user_id', flat=True)
+    for user_id in overflowing:
+        entries = Timeline.objects.filter(user_id=user_id)
+        cutoff = entries.order_by(*TIMELINE_ORDERING).values_list(
+            'pub_date', 'post_id')[depth:depth + 1]
+        for pub_date, post_id in cutoff:
+            entries.filter(
+                Q(pub_date__lt=pub_date)
+                | Q(pub_date=pub_date, post_id__lte=post_id)
+            ).delete()
+
+
+def rebuild(users=None):
+    """Заново собирает ленты по текущим подпискам."""
+    follows = Follow.objects.all()
+    if users is not None:
+        follows = follows.filter(user__in=users)
+        Timeline.objects.filter(user__in=users).delete()
+    else:
+        Timeline.objects.all().delete()
+        reset_modes()
+    pairs = follows.values_list('user_id', 'author_id')
+    for user_id, author_id in pairs.iterator(chunk_size=BATCH_SIZE):
+        backfill(user_id, author_id)
+
+
+def pulled_authors(user):
+    followee_ids = get_followee_ids(user)
+    if not followee_ids:
+        return []
+    return list(AuthorStats.objects.filter(
+        user_id__in=followee_ids, pulled=True,
+    ).values_list('user_id', flat=True))
+
+
+def get_feed(user):
+    """Лента подписок пользователя.
+
+    Если пользователь не подписан на «тяжёлых» авторов, это просто
+    выборка из Timeline. Иначе их записи читаются отдельными потоками
+    и сливаются с лентой в MergedFeed.
+    """
+    entries = Timeline.objects.filter(user=user).select_related(
+        'post__author', 'post__group')
+    author_ids = pulled_authors(user)
+    if not author_ids:
+        return entries
+    streams = [entries.exclude(post__author_id__in=author_ids)]
+    for author_id in author_ids:
+        streams.append(Post.objects.filter(author_id=author_id).annotate(
+            post_id=F('id')).select_related('author', 'group'))
+    return MergedFeed(user, streams)
+
+
+class MergedFeed:
+    """k-путевое слияние нескольких упорядоченных выборок.
+
+    Поддерживает ту часть интерфейса QuerySet, которая нужна Paginator
+    и CursorPaginator: order_by, filter, reverse, count и срезы. Все
+    потоки упорядочены по (pub_date, post_id) в одном направлении.
+    """
+    model = Timeline
+
+    def __init__(self, user, streams, descending=True):
+        self.user = user
+        self.streams = streams
+        self.descending = descending
+
+    def _clone(self, streams, descending=None):
+        if descending is None:
+            descending = self.descending
+        return MergedFeed(self.user, streams, descending)
+
+    def order_by(self, *ordering):
+        descending = ordering[0].startswith('-')
+        return self._clone(
+            [stream.order_by(*ordering) for stream in self.streams],
+            descending,
+        )
+
+    def filter(self, *args, **kwargs):
+        return self._clone(
+            [stream.filter(*args, **kwargs) for stream in self.streams])
+
+    def reverse(self):
+        return self._clone(
+            [stream.reverse() for stream in self.streams],
+            not self.descending,
+        )
+
+    def count(self):
+        return sum(stream.count() for stream in self.streams)
+
+    def _entry(self, obj):
+        if isinstance(obj, Timeline):
+            return obj
+        return Timeline(user=self.user, post=obj, pub_date=obj.pub_date)
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start, stop = index.start or 0, index.stop
+        merged = heapq.merge(
+            *(stream[:stop] for stream in self.streams),
+            key=lambda obj: (obj.pub_date, obj.post_id),
+            reverse=self.descending,
+        )
+        return [self._entry(obj)
+                for obj in itertools.islice(merged, start, stop)]
@@ -0,0 +1,268 @@
+"""Потоковый перенос записей, комментариев, сообществ и подписок через
+JSON Lines.
+
+Одна строка файла - один объект: {"model": "post", "fields": {...}}.
+Сообщества идут первыми, за ними записи, комментарии и подписки, чтобы
+при загрузке все ссылки уже были в базе. Пользователи передаются по
+username, сообщества - по slug, записи и комментарии сохраняют id.
+Если id из файла в базе уже занят другой записью, загрузка
+останавливается, а не пропускает строку.
+"""
+import datetime
+import gzip
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files import File
+from django.core.management.color import no_style
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils.dateparse import parse_datetime
+
+from posts.benchmark import peak_rss
+from posts.models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+BATCH_SIZE = 2000
+PROGRESS_EVERY = 100_000
+MODELS = ('group', 'post', 'comment', 'follow')
+
+EXPORT_FIELDS = {
+    'group': ('title', 'slug', 'description'),
+    'post': ('id', 'text', 'pub_date', 'author__username', 'group__slug',
+             'image', 'image_width', 'image_height', 'image_placeholder'),
+    'comment': ('id', 'post_id', 'text', 'created', 'author__username'),
+    'follow': ('user__username', 'author__username'),
+}
+QUERYSETS = {
+    'group': lambda: Group.objects.order_by('pk'),
+    'post': lambda: Post.objects.order_by('pk'),
+    'comment': lambda: Comment.objects.order_by('pk'),
+    'follow': lambda: Follow.objects.order_by('pk'),
+}
+
+
+class Encoder(DjangoJSONEncoder):
+    """DjangoJSONEncoder обрезает время до миллисекунд, а после переноса
+    порядок записей с одинаковой секундой должен сохраниться."""
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+ENCODER = Encoder(ensure_ascii=False)
+
+
+def open_file(path, mode):
+    """Открывает файл выгрузки, при расширении .gz - со сжатием."""
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def progress(rows, start):
+    elapsed = time.perf_counter() - start
+    return (f'{rows} строк, {rows / elapsed if elapsed else 0:.0f} строк/с, '
+            f'пиковый RSS {peak_rss() / 1024:.1f} МБ')
+
+
+def export_records(models=MODELS, batch_size=BATCH_SIZE):
+    """Объекты для выгрузки по одному, без загрузки таблиц в память."""
+    for model in MODELS:
+        if model not in models:
+            continue
+        fields = EXPORT_FIELDS[model]
+        rows = QUERYSETS[model]().values_list(*fields)
+        for row in rows.iterator(chunk_size=batch_size):
+            yield {'model': model, 'fields': dict(zip(fields, row))}
+
+
+def dump_line(record):
+    return ENCODER.encode(record) + '\n'
+
+
+def copy_image(name, source_storage, media_dir):
+    """Копирует файл изображения в каталог выгрузки, если его там нет.
+
+    Имена в хранилище строятся по хешу содержимого, поэтому одинаковый
+    файл копируется один раз.
+    """
+    target = os.path.join(media_dir, name)
+    if os.path.exists(target) or not source_storage.exists(name):
+        return False
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with source_storage.open(name) as source, open(target, 'wb') as output:
+        shutil.copyfileobj(source, output)
+    return True
+
+
+@contextmanager
+def keep_dates():
+    """bulk_create подставляет текущее время в поля с auto_now_add, а при
+    загрузке нужны даты из файла."""
+    fields = [Post._meta.get_field('pub_date'),
+              Comment._meta.get_field('created')]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class Importer:
+    """Загружает строки файла пачками по batch_size через bulk_create.
+
+    В памяти держится только текущая пачка. Недостающие пользователи
+    создаются с непригодным для входа паролем, существующие строки (по
+    id, slug или паре подписки) не перезаписываются. Запись или
+    комментарий с занятым id пропускается, только если в базе под этим
+    id та же строка (тот же автор и дата), иначе ValueError.
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE, media_dir=None):
+        self.batch_size = batch_size
+        self.media_dir = media_dir
+        self.storage = Post.image.field.storage
+        self.model = None
+        self.batch = []
+        self.counts = dict.fromkeys(MODELS, 0)
+        self.skipped = 0
+
+    def add(self, line):
+        record = json.loads(line)
+        model = record['model']
+        if model not in MODELS:
+            raise ValueError(f'Неизвестная модель: {model}')
+        if model != self.model or len(self.batch) >= self.batch_size:
+            self.flush()
+            self.model = model
+        self.batch.append(record['fields'])
+
+    def flush(self):
+        if not self.batch:
+            return
+        with transaction.atomic(), keep_dates():
+            getattr(self, f'_load_{self.model}')(self.batch)
+        self.counts[self.model] += len(self.batch)
+        self.batch = []
+
+    def finish(self):
+        self.flush()
+        statements = connection.ops.sequence_reset_sql(
+            no_style(), [Group, Post, Comment, Follow])
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+        return self.counts
+
+    def _user_ids(self, usernames):
+        usernames = set(usernames)
+        User.objects.bulk_create(
+            [User(username=username, password=make_password(None))
+             for username in usernames],
+            ignore_conflicts=True,
+        )
+        return dict(User.objects.filter(
+            username__in=usernames).values_list('username', 'pk'))
+
+    def _check_ids(self, model, rows, date_field, users):
+        # Иначе строка из файла молча потерялась бы, а комментарии к ней
+        # достались бы чужой записи с тем же id.
+        existing = {
+            pk: (author_id, date)
+            for pk, author_id, date in model.objects.filter(
+                pk__in=[row['id'] for row in rows]
+            ).values_list('pk', 'author_id', date_field)
+        }
+        for row in rows:
+            expected = (users[row['author__username']],
+                        parse_datetime(row[date_field]))
+            if existing.get(row['id'], expected) != expected:
+                raise ValueError(
+                    f'{model._meta.model_name} id={row["id"]} уже занят '
+                    f'другой строкой базы')
+
+    def _image(self, name):
+        if not name:
+            return name
+        parts = name.replace('\\', '/').split('/')
+        if os.path.isabs(name) or name.startswith('/') or '..' in parts:
+            raise ValueError(f'Недопустимое имя изображения: {name}')
+        if not self.media_dir:
+            return name
+        path = os.path.join(self.media_dir, name)
+        if not os.path.exists(path):
+            return name
+        # Имя в хранилище заново строится из upload_to и хеша содержимого,
+        # как при обычной загрузке.
+        field = Post._meta.get_field('image')
+        with open(path, 'rb') as content:
+            return self.storage.save(
+                field.generate_filename(None, os.path.basename(name)),
+                File(content))
+
+    def _load_group(self, rows):
+        Group.objects.bulk_create(
+            [Group(**row) for row in rows], ignore_conflicts=True)
+
+    def _load_post(self, rows):
+        users = self._user_ids(row['author__username'] for row in rows)
+        groups = dict(Group.objects.filter(
+            slug__in={row['group__slug'] for row in rows}
+        ).values_list('slug', 'pk'))
+        self._check_ids(Post, rows, 'pub_date', users)
+        Post.objects.bulk_create([
+            Post(
+                id=row['id'],
+                text=row['text'],
+                pub_date=parse_datetime(row['pub_date']),
+                author_id=users[row['author__username']],
+                group_id=groups.get(row['group__slug']),
+                image=self._image(row['image']),
+                image_width=row['image_width'],
+                image_height=row['image_height'],
+                image_placeholder=row['image_placeholder'],
+            )
+            for row in rows
+        ], ignore_conflicts=True)
+
+    def _load_comment(self, rows):
+        users = self._user_ids(row['author__username'] for row in rows)
+        # Частичная копия может содержать комментарии к записям, которых
+        # нет ни в файле, ни в базе; такие комментарии пропускаются.
+        post_ids = set(Post.objects.filter(
+            pk__in={row['post_id'] for row in rows}
+        ).values_list('pk', flat=True))
+        self.skipped += sum(row['post_id'] not in post_ids for row in rows)
+        self._check_ids(Comment, rows, 'created', users)
+        Comment.objects.bulk_create([
+            Comment(
+                id=row['id'],
+                post_id=row['post_id'],
+                text=row['text'],
+                created=parse_datetime(row['created']),
+                author_id=users[row['author__username']],
+            )
+            for row in rows
+            if row['post_id'] in post_ids
+        ], ignore_conflicts=True)
+
+    def _load_follow(self, rows):
+        users = self._user_ids(
+            username for row in rows
+            for username in (row['user__username'], row['author__username']))
+        Follow.objects.bulk_create([
+            Follow(user_id=users[row['user__username']],
+                   author_id=users[row['author__username']])
+            for row in rows
+        ], ignore_conflicts=True)
@@ -11,10 +11,12 @@ urlpatterns = [
     path('group/<slug:slug>/', views.group_posts, name='group'),
     path('new/', views.new_post, name='new_post'),
     path('follow/', views.follow_index, name='follow_index'),
+    path('search/', views.search, name='search'),
     path('<str:username>/follow/', views.profile_follow, name='profile_follow'), # noqa
     path('<str:username>/unfollow/', views.profile_unfollow, name='profile_unfollow'), # noqa
     path('<str:username>/', views.profile, name='profile'),
     path('<str:username>/<int:post_id>/', views.post_view, name='post'),
+    path('<str:username>/<int:post_id>/comments/', views.comments, name='comments'), # noqa
     path('<str:username>/<int:post_id>/edit/', views.post_edit, name='post_edit'), # noqa
     path('<str:username>/<int:post_id>/del/', views.post_del, name='post_del'), # noqa
     path('<str:username>/<int:post_id>/comment/', views.add_comment, name='add_comment'), # noqa
@@ -1,17 +1,71 @@
+from django.conf import settings
+from django.core.cache import cache
 from django.core.paginator import Paginator
 
 from posts.models import Follow
+from posts.paginators import (
+    COMMENTS_ORDERING, POSTS_ORDERING, CursorPaginator)
 
+FOLLOWEES_KEY = 'followees:{}'
+COMMENTS_PER_PAGE = 20
 
-def get_page(request, object_list, per_page=10):
+
+def get_page(request, object_list, per_page=10, cursor=False,
+             ordering=POSTS_ORDERING):
+    if cursor:
+        cursor_paginator = CursorPaginator(object_list, per_page, ordering)
+        token = request.GET.get('cursor')
+        if token:
+            page = cursor_paginator.get_page(token)
+            request.page_size = len(page)
+            return page
+        if not request.GET.get('page'):
+            # Первая страница без COUNT(*); Paginator по всей выборке
+            # нужен только для явного ?page=N.
+            page = cursor_paginator.first_page()
+            request.page_size = len(page)
+            return page
+        object_list = cursor_paginator.object_list
     page_number = request.GET.get('page')
     paginator = Paginator(object_list, per_page)
     page = paginator.get_page(page_number)
+    if cursor:
+        cursor_paginator.annotate(page)
+    request.page_size = len(page)
     return page
 
 
-def is_follow(user, author_username):
-    return Follow.objects.filter(
-        user__username=user,
-        author__username=author_username,
-    ).exists()
+def get_comments_page(request, post, first=None):
+    """Очередная порция комментариев записи по курсору из ?cursor=.
+
+    first - комментарий, который нужно показать первым (редактируемый).
+    """
+    paginator = CursorPaginator(
+        post.comments.select_related('author'), COMMENTS_PER_PAGE,
+        COMMENTS_ORDERING)
+    if first is not None:
+        page = paginator.get_page(paginator.encode_cursor(first))
+        page.object_list.insert(0, first)
+        return page
+    return paginator.get_page(request.GET.get('cursor'))
+
+
+def get_followee_ids(user):
+    """Множество id авторов, на которых подписан пользователь."""
+    if not user.is_authenticated:
+        return frozenset()
+    key = FOLLOWEES_KEY.format(user.pk)
+    followee_ids = cache.get(key)
+    if followee_ids is None:
+        followee_ids = frozenset(Follow.objects.filter(
+            user_id=user.pk).values_list('author_id', flat=True))
+        cache.set(key, followee_ids, settings.FOLLOWEES_CACHE_TIMEOUT)
+    return followee_ids
+
+
+def invalidate_followees(user_id):
+    cache.delete(FOLLOWEES_KEY.format(user_id))
+
+
+def is_follow(user, author):
+    return author.pk in get_followee_ids(user)
@@ -1,18 +1,25 @@
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
+from django.db import transaction
 from django.shortcuts import get_object_or_404, redirect, render
 from django.views.decorators.http import require_POST
 
+from posts import thumbnails
+from posts.cache import cache_anonymous_page, conditional_page
 from posts.forms import CommentForm, PostForm
 from posts.models import Comment, Follow, Group, Post
-from posts.utils import get_page, is_follow
+from posts.search import search_posts
+from posts.timeline import TIMELINE_ORDERING, get_feed
+from posts.utils import get_comments_page, get_page, is_follow
 
 User = get_user_model()
 
 
+@cache_anonymous_page
 def index(request):
     post_list = Post.objects.select_related('group', 'author')
-    page = get_page(request, post_list)
+    page = get_page(request, post_list, cursor=True)
+    thumbnails.resolve(page.object_list)
     context = {
         'page': page,
         'paginator': page.paginator,
@@ -21,53 +28,88 @@ def index(request):
     return render(request, 'posts/index.html', context)
 
 
+@conditional_page
+@cache_anonymous_page
 def group_posts(request, slug):
-    group = get_object_or_404(
-        Group.objects.prefetch_related('posts'),
-        slug=slug,
-    )
+    group = get_object_or_404(Group, slug=slug)
     post_list = group.posts.select_related('author')
-    page = get_page(request, post_list)
+    page = get_page(request, post_list, cursor=True)
+    thumbnails.resolve(page.object_list)
     context = {
         'group': group,
+        'posts_count': group.posts.count(),
         'page': page,
         'paginator': page.paginator,
     }
     return render(request, 'posts/group.html', context)
 
 
+@cache_anonymous_page
+def search(request):
+    query = request.GET.get('q', '').strip()
+    page = get_page(request, search_posts(query))
+    thumbnails.resolve(page.object_list)
+    context = {
+        'query': query,
+        'page': page,
+        'paginator': page.paginator,
+    }
+    return render(request, 'posts/search.html', context)
+
+
+@conditional_page
+@cache_anonymous_page
 def profile(request, username):
     author = get_object_or_404(
-        User.objects.prefetch_related('posts'),
+        User.objects.select_related('stats'),
         username=username,
     )
-    post_list = author.posts.prefetch_related('comments')
-    page = get_page(request, post_list)
+    post_list = author.posts.select_related('author', 'group')
+    page = get_page(request, post_list, cursor=True)
+    thumbnails.resolve(page.object_list)
     context = {
         'author': author,
         'page': page,
         'paginator': page.paginator,
-        'is_follow': is_follow(request.user, username),
+        'is_follow': is_follow(request.user, author),
     }
     return render(request, 'posts/profile.html', context)
 
 
+@conditional_page
+@cache_anonymous_page
 def post_view(request, username, post_id):
     post = get_object_or_404(
-        Post.objects.select_related('author', 'group'),
+        Post.objects.select_related('author__stats', 'group'),
         id=post_id,
         author__username=username,
     )
-    comments = post.comments.select_related('author')
+    thumbnails.resolve([post])
     context = {
         'post': post,
-        'comments': comments,
-        'is_follow': is_follow(request.user, username),
+        'comments': get_comments_page(request, post),
+        'is_follow': is_follow(request.user, post.author),
     }
     return render(request, 'posts/post.html', context)
 
 
+@cache_anonymous_page
+def comments(request, username, post_id):
+    """HTML следующей порции комментариев для кнопки «Показать ещё»."""
+    post = get_object_or_404(
+        Post.objects.select_related('author'),
+        id=post_id,
+        author__username=username,
+    )
+    context = {
+        'post': post,
+        'comments': get_comments_page(request, post),
+    }
+    return render(request, 'includes/comment_list.html', context)
+
+
 @login_required
+@transaction.atomic
 def new_post(request):
     form = PostForm(request.POST or None, files=request.FILES or None)
     if form.is_valid():
@@ -108,6 +150,7 @@ def post_edit(request, username, post_id):
 
 @require_POST
 @login_required
+@transaction.atomic
 def post_del(request, username, post_id):
     post = get_object_or_404(
         Post.objects.select_related('author'),
@@ -123,13 +166,14 @@ def post_del(request, username, post_id):
 
 
 @login_required
+@transaction.atomic
 def add_comment(request, username, post_id):
     post = get_object_or_404(
-        Post.objects.select_related('author', 'group'),
+        Post.objects.select_related('author__stats', 'group'),
         id=post_id,
         author__username=username,
     )
-    comments = post.comments.select_related('author')
+    thumbnails.resolve([post])
     form = CommentForm(request.POST or None)
     if form.is_valid():
         form.instance.author = request.user
@@ -140,8 +184,8 @@ def add_comment(request, username, post_id):
         'form': form,
         'post': post,
         'author': post.author,
-        'comments': comments,
-        'is_follow': is_follow(request.user, username),
+        'comments': get_comments_page(request, post),
+        'is_follow': is_follow(request.user, post.author),
     }
     return render(request, 'posts/post.html', context)
 
@@ -149,12 +193,13 @@ def add_comment(request, username, post_id):
 @login_required
 def comment_edit(request, username, post_id, comment_id):
     post = get_object_or_404(
-        Post.objects.select_related('author', 'group'),
+        Post.objects.select_related('author__stats', 'group'),
         id=post_id,
         author__username=username,
     )
-    comments = post.comments.select_related('author')
-    comment = get_object_or_404(comments, post=post, id=comment_id)
+    thumbnails.resolve([post])
+    comment = get_object_or_404(
+        post.comments.select_related('author'), id=comment_id)
 
     if request.user == comment.author:
         form = CommentForm(
@@ -168,8 +213,8 @@ def comment_edit(request, username, post_id, comment_id):
             'form': form,
             'post': post,
             'comment_id': comment_id,
-            'comments': comments,
-            'is_follow': is_follow(request.user, username),
+            'comments': get_comments_page(request, post, first=comment),
+            'is_follow': is_follow(request.user, post.author),
         }
         return render(request, 'posts/post.html', context)
     return redirect('posts:post', username=username, post_id=post_id)
@@ -177,6 +222,7 @@ def comment_edit(request, username, post_id, comment_id):
 
 @require_POST
 @login_required
+@transaction.atomic
 def comment_del(request, username, post_id, comment_id):
     comment = get_object_or_404(
         Comment.objects.select_related('author'),
@@ -190,9 +236,9 @@ def comment_del(request, username, post_id, comment_id):
 
 @login_required
 def follow_index(request):
-    post_list = Post.objects.filter(
-        author__following__user=request.user).select_related('author', 'group')
-    page = get_page(request, post_list)
+    feed = get_feed(request.user)
+    page = get_page(request, feed, cursor=True, ordering=TIMELINE_ORDERING)
+    thumbnails.resolve([entry.post for entry in page.object_list])
     context = {
         'page': page,
         'paginator': page.paginator,
@@ -202,6 +248,7 @@ def follow_index(request):
 
 
 @login_required
+@transaction.atomic
 def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
     if not author == request.user:
@@ -213,6 +260,7 @@ def profile_follow(request, username):
 
 
 @login_required
+@transaction.atomic
 def profile_unfollow(request, username):
     author = get_object_or_404(User, username=username)
     follow = Follow.objects.filter(user=request.user, author=author)
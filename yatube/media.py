@@ -0,0 +1,145 @@
+import mimetypes
+import os
+import posixpath
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import (FileResponse, Http404, HttpResponse,
+                         HttpResponseNotModified, StreamingHttpResponse)
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+# Имена из хеша содержимого (производные, кеш sorl) никогда не меняются.
+HASHED_NAME = re.compile(r'^[0-9a-f]{20,}\.\w+$')
+HASHED_MAX_AGE = 365 * 24 * 60 * 60
+MAX_AGE = 60 * 60
+CHUNK_SIZE = 64 * 1024
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def _etag(path, stat):
+    name = posixpath.basename(path)
+    if HASHED_NAME.match(name):
+        return f'"{name.split(".")[0]}"'
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def _cache_headers(response, path, etag, stat):
+    hashed = HASHED_NAME.match(posixpath.basename(path))
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    if hashed:
+        response['Cache-Control'] = (
+            f'public, max-age={HASHED_MAX_AGE}, immutable')
+    else:
+        response['Cache-Control'] = f'public, max-age={MAX_AGE}'
+    return response
+
+
+def _not_modified(request, etag, stat):
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        etags = parse_etags(if_none_match)
+        return '*' in etags or etag in etags
+    since = parse_http_date_safe(request.headers.get('If-Modified-Since'))
+    return since is not None and int(stat.st_mtime) <= since
+
+
+def _byte_range(request, etag, size):
+    """(start, end) для одного диапазона из Range, None без него и
+    False для неудовлетворимого диапазона."""
+    header = request.headers.get('Range')
+    if not header:
+        return None
+    if_range = request.headers.get('If-Range')
+    if if_range is not None and if_range != etag:
+        return None
+    match = RANGE.match(header.strip())
+    if match is None:
+        # Несколько диапазонов не поддерживаем, отдаём файл целиком.
+        return None
+    start, end = match.groups()
+    if not start:
+        if not end or not int(end):
+            return False
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start = int(start)
+        end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def _read(file, length):
+    with file:
+        while length > 0:
+            chunk = file.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def _stream(request, fullpath, content_type, etag, stat):
+    byte_range = _byte_range(request, etag, stat.st_size)
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{stat.st_size}'
+        return response
+    if byte_range is None:
+        response = FileResponse(
+            open(fullpath, 'rb'), content_type=content_type)
+    else:
+        start, end = byte_range
+        file = open(fullpath, 'rb')
+        file.seek(start)
+        response = StreamingHttpResponse(
+            _read(file, end - start + 1), status=206,
+            content_type=content_type)
+        response['Content-Length'] = end - start + 1
+        response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+@require_safe
+def serve(request, path):
+    """Отдаёт файлы из MEDIA_ROOT без DEBUG.
+
+    В режиме MEDIA_DELIVERY = 'x-accel' или 'x-sendfile' Django только
+    проверяет путь и условные заголовки, а передачу файла выполняет
+    фронтовый сервер. В режиме 'stream' файл отдаётся FileResponse с
+    поддержкой ETag, If-None-Match и Range.
+    """
+    try:
+        fullpath = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    try:
+        stat = os.stat(fullpath)
+    except OSError:
+        raise Http404
+    if not os.path.isfile(fullpath):
+        raise Http404
+    etag = _etag(path, stat)
+    if _not_modified(request, etag, stat):
+        return _cache_headers(HttpResponseNotModified(), path, etag, stat)
+    content_type, encoding = mimetypes.guess_type(fullpath)
+    content_type = content_type or 'application/octet-stream'
+    mode = settings.MEDIA_DELIVERY
+    if mode == 'x-accel':
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = quote(
+            settings.MEDIA_ACCEL_PREFIX.rstrip('/') + '/' + path)
+    elif mode == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = fullpath
+    else:
+        response = _stream(request, fullpath, content_type, etag, stat)
+    if encoding:
+        response['Content-Encoding'] = encoding
+    return _cache_headers(response, path, etag, stat)
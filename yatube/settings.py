@@ -1,4 +1,5 @@
 import os
+import sys
 from pathlib import Path
 
 import environ
@@ -39,9 +40,13 @@ INTERNAL_IPS = [
 ]
 
 MIDDLEWARE = [
+    'posts.middleware.QueryBudgetMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    # Снаружи сессий, чтобы сохранение сессии при входе тоже считалось
+    # записью.
+    'posts.middleware.ReplicaMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -77,6 +82,28 @@ DATABASES = {
     }
 }
 
+# Реплики только для чтения: адреса баз через запятую, например
+# DATABASE_REPLICAS=sqlite:///replica1.sqlite3,sqlite:///replica2.sqlite3.
+# Файлы SQLite открываются только на чтение; в тестах реплики совпадают
+# с основной базой.
+REPLICA_DATABASES = []
+for number, url in enumerate(env.list('DATABASE_REPLICAS', default=[]), 1):
+    replica = env.db_url_config(url)
+    if replica['ENGINE'] == 'django.db.backends.sqlite3':
+        replica['NAME'] = f'file:{replica["NAME"]}?mode=ro'
+        replica['OPTIONS'] = {'uri': True}
+    replica['TEST'] = {'MIRROR': 'default'}
+    DATABASES[f'replica{number}'] = replica
+    REPLICA_DATABASES.append(f'replica{number}')
+
+DATABASE_ROUTERS = ['posts.replicas.ReplicaRouter']
+REPLICA_VIEWS = [
+    'posts:index', 'posts:group', 'posts:follow_index', 'posts:profile',
+    'posts:post', 'posts:comments', 'posts:search',
+]
+REPLICA_PIN_SECONDS = env.int('REPLICA_PIN_SECONDS', default=10)
+REPLICA_CHECK_INTERVAL = env.int('REPLICA_CHECK_INTERVAL', default=5)
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -92,11 +119,38 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
-}
+TESTING = sys.argv[1:2] == ['test'] or 'pytest' in sys.modules
+
+# Версии страниц, счётчики кеша и очередь миниатюр должны быть общими
+# для всех процессов сервера и для manage.py metrics, поэтому по
+# умолчанию кеш в Redis. locmem:// годится только для тестов и
+# однопроцессного запуска; другие варианты: pymemcache://host:11211,
+# dbcache://cache_table (после manage.py createcachetable).
+CACHE_URL = env(
+    'CACHE_URL',
+    default='locmem://' if TESTING else 'redis://127.0.0.1:6379/1')
+if CACHE_URL.startswith('locmem://'):
+    CACHES = {'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+elif CACHE_URL.startswith(('redis://', 'rediss://')):
+    CACHES = {'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': CACHE_URL}}
+elif CACHE_URL.startswith('pymemcache://'):
+    CACHES = {'default': {
+        'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+        'LOCATION': CACHE_URL[len('pymemcache://'):]}}
+else:
+    CACHES = {'default': env.cache_url_config(CACHE_URL)}
+
+PAGE_CACHE_TIMEOUT = env.int('PAGE_CACHE_TIMEOUT', default=300)
+FOLLOWEES_CACHE_TIMEOUT = env.int('FOLLOWEES_CACHE_TIMEOUT', default=3600)
+
+QUERY_BUDGET_ENABLED = env.bool('QUERY_BUDGET', default=False)
+QUERY_BUDGET_DIR = env(
+    'QUERY_BUDGET_DIR', default=os.path.join(BASE_DIR, 'metrics'))
+QUERY_BUDGET_FLUSH = env.int('QUERY_BUDGET_FLUSH', default=10)
+QUERY_BUDGET_WINDOWS = env.int('QUERY_BUDGET_WINDOWS', default=60)
 
 LANGUAGE_CODE = 'ru'
 
@@ -114,8 +168,34 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Загрузки больше этого размера пишутся во временный файл, а не в память.
+FILE_UPLOAD_MAX_MEMORY_SIZE = env.int(
+    'FILE_UPLOAD_MAX_MEMORY_SIZE', default=256 * 1024)
+IMAGE_MAX_PIXELS = env.int('IMAGE_MAX_PIXELS', default=50_000_000)
+# PNG, WebP и GIF нельзя декодировать в уменьшенном масштабе, как JPEG:
+# 16 Мпикс в RGBA - около 64 МБ памяти на загрузку.
+IMAGE_MAX_DECODED_PIXELS = env.int(
+    'IMAGE_MAX_DECODED_PIXELS', default=16_000_000)
+IMAGE_MAX_SIDE = env.int('IMAGE_MAX_SIDE', default=2560)
+# Файл изображения без ссылок удаляется, только если его не брали столько
+# секунд: загрузка того же содержимого могла ещё не закоммитить запись.
+# Пропущенные файлы удаляет manage.py sweep_images.
+IMAGE_RELEASE_GRACE = env.int('IMAGE_RELEASE_GRACE', default=3600)
+
+# stream, x-accel (nginx) или x-sendfile (apache, lighttpd)
+MEDIA_DELIVERY = env('MEDIA_DELIVERY', default='stream')
+MEDIA_ACCEL_PREFIX = env('MEDIA_ACCEL_PREFIX', default='/protected-media/')
+
 LOGIN_URL = '/auth/login/'
 LOGIN_REDIRECT_URL = 'posts:index'
 
+THUMBNAIL_WORKERS = env.int('THUMBNAIL_WORKERS', default=2)
+
+TIMELINE_DEPTH = env.int('TIMELINE_DEPTH', default=1000)
+TIMELINE_PULL_THRESHOLD = env.int('TIMELINE_PULL_THRESHOLD', default=10000)
+# Потоки, возвращающие авторов к раскладке по лентам (см.
+# posts.timeline.switch_to_push); 0 - сразу после коммита в том же потоке.
+TIMELINE_WORKERS = env.int('TIMELINE_WORKERS', default=1)
+
 EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
@@ -3,7 +3,8 @@ from django.conf.urls import handler404, handler500
 from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import include, path
-from django.views.static import serve as media_serve
+
+from yatube.media import serve as media_serve
 
 
 urlpatterns = [
@@ -26,4 +27,4 @@ if settings.DEBUG:
     urlpatterns += (path('__debug__/', include(debug_toolbar.urls)),)
 
 if not settings.DEBUG:
-    urlpatterns.append(path('media/<path:path>', media_serve, {'document_root': settings.MEDIA_ROOT}))
+    urlpatterns.append(path('media/<path:path>', media_serve))